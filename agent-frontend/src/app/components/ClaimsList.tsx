@@ -10,13 +10,45 @@ export default function ClaimsList() {
     const [claims, setClaims] = useState<Claim[]>([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
-    const [needsAttentionClaims, setNeedsAttentionClaims] = useState<Claim[]>([]);
-    const [pendingClaims, setPendingClaims] = useState<Claim[]>([]);
-    const [reviewingClaims, setReviewingClaims] = useState<Claim[]>([]);
-    const [deniedClaims, setDeniedClaims] = useState<Claim[]>([]);
-    const [approvedClaims, setApprovedClaims] = useState<Claim[]>([]);
 
     useEffect(() => {
+        let active = true;
+
+        // Apply claim changes from the change feed until the component unmounts
+        const followChanges = async (token: string, cursor: number) => {
+            while (active) {
+                try {
+                    const response: any = await axios.get('/api/changes', {
+                        headers: {
+                            Authorization: `Bearer ${token}`,
+                        },
+                        params: {
+                            since: cursor,
+                            wait: 25,
+                        },
+                    });
+                    cursor = response.data.cursor;
+                    const updates = response.data.changes.filter((change: any) => change.entity === 'claim');
+                    if (active && updates.length > 0) {
+                        setClaims((current) => {
+                            const byId = new Map(current.map((claim) => [claim.id, claim]));
+                            updates.forEach((change: any) => byId.set(change.entity_id, { ...byId.get(change.entity_id), ...change.data }));
+                            return Array.from(byId.values());
+                        });
+                    }
+                } catch (error: any) {
+                    if (error.response?.status === 410) {
+                        // The feed no longer reaches back to our cursor
+                        if (active) {
+                            fetchClaims();
+                        }
+                        return;
+                    }
+                    await new Promise((resolve) => setTimeout(resolve, 5000));
+                }
+            }
+        };
+
         const fetchClaims = async () => {
             const token = localStorage.getItem('jwtToken');
             if (!token) {
@@ -24,19 +56,32 @@ export default function ClaimsList() {
             }
 
             try {
-                const response = await axios.get('/api/claims', {
+                // Take the feed cursor before listing, so changes made while
+                // paging through the claims are replayed afterwards
+                const head: any = await axios.get('/api/changes', {
                     headers: {
                         Authorization: `Bearer ${token}`,
                     },
                 });
-                const fetchedClaims = response.data;
+                let fetchedClaims: Claim[] = [];
+                let cursor: string | null = null;
+                do {
+                    const response: any = await axios.get('/api/claims', {
+                        headers: {
+                            Authorization: `Bearer ${token}`,
+                        },
+                        params: {
+                            limit: 200,
+                            cursor: cursor || undefined,
+                            fields: 'id,claim_date,damage_date,date_of_repair,status,internal_status',
+                        },
+                    });
+                    fetchedClaims = fetchedClaims.concat(response.data.claims);
+                    cursor = response.data.next_cursor;
+                } while (cursor);
                 setClaims(fetchedClaims);
-                setNeedsAttentionClaims(fetchedClaims.filter((claim: Claim) => claim.internal_status === '2nd Level Review'));
-                setPendingClaims(fetchedClaims.filter((claim: Claim) => claim.status === 'Pending'));
-                setReviewingClaims(fetchedClaims.filter((claim: Claim) => claim.internal_status === 'Reviewing'));
-                setDeniedClaims(fetchedClaims.filter((claim: Claim) => claim.status === 'Denied'));
-                setApprovedClaims(fetchedClaims.filter((claim: Claim) => claim.status === 'Approved'));
                 setLoading(false);
+                followChanges(token, head.data.cursor);
             } catch (error: any) {
                 setError(error.response?.data?.message || 'Failed to fetch claims');
                 setLoading(false);
@@ -44,8 +89,16 @@ export default function ClaimsList() {
         };
 
         fetchClaims();
+        return () => {
+            active = false;
+        };
     }, []);
 
+    const needsAttentionClaims = claims.filter((claim: Claim) => claim.internal_status === '2nd Level Review');
+    const pendingClaims = claims.filter((claim: Claim) => claim.status === 'Pending');
+    const reviewingClaims = claims.filter((claim: Claim) => claim.internal_status === 'Reviewing');
+    const deniedClaims = claims.filter((claim: Claim) => claim.status === 'Denied');
+    const approvedClaims = claims.filter((claim: Claim) => claim.status === 'Approved');
 
 
     if (loading) {
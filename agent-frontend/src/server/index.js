@@ -28,7 +28,7 @@ app.post('/api/login', async (req, res) => {
 });
 
 app.get('/api/claims', async (req, res) => {
-    const { status } = req.query;
+    const { status, limit, cursor, fields } = req.query;
     const token = req.headers.authorization.split(' ')[1];
     try {
         const response = await axios.get(`${server_url}/claims`, {
@@ -37,6 +37,9 @@ app.get('/api/claims', async (req, res) => {
             },
             params: {
                 status,
+                limit,
+                cursor,
+                fields,
             },
         });
 
@@ -120,4 +123,31 @@ app.get('/api/claims/:id/policy', async (req, res) => {
     }
 });
 
+app.get('/api/changes', async (req, res) => {
+    const { since, wait, limit } = req.query;
+    const token = req.headers.authorization.split(' ')[1];
+
+    try {
+        const response = await axios.get(`${server_url}/changes`, {
+            headers: {
+                Authorization: `Bearer ${token}`,
+            },
+            params: {
+                since,
+                wait,
+                limit,
+            },
+        });
+
+        res.json(response.data);
+    } catch (error) {
+        // 410 tells the client to reload the claims and resume from the returned cursor
+        if (error.response && error.response.status === 410) {
+            return res.status(410).json(error.response.data);
+        }
+        console.error('Error fetching changes:', error.response ? error.response.data : error.message);
+        res.status(500).json({ message: 'Error fetching changes' });
+    }
+});
+
 module.exports = app;
\ No newline at end of file
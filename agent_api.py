@@ -1,25 +1,78 @@
 import sqlite3
-import hashlib
 import os
-
-from flask import Flask, request, jsonify, send_from_directory
-from flask_restx import Api, Resource, fields
+import json
+import hashlib
+import math
+import time
+import base64
+import binascii
+
+from flask import Flask, Response, request, send_file
+from werkzeug.utils import secure_filename
+from flask_restx import Api, Resource, fields, marshal
 from flask_jwt_extended import (
-    JWTManager,
     jwt_required,
     create_access_token,
-    get_jwt_identity,
 )
-from functools import wraps
 from datetime import timedelta, datetime
 
+from auth import admin_required, init_jwt
+from db import get_db, pool, init_app as init_db, start_checkpointer
+from invoices import store as invoice_store
+from changes import (
+    CHANGES_MAX_WAIT,
+    CHANGES_PAGE_SIZE,
+    is_pruned,
+    latest_seq,
+    notify_changes,
+    record_check_changes,
+    record_claim_change,
+    start_change_pruner,
+    stream_changes,
+    wait_for_changes,
+)
+from checks import (
+    build_checks,
+    create_checks,
+    evaluate_claim_checks,
+    registry as check_registry,
+)
+from metrics import init_request_metrics, logging_stats, query_stats
+from extraction import (
+    cached_fields,
+    extract_and_store,
+    extraction_response,
+    file_sha256,
+    get_extraction,
+    needs_extraction,
+)
+from idempotency import lookup_response, request_fingerprint, store_response
+from passwords import HasherBusy, authenticate, hashing_pool
+
+CLAIMS_PAGE_SIZE = int(os.getenv("CLAIMS_PAGE_SIZE", "50"))
+CLAIMS_MAX_PAGE_SIZE = int(os.getenv("CLAIMS_MAX_PAGE_SIZE", "500"))
+INVOICE_CACHE_MAX_AGE = int(os.getenv("INVOICE_CACHE_MAX_AGE", "86400"))
+# Set to an nginx internal location (e.g. /protected-invoices/) to offload
+# invoice downloads with X-Accel-Redirect
+INVOICE_ACCEL_REDIRECT_PREFIX = os.getenv("INVOICE_ACCEL_REDIRECT_PREFIX", "")
+
 app = Flask(__name__)
 app.config["JWT_SECRET_KEY"] = (
     "your_jwt_secret_key"  # Change this to a random secret key
 )
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=10)
+# Let a fronting server that understands X-Sendfile (Apache, lighttpd) send files
+app.config["USE_X_SENDFILE"] = (
+    os.getenv("INVOICE_X_SENDFILE", "false").lower() == "true"
+)
+# Larger request bodies are rejected with 413 before they are read
+app.config["MAX_CONTENT_LENGTH"] = int(
+    os.getenv("MAX_CONTENT_LENGTH", str(25 * 1024 * 1024))
+)
 
-jwt = JWTManager(app)
+jwt = init_jwt(app)
+init_db(app)
+init_request_metrics(app, "agent")
 
 # Define the servers for the OpenAPI spec
 servers = [
@@ -77,8 +130,15 @@ claim_model = api.model(
         ),
         "internal_status": fields.String(
             required=True,
-            description="Status of the claim (Pending, Reviewing, 2nd Level Review, Approved, Denied)",
-            enum=["Pending", "Reviewing", "2nd Level Review", "Approved", "Denied"],
+            description="Status of the claim (Pending, Scheduled, Reviewing, 2nd Level Review, Approved, Denied)",
+            enum=[
+                "Pending",
+                "Scheduled",
+                "Reviewing",
+                "2nd Level Review",
+                "Approved",
+                "Denied",
+            ],
         ),
         "internal_status_message": fields.String(
             description="Message from the insurance company regarding the claim status"
@@ -89,6 +149,18 @@ claim_model = api.model(
     },
 )
 
+claims_page_model = api.model(
+    "ClaimsPage",
+    {
+        "claims": fields.List(
+            fields.Nested(claim_model), description="Claims on this page"
+        ),
+        "next_cursor": fields.String(
+            description="Cursor for the next page, null on the last page"
+        ),
+    },
+)
+
 check_model = api.model(
     "ClaimProcessingCheck",
     {
@@ -115,6 +187,9 @@ check_model = api.model(
             description="The message detailing the check result"
         ),
         "processed_at": fields.String(description="When the check was processed"),
+        "subject": fields.String(
+            description="The claim, policy or invoice fact the check is evaluated against"
+        ),
     },
 )
 
@@ -221,6 +296,14 @@ combined_policy_model = api.model(
     },
 )
 
+claim_policy_model = api.inherit(
+    "ClaimPolicy",
+    combined_policy_model,
+    {
+        "claim_id": fields.Integer(description="The claim the policy belongs to"),
+    },
+)
+
 check_update_model = api.model(
     "UpdateClaimProcessingCheck",
     {
@@ -238,38 +321,136 @@ check_update_model = api.model(
     },
 )
 
+check_result_model = api.inherit(
+    "ClaimProcessingCheckResult",
+    check_update_model,
+    {
+        "id": fields.Integer(required=True, description="The ID of the check"),
+    },
+)
 
-def admin_required(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        current_user = get_jwt_identity()
-        if current_user["username"] != "admin":
-            return jsonify({"message": "Access forbidden: Admins only"}), 403
-        return fn(*args, **kwargs)
+check_batch_update_model = api.model(
+    "BatchUpdateClaimProcessingChecks",
+    {
+        "checks": fields.List(
+            fields.Nested(check_result_model),
+            required=True,
+            description="Results to record, one per check",
+        ),
+    },
+)
 
-    return wrapper
+check_summary_model = api.model(
+    "ClaimProcessingCheckSummary",
+    {
+        "total": fields.Integer(description="Number of checks for the claim"),
+        "pending": fields.Integer(description="Number of pending checks"),
+        "passed": fields.Integer(description="Number of passed checks"),
+        "failed": fields.Integer(description="Number of failed checks"),
+        "updated": fields.Integer(
+            description="Number of checks updated by a batch update"
+        ),
+    },
+)
 
+change_model = api.model(
+    "ClaimChange",
+    {
+        "seq": fields.Integer(description="Position of the change in the feed"),
+        "entity": fields.String(description="What changed", enum=["claim", "check"]),
+        "entity_id": fields.Integer(description="ID of the claim or check"),
+        "claim_id": fields.Integer(description="The claim the change belongs to"),
+        "data": fields.Raw(description="The claim or check after the change"),
+        "created_at": fields.String(description="When the change was recorded"),
+    },
+)
 
-def get_db():
-    conn = sqlite3.connect("insurance.db")
-    conn.set_trace_callback(print)
-    conn.row_factory = sqlite3.Row
-    return conn
+changes_page_model = api.model(
+    "ClaimChangesPage",
+    {
+        "changes": fields.List(fields.Nested(change_model)),
+        "cursor": fields.Integer(
+            description="Sequence of the last change returned; pass as since"
+        ),
+    },
+)
 
+invoice_facts_model = api.model(
+    "InvoiceFacts",
+    {
+        "invoice_date": fields.String(description="Date on the invoice"),
+        "invoice_total": fields.Float(description="Total invoiced cost"),
+        "invoice_license_plate": fields.String(
+            description="License plate of the vehicle named on the invoice"
+        ),
+        "invoice_customer_name": fields.String(
+            description="Customer name on the invoice"
+        ),
+        "invoice_policy_number": fields.String(
+            description="Policy number quoted on the invoice"
+        ),
+        "invoice_text": fields.String(description="Full text of the invoice"),
+        "line_items": fields.Raw(
+            description="Invoiced cost per line item kind (labor, adhesive, materials, sensor, calibration); "
+            "a number or a list of numbers. Kinds not on the invoice are left out; "
+            "amounts with ambiguous separators are kept as text."
+        ),
+    },
+)
 
-def hash_password(password):
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+invoice_data_model = api.model(
+    "InvoiceData",
+    {
+        "sha256": fields.String(description="Content hash of the invoice"),
+        "status": fields.String(
+            description="Extraction status",
+            enum=["Pending", "Extracted", "NoText", "Failed"],
+        ),
+        "source": fields.String(
+            description="Where the text came from: text (PDF text layer) or ocr:<backend>"
+        ),
+        "error": fields.String(description="Why extraction failed"),
+        "extracted_at": fields.Float(description="Unix time of the extraction"),
+        "fields": fields.Nested(invoice_facts_model),
+    },
+)
 
+invoice_reference_model = api.model(
+    "InvoiceReference",
+    {
+        "url": fields.String(description="Path of the invoice download endpoint"),
+        "sha256": fields.String(description="Content hash of the invoice"),
+        "size": fields.Integer(description="Size of the invoice in bytes"),
+        "mime_type": fields.String(description="Content type of the invoice"),
+        "filename": fields.String(description="File name the invoice was uploaded as"),
+    },
+)
 
-def admin_required(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        current_user = get_jwt_identity()
-        if current_user["username"] != "admin":
-            return jsonify({"message": "Access forbidden: Admins only"}), 403
-        return fn(*args, **kwargs)
+claim_bundle_model = api.model(
+    "ClaimBundle",
+    {
+        "claim": fields.Nested(claim_model),
+        "policy": fields.Nested(combined_policy_model, allow_null=True),
+        "checks": fields.List(fields.Nested(check_model)),
+        "check_summary": fields.Nested(check_summary_model),
+        "invoice": fields.Nested(invoice_reference_model, allow_null=True),
+        "invoice_data": fields.Nested(invoice_data_model, allow_null=True),
+        "built_at": fields.Float(description="Unix time the bundle was built"),
+    },
+)
 
-    return wrapper
+check_evaluation_model = api.model(
+    "ClaimCheckEvaluation",
+    {
+        "evaluated": fields.Integer(
+            description="Number of checks decided by this evaluation"
+        ),
+        "pending": fields.Integer(
+            description="Number of checks left pending for review"
+        ),
+        "checks": fields.List(fields.Nested(check_model)),
+    },
+)
 
 
 @api.route("/login")
@@ -289,11 +470,14 @@ class AuthResource(Resource):
         """
         conn = get_db()
         data = request.json
-        hashed_password = hash_password(data["password"])
-        user = conn.execute(
-            "SELECT * FROM User WHERE username = ? AND password = ?",
-            (data["username"], hashed_password),
-        ).fetchone()
+        try:
+            user = authenticate(conn, data["username"], data["password"])
+        except HasherBusy:
+            return (
+                {"message": "Too many login attempts, try again shortly"},
+                503,
+                {"Retry-After": "1"},
+            )
 
         if user:
             token_data = {"id": user["id"], "username": user["username"]}
@@ -306,30 +490,90 @@ class AuthResource(Resource):
 @api.route("/claims")
 class ClaimsResource(Resource):
     @jwt_required()
-    @api.doc(params={"status": "Filter claims by status"})
-    @api.marshal_list_with(claim_model)
+    @api.doc(
+        params={
+            "status": "Filter claims by status",
+            "limit": f"Page size (default {CLAIMS_PAGE_SIZE}, max {CLAIMS_MAX_PAGE_SIZE})",
+            "cursor": "The next_cursor returned by the previous page",
+            "fields": "Comma separated list of claim fields to return",
+        }
+    )
+    @api.response(
+        200,
+        "Success; a plain list of claims without limit or cursor",
+        claims_page_model,
+    )
     @admin_required
     def get(self):
         """
-        Get a list of claims, optionally filtered by status.
+        Get claims ordered by claim_date, optionally filtered by status.
+
+        With limit or cursor, returns one page as {"claims", "next_cursor"}.
+        Without either, returns every matching claim as a plain list, as
+        before pagination was added.
         """
         status_filter = request.args.get("status")
-        db = get_db()
+        paginated = "limit" in request.args or "cursor" in request.args
+
+        try:
+            limit = int(request.args.get("limit", CLAIMS_PAGE_SIZE))
+        except ValueError:
+            return {"message": "limit must be an integer"}, 400
+        if limit < 1:
+            return {"message": "limit must be positive"}, 400
+        limit = min(limit, CLAIMS_MAX_PAGE_SIZE)
+
+        selected = list(claim_model.keys())
+        if request.args.get("fields"):
+            selected = [
+                f.strip() for f in request.args["fields"].split(",") if f.strip()
+            ]
+            unknown = [f for f in selected if f not in claim_model]
+            if unknown:
+                return {"message": f"Unknown fields: {', '.join(unknown)}"}, 400
+
+        where, params = [], []
         if status_filter:
-            claims = db.execute(
-                "SELECT * FROM Claims WHERE status = ?", (status_filter,)
-            ).fetchall()
-        else:
-            claims = db.execute("SELECT * FROM Claims").fetchall()
-
-        # Convert the result to a list of dictionaries and transform invoice paths
-        claims_list = [dict(claim) for claim in claims]
-        for claim in claims_list:
-            if claim.get("invoices"):
-                claim["invoices"] = (
-                    f"{request.host_url.rstrip('/')}/claims/{claim['id']}/invoices"
-                )
-        return claims_list
+            where.append("status = ?")
+            params.append(status_filter)
+        if request.args.get("cursor"):
+            try:
+                after = decode_cursor(request.args["cursor"])
+            except ValueError:
+                return {"message": "Invalid cursor"}, 400
+            where.append("(claim_date, id) > (?, ?)")
+            params.extend(after)
+
+        # claim_date and id are always read because they make up the cursor
+        columns = sorted(set(selected) | {"claim_date", "id"})
+        query = f"SELECT {', '.join(columns)} FROM Claims"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY claim_date, id"
+        if paginated:
+            query += " LIMIT ?"
+            params.append(limit + 1)
+
+        db = get_db()
+        rows = db.execute(query, params).fetchall()
+
+        next_cursor = None
+        if paginated and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["claim_date"], rows[-1]["id"])
+
+        claims_list = [dict(claim) for claim in rows]
+        if "invoices" in selected:
+            host_url = request.host_url.rstrip("/")
+            for claim in claims_list:
+                if claim.get("invoices"):
+                    claim["invoices"] = f"{host_url}/claims/{claim['id']}/invoices"
+
+        mask = "{" + ",".join(selected) + "}"
+        claims_list = marshal(claims_list, claim_model, mask=mask)
+        if not paginated:
+            return claims_list
+        return {"claims": claims_list, "next_cursor": next_cursor}
 
 
 @api.route("/claims/<int:id>")
@@ -359,78 +603,108 @@ class ClaimResource(Resource):
     def put(self, id):
         """
         Update a claim by ID. If the status changes to 'Reviewing', create processing checks.
+        Send an Idempotency-Key header to make retries replay the first response.
         """
         db = get_db()
-        claim = db.execute("SELECT * FROM Claims WHERE id = ?", (id,)).fetchone()
-        if not claim:
-            return {"message": "Claim not found"}, 404
-
-        print("Request JSON", request.json)
         updated_data = request.json
-        print("Updated Data", updated_data)
-        print("Type of updated_data", type(updated_data))
-        new_status = updated_data.get("internal_status")
-
-        if (
-            new_status
-            and new_status == "Reviewing"
-            and claim["internal_status"] != "Reviewing"
-        ):
-            updated_data["status"] = "Reviewing"
-            existing_checks = db.execute(
-                "SELECT COUNT(*) FROM ClaimsProcessingChecks WHERE claim_id = ?", (id,)
-            ).fetchone()[0]
-
-            policy_obj = get_policy_processing_object(id)
-            if existing_checks == 0:
-                # Create processing checks
-                checks = get_checks_for_claim(policy_obj)
-                for check in checks:
-                    db.execute(
-                        """
-                        INSERT INTO ClaimsProcessingChecks 
-                        (claim_id, check_name, expected_value, reviewed_value, operator, status, result_message, processed_at)
-                        VALUES (?, ?, ?, ?, ?, 'Pending', NULL, NULL)
-                    """,
-                        (id, check[0], check[1], check[2], check[3]),
-                    )
-
-        # Update the claim with new data
-        db.execute(
-            """
-            UPDATE Claims
-            SET policy_id = ?,
-                claim_date = ?,
-                damage_date = ?,
-                date_of_repair = ?,
-                invoices = ?,
-                status = ?,
-                status_message = ?,
-                internal_status = ?,
-                internal_status_message = ?
-            WHERE id = ?
-            """,
-            (
-                updated_data.get("policy_id", claim["policy_id"]),
-                updated_data.get("claim_date", claim["claim_date"]),
-                updated_data.get("damage_date", claim["damage_date"]),
-                updated_data.get("date_of_repair", claim["date_of_repair"]),
-                claim["invoices"],
-                updated_data.get("status", claim["status"]),
-                updated_data.get("status_message", claim["status_message"]),
-                updated_data.get("internal_status", claim["internal_status"]),
-                updated_data.get(
+
+        idempotency_key = request.headers.get("Idempotency-Key")
+        scope = f"PUT /claims/{id}"
+        fingerprint = request_fingerprint(updated_data)
+
+        # Take the write lock before reading, so concurrent transitions of the
+        # same claim run one after the other and the second sees the first
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if idempotency_key:
+                replay = lookup_response(db, idempotency_key, scope, fingerprint)
+                if replay is not None:
+                    db.rollback()
+                    return replay
+
+            claim = db.execute("SELECT * FROM Claims WHERE id = ?", (id,)).fetchone()
+            if not claim:
+                db.rollback()
+                return {"message": "Claim not found"}, 404
+            new_checks = False
+            new_status = updated_data.get("internal_status")
+
+            if (
+                new_status
+                and new_status == "Reviewing"
+                and claim["internal_status"] != "Reviewing"
+            ):
+                updated_data["status"] = "Reviewing"
+                existing_checks = db.execute(
+                    "SELECT COUNT(*) FROM ClaimsProcessingChecks WHERE claim_id = ?",
+                    (id,),
+                ).fetchone()[0]
+
+                if existing_checks == 0:
+                    # Create processing checks
+                    policy_obj = get_policy_processing_object(id)
+                    create_checks(db, id, get_checks_for_claim(policy_obj))
+                    new_checks = True
+
+            values = {
+                "policy_id": updated_data.get("policy_id", claim["policy_id"]),
+                "claim_date": updated_data.get("claim_date", claim["claim_date"]),
+                "damage_date": updated_data.get("damage_date", claim["damage_date"]),
+                "date_of_repair": updated_data.get(
+                    "date_of_repair", claim["date_of_repair"]
+                ),
+                "status": updated_data.get("status", claim["status"]),
+                "status_message": updated_data.get(
+                    "status_message", claim["status_message"]
+                ),
+                "internal_status": updated_data.get(
+                    "internal_status", claim["internal_status"]
+                ),
+                "internal_status_message": updated_data.get(
                     "internal_status_message", claim["internal_status_message"]
                 ),
-                id,
-            ),
-        )
-        db.commit()
+            }
+            # A retried update that changes nothing writes nothing
+            if not new_checks and all(
+                claim[column] == value for column, value in values.items()
+            ):
+                db.rollback()
+                return dict(claim)
+
+            # Update the claim with new data
+            db.execute(
+                """
+                UPDATE Claims
+                SET policy_id = :policy_id,
+                    claim_date = :claim_date,
+                    damage_date = :damage_date,
+                    date_of_repair = :date_of_repair,
+                    status = :status,
+                    status_message = :status_message,
+                    internal_status = :internal_status,
+                    internal_status_message = :internal_status_message
+                WHERE id = :id
+                """,
+                dict(values, id=id),
+            )
+            if new_checks:
+                # Settle the checks that only need claim and policy data up front
+                evaluate_claim_checks(db, id, get_check_facts(db, id))
+                record_check_changes(db, id)
+            record_claim_change(db, id)
+
+            updated_claim = dict(
+                db.execute("SELECT * FROM Claims WHERE id = ?", (id,)).fetchone()
+            )
+            if idempotency_key:
+                store_response(db, idempotency_key, scope, fingerprint, updated_claim)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
 
-        updated_claim = db.execute(
-            "SELECT * FROM Claims WHERE id = ?", (id,)
-        ).fetchone()
-        return dict(updated_claim)
+        notify_changes()
+        return updated_claim
 
 
 @api.route("/claims/<int:id>/policy")
@@ -445,32 +719,154 @@ class ClaimPolicyResource(Resource):
         return get_policy_processing_object(id)
 
 
+@api.route("/claims/policies")
+class ClaimPoliciesResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.doc(params={"ids": "Comma separated list of claim IDs"})
+    @api.marshal_list_with(claim_policy_model)
+    def get(self):
+        """
+        Get the policy details for many claims in one request.
+        """
+        try:
+            ids = [int(i) for i in request.args.get("ids", "").split(",") if i.strip()]
+        except ValueError:
+            return {"message": "ids must be a comma separated list of integers"}, 400
+
+        combined = load_policy_processing_objects(get_db(), ids)
+        return [
+            dict(combined[claim_id], claim_id=claim_id)
+            for claim_id in ids
+            if combined.get(claim_id)
+        ]
+
+
 @api.route("/claims/<int:id>/invoices")
 class ClaimInvoiceResource(Resource):
     @jwt_required()
     @admin_required
     def get(self, id):
         """
-        Endpoint to download the invoice file
+        Endpoint to download the invoice file. Supports Range requests and
+        conditional requests with the invoice's SHA-256 as a strong ETag.
         """
         db = get_db()
-        # Retrieve the claim's invoice path
-        claim = db.execute("SELECT invoices FROM Claims WHERE id = ?", (id,)).fetchone()
+        # Retrieve the claim's invoice blob
+        claim = db.execute(
+            "SELECT invoices, invoice_sha256, invoice_mime_type, invoice_filename FROM Claims WHERE id = ?",
+            (id,),
+        ).fetchone()
         if not claim or not claim["invoices"]:
             return {"message": "Invoice file not found for this claim"}, 404
 
-        invoice_path = claim["invoices"]
-        directory, filename = os.path.split(invoice_path)
+        etag = claim["invoice_sha256"]
+        # Blobs are content-addressed, so a matching ETag needs no disk access
+        if etag and request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            set_invoice_cache_headers(response, immutable=True)
+            return response
 
+        invoice_path = invoice_store.resolve(claim["invoices"])
         if not os.path.exists(invoice_path):
             return {"message": "Invoice file not found on disk"}, 404
+        download_name = claim["invoice_filename"] or os.path.basename(invoice_path)
 
         try:
-            # Serve the file from the directory
-            return send_from_directory(directory, filename, as_attachment=True)
+            if INVOICE_ACCEL_REDIRECT_PREFIX:
+                response = accel_redirect_response(
+                    invoice_path, claim["invoice_mime_type"], download_name, etag
+                )
+            else:
+                # send_file answers Range and If-None-Match itself, and hands the
+                # file to wsgi.file_wrapper (sendfile) or X-Sendfile when enabled
+                response = send_file(
+                    invoice_path,
+                    mimetype=claim["invoice_mime_type"],
+                    as_attachment=True,
+                    download_name=download_name,
+                    conditional=True,
+                    etag=etag or True,
+                )
+                response.headers.setdefault("Accept-Ranges", "bytes")
         except Exception as e:
             return {"message": f"Error retrieving invoice: {str(e)}"}, 500
 
+        set_invoice_cache_headers(response, immutable=bool(etag))
+        return response
+
+
+@api.route("/claims/<int:id>/invoice-data")
+class ClaimInvoiceDataResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.doc(params={"refresh": "Set to true to extract the invoice again"})
+    @api.response(200, "Success", invoice_data_model)
+    @api.response(202, "Extraction in progress", invoice_data_model)
+    def get(self, id):
+        """
+        Get the fields extracted from the claim's invoice: date, total, license
+        plate, policy number, customer name, line items and full text. Results
+        are cached by invoice content, so this only extracts an invoice that
+        has not been seen before.
+        """
+        db = get_db()
+        claim = db.execute(
+            "SELECT invoices, invoice_sha256, invoice_mime_type FROM Claims WHERE id = ?",
+            (id,),
+        ).fetchone()
+        if not claim or not claim["invoices"]:
+            return {"message": "Invoice file not found for this claim"}, 404
+        invoice_path = invoice_store.resolve(claim["invoices"])
+        if not os.path.exists(invoice_path):
+            return {"message": "Invoice file not found on disk"}, 404
+
+        # Claims stored before content addressing have no hash recorded
+        sha256 = claim["invoice_sha256"] or file_sha256(invoice_path)
+        row = get_extraction(db, sha256)
+        refresh = request.args.get("refresh", "false").lower() == "true"
+        if refresh or needs_extraction(row):
+            row = extract_and_store(
+                sha256, invoice_path, claim["invoice_mime_type"], conn=db
+            )
+        elif row["status"] == "Pending":
+            return marshal(extraction_response(row), invoice_data_model), 202
+        return marshal(extraction_response(row), invoice_data_model)
+
+
+@api.route("/claims/<int:id>/bundle")
+class ClaimBundleResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.response(200, "Success", claim_bundle_model)
+    def get(self, id):
+        """
+        Get everything needed to review a claim in one request: the claim, its
+        combined policy, its checks and a summary of them, a reference to the
+        invoice and the extracted invoice data. Served from a snapshot that is
+        rebuilt after any of those change; supports If-None-Match.
+        """
+        db = get_db()
+        bundle = db.execute(
+            "SELECT payload, etag FROM ClaimBundles WHERE claim_id = ?", (id,)
+        ).fetchone()
+        cache = "hit"
+        if bundle is None:
+            cache = "miss"
+            bundle = build_claim_bundle(db, id)
+            if bundle is None:
+                return {"message": "Claim not found"}, 404
+
+        if request.if_none_match.contains(bundle["etag"]):
+            response = Response(status=304)
+        else:
+            response = Response(bundle["payload"], mimetype="application/json")
+        response.set_etag(bundle["etag"])
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.headers["X-Bundle-Cache"] = cache
+        return response
+
 
 @api.route("/claims/<int:id>/checks")
 class ClaimChecksResource(Resource):
@@ -483,13 +879,139 @@ class ClaimChecksResource(Resource):
         """
         db = get_db()
         checks = db.execute(
-            "SELECT * FROM ClaimsProcessingChecks WHERE claim_id = ?", (id,)
+            "SELECT * FROM ClaimsProcessingChecks WHERE claim_id = ? ORDER BY id",
+            (id,),
         ).fetchall()
 
         # Convert the result to a list of dictionaries
         checks_list = [dict(check) for check in checks]
         return checks_list
 
+    @jwt_required()
+    @admin_required
+    @api.expect(check_batch_update_model)
+    @api.response(200, "Success", check_summary_model)
+    def patch(self, id):
+        """
+        Record the results of many checks of a claim in one transaction.
+        Fields left out of a result keep their current value. Returns the
+        check counts by status after the update.
+        """
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body, dict):
+            return {"message": "Request body must be a JSON object"}, 400
+        results = body.get("checks")
+        if not isinstance(results, list) or not all(
+            isinstance(result, dict) for result in results
+        ):
+            return {"message": "checks must be a list of check results"}, 400
+
+        updates = []
+        for result in results:
+            if not isinstance(result.get("id"), int):
+                return {"message": "Every check result needs an integer id"}, 400
+            if result.get("status") not in (None, "Pending", "Passed", "Failed"):
+                return {"message": f"Invalid status for check {result['id']}"}, 400
+            updates.append(
+                (
+                    result.get("status"),
+                    result.get("result_message"),
+                    result.get("reviewed_value"),
+                    result["id"],
+                )
+            )
+
+        db = get_db()
+        known = {
+            row[0]
+            for row in db.execute(
+                "SELECT id FROM ClaimsProcessingChecks WHERE claim_id = ?", (id,)
+            )
+        }
+        missing = sorted({update[3] for update in updates} - known)
+        if missing:
+            return {
+                "message": f"Checks not found for this claim: {', '.join(map(str, missing))}"
+            }, 404
+
+        processed_at = datetime.now()
+        db.executemany(
+            """
+            UPDATE ClaimsProcessingChecks
+            SET status = COALESCE(?, status),
+                result_message = COALESCE(?, result_message),
+                reviewed_value = COALESCE(?, reviewed_value),
+                processed_at = ?
+            WHERE id = ? AND claim_id = ?
+            """,
+            [(*update[:3], processed_at, update[3], id) for update in updates],
+        )
+        record_check_changes(db, id, sorted({update[3] for update in updates}))
+        db.commit()
+        notify_changes()
+
+        summary = get_check_summary(db, id)
+        summary["updated"] = len(updates)
+        return marshal(summary, check_summary_model)
+
+
+@api.route("/claims/<int:id>/checks/summary")
+class ClaimChecksSummaryResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.marshal_with(check_summary_model, skip_none=True)
+    def get(self, id):
+        """
+        Get the number of checks for a claim by status.
+        """
+        return get_check_summary(get_db(), id)
+
+
+@api.route("/claims/<int:id>/checks/evaluate")
+class ClaimChecksEvaluationResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.expect(invoice_facts_model)
+    @api.response(200, "Success", check_evaluation_model)
+    def post(self, id):
+        """
+        Evaluate every pending check that can be decided from the claim, its
+        policy and the extracted invoice facts in the request body. Decided
+        checks are marked Passed or Failed; checks that need judgment stay
+        Pending.
+        """
+        db = get_db()
+        invoice = request.get_json(silent=True) or {}
+        if not isinstance(invoice, dict):
+            return {"message": "Request body must be a JSON object"}, 400
+        if not isinstance(invoice.get("line_items", {}), (dict, type(None))):
+            return {"message": "line_items must be an object of costs by kind"}, 400
+
+        facts = get_check_facts(db, id, invoice)
+        if facts is None:
+            return {"message": "Claim not found"}, 404
+
+        evaluated = evaluate_claim_checks(db, id, facts)
+        record_check_changes(db, id, evaluated)
+        db.commit()
+        notify_changes()
+
+        checks = [
+            dict(check)
+            for check in db.execute(
+                "SELECT * FROM ClaimsProcessingChecks WHERE claim_id = ? ORDER BY id",
+                (id,),
+            ).fetchall()
+        ]
+        return marshal(
+            {
+                "evaluated": len(evaluated),
+                "pending": sum(1 for check in checks if check["status"] == "Pending"),
+                "checks": checks,
+            },
+            check_evaluation_model,
+        )
+
 
 @api.route("/claims/<int:claim_id>/checks/<int:check_id>")
 class ClaimCheckResource(Resource):
@@ -530,7 +1052,9 @@ class ClaimCheckResource(Resource):
                 claim_id,
             ),
         )
+        record_check_changes(db, claim_id, [check_id])
         db.commit()
+        notify_changes()
 
         updated_check = db.execute(
             "SELECT * FROM ClaimsProcessingChecks WHERE id = ? AND claim_id = ?",
@@ -540,179 +1064,420 @@ class ClaimCheckResource(Resource):
         return dict(updated_check)
 
 
-def get_checks_for_claim(policy_obj):
-    policy = policy_obj["policy"]
-    policy_holder = policy_obj["policy_holder"]
-    checks = {}
-    if policy["type"] == "Windscreen":
-        checks["Windscreen"] = [
-            (
-                "Verify damage_date occurred before claim_date",
-                "damage_date < claim_date",
-                None,
-                "<",
-            ),
-            (
-                "Verify claim_date is after date_of_repair",
-                "date_of_repair < claim_date",
-                None,
-                "<",
-            ),
-            (
-                "Verify the date on the invoice is before claim_date",
-                "invoice_date < claim_date",
-                None,
-                "<",
-            ),
-            (
-                "Verify the date on the invoice and date of repair are within 14 days of each other",
-                "delta between date_of_repair and invoice_date <= 14",
-                None,
-                "<=",
-            ),
-            (
-                "Verify a license plate number of the vehicle is on the invoice",
-                policy["vehicle"]["license_plate"],
-                None,
-                "IN",
-            ),
-            (
-                "Verify License Plate of policy matches the plate on the invoice",
-                policy["vehicle"]["license_plate"],
-                None,
-                "=",
-            ),
-            (
-                "Verify Policy Number is on the invoice",
-                policy["policy_number"],
-                None,
-                "IN",
-            ),
-            (
-                "Verify Name on the invoice reasonably matches the policy holder",
-                f'{policy_holder["first_name"]} {policy_holder["last_name"]}',
-                None,
-                "=",
-            ),
-            (
-                "Verify Claim Total invoiced cost does not exceed 1200",
-                "1200",
-                None,
-                "<=",
-            ),
-            (
-                "Verify the Claim invoiced total exceeds deductible",
-                policy["deductible"],
-                None,
-                ">",
-            ),
-            (
-                "Verify labor invoiced costs are in range",
-                "0<=cost<=150 or not present",
-                None,
-                "<=",
-            ),
-            (
-                "Verify the adhesive set invoiced costs are in range",
-                "0<=cost<=40 or not present",
-                None,
-                "<=",
-            ),
-            (
-                "Verify Env and small materials invoiced costs are in range",
-                "0<=cost<=10 or not present",
-                None,
-                "<=",
-            ),
-            (
-                "Verify Sensor invoiced costs are in range",
-                "0<=cost<=10 or not present",
-                None,
-                "<=",
-            ),
-            (
-                "Verify the calibration invoiced costs are in range",
-                "0<=cost<=100 or not present",
-                None,
-                "<=",
-            ),
-        ]
-    checks["Device"] = [
-        (
-            "Determine and record the depreciated value of device based on purchase date and current replacement value",
-            None,
-            None,
-            None,
-        ),
-        (
-            "Check the current prices online to determine replacement value",
-            None,
-            None,
-            None,
-        ),
-        ("Determine the repair cost of the device", None, None, None),
-        (
-            "Find the minimum of the replacement value and repair cost",
-            "min(replacement_value, repair_cost)",
-            None,
-            "min",
-        ),
-    ]
-    return checks[policy["type"]]
-    # return [
-    # (
-    # "Verify damage_date is before claim_date",
-    # "damage_date < claim_date",
-    # None,
-    # "<",
-    # )
-    # ]
+@api.route("/changes")
+class ChangesResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.doc(
+        params={
+            "since": "Sequence of the last change already seen; omit to get the current cursor",
+            "wait": f"Seconds to wait for a change when there is none yet (max {CHANGES_MAX_WAIT:g})",
+            "limit": f"Maximum number of changes to return (default {CHANGES_PAGE_SIZE})",
+        }
+    )
+    @api.response(200, "Success", changes_page_model)
+    @api.response(410, "Changes after since were pruned; reload and resume from cursor")
+    def get(self):
+        """
+        Long-poll the claim change feed. Returns the claim and check changes
+        after ``since`` in sequence order, and the cursor to pass as ``since``
+        next time.
+        """
+        since = None
+        if "since" in request.args:
+            try:
+                since = int(request.args["since"])
+            except ValueError:
+                return {"message": "since must be an integer"}, 400
+            if since < 0:
+                return {"message": "since must not be negative"}, 400
+        try:
+            wait = float(request.args.get("wait", 0))
+        except ValueError:
+            return {"message": "wait must be a number"}, 400
+        if not math.isfinite(wait):
+            return {"message": "wait must be a number"}, 400
+        wait = min(max(wait, 0), CHANGES_MAX_WAIT)
+        try:
+            limit = int(request.args.get("limit", CHANGES_PAGE_SIZE))
+        except ValueError:
+            return {"message": "limit must be an integer"}, 400
+        if limit < 1:
+            return {"message": "limit must be positive"}, 400
+        limit = min(limit, CHANGES_PAGE_SIZE)
+
+        # A short-lived connection rather than get_db(): the request's one
+        # would stay checked out for the whole wait
+        with pool.connection() as conn:
+            if since is None:
+                return {"changes": [], "cursor": latest_seq(conn)}
+            if is_pruned(conn, since):
+                return {
+                    "message": "Changes after since are no longer kept; reload and resume from cursor",
+                    "resync": True,
+                    "cursor": latest_seq(conn),
+                }, 410
+
+        changes = wait_for_changes(since, wait, limit)
+        return marshal(
+            {
+                "changes": changes,
+                "cursor": changes[-1]["seq"] if changes else since,
+            },
+            changes_page_model,
+        )
 
 
-def get_policy_processing_object(id):
-    db = get_db()
-    # Get the claim to find the policy_id
-    claim = db.execute("SELECT policy_id FROM Claims WHERE id = ?", (id,)).fetchone()
-    if not claim:
-        return {"message": "Claim not found"}, 404
+@api.route("/changes/stream")
+class ChangesStreamResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.doc(
+        params={
+            "since": "Sequence of the last change already seen; Last-Event-ID takes precedence, the default is the current cursor"
+        }
+    )
+    def get(self):
+        """
+        Stream the claim change feed as Server-Sent Events. Each event is a
+        claim or check change with the change sequence as its id. Streams end
+        after CHANGES_STREAM_MAX_AGE seconds and the client reconnects. A
+        client too far behind gets a single resync event, whose data holds
+        the cursor to resume from after reloading.
+        """
+        # A reconnecting EventSource repeats its original URL, so the
+        # Last-Event-ID it sends is the more recent position
+        since = request.headers.get("Last-Event-ID", type=int)
+        if since is None and "since" in request.args:
+            try:
+                since = int(request.args["since"])
+            except ValueError:
+                return {"message": "since must be an integer"}, 400
+        with pool.connection() as conn:
+            if since is None:
+                since = latest_seq(conn)
+            elif is_pruned(conn, since):
+                cursor = latest_seq(conn)
+                return Response(
+                    f"id: {cursor}\nevent: resync\ndata: {json.dumps({'cursor': cursor})}\n\n",
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"},
+                )
 
-    policy = db.execute(
-        "SELECT * FROM Policy WHERE id = ?", (claim["policy_id"],)
-    ).fetchone()
-    if not policy:
-        return {"message": "Policy not found"}, 404
+        return Response(
+            stream_changes(since),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
-    # Get the associated user
-    user = db.execute(
-        "SELECT * FROM User WHERE id = ?", (policy["user_id"],)
-    ).fetchone()
 
-    # Get the associated vehicle if applicable
-    vehicle = None
-    if policy["vehicle_id"]:
-        vehicle = db.execute(
-            "SELECT * FROM Vehicles WHERE id = ?", (policy["vehicle_id"],)
-        ).fetchone()
+@api.route("/system/db")
+class SystemDatabaseResource(Resource):
+    @jwt_required()
+    @admin_required
+    def get(self):
+        """
+        Get connection pool statistics.
+        """
+        return pool.stats()
 
-    # You can add similar logic for devices if needed
-    device = None
-    if policy["device_id"]:
-        device = db.execute(
-            "SELECT * FROM Devices WHERE id = ?", (policy["device_id"],)
-        ).fetchone()
 
-    # Construct the response
-    policy_data = dict(policy)
-    if vehicle:
-        policy_data["vehicle"] = dict(vehicle)
+@api.route("/system/metrics")
+class SystemMetricsResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.doc(
+        params={
+            "limit": "Number of statements to return, most total time first",
+            "reset": "Set to true to clear the collected statistics",
+        }
+    )
+    def get(self):
+        """
+        Get per-statement SQL timings with p50/p95/p99 in milliseconds.
+        """
+        limit = request.args.get("limit", type=int)
+        queries = query_stats.snapshot(limit)
+        if request.args.get("reset", "false").lower() == "true":
+            query_stats.reset()
+        return {"queries": queries, "logging": logging_stats()}
+
+
+@api.route("/system/auth")
+class SystemAuthResource(Resource):
+    @jwt_required()
+    @admin_required
+    def get(self):
+        """
+        Get token verification cache and password hashing statistics.
+        """
+        return {**jwt.cache_stats(), "password_hashing": hashing_pool.stats()}
+
+
+@api.route("/system/check-rules")
+class SystemCheckRulesResource(Resource):
+    @jwt_required()
+    @admin_required
+    def get(self):
+        """
+        Get the active check catalogue version for each policy type.
+        """
+        return check_registry.versions(get_db())
+
+    @jwt_required()
+    @admin_required
+    def post(self):
+        """
+        Reload the check catalogue from ClaimCheckRules in every worker.
+        """
+        db = get_db()
+        check_registry.reload(db)
+        return check_registry.versions(db)
+
+
+def set_invoice_cache_headers(response, immutable):
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = INVOICE_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Legacy path-based invoices can be overwritten in place
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+
+
+def accel_redirect_response(invoice_path, mime_type, download_name, etag):
+    """
+    Hand the transfer to the fronting nginx with X-Accel-Redirect. nginx
+    serves the body (including Range requests) from an internal location
+    mapped to the invoice store root.
+    """
+    relative = os.path.relpath(invoice_path, invoice_store.root)
+    response = Response(mimetype=mime_type or "application/octet-stream")
+    response.headers["X-Accel-Redirect"] = (
+        INVOICE_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative.replace(os.sep, "/")
+    )
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename="{secure_filename(download_name)}"'
+    )
+    if etag:
+        response.set_etag(etag)
+    return response.make_conditional(request)
 
-    if device:
-        policy_data["device"] = dict(device)
 
-    combined_policy = {"policy": policy_data, "policy_holder": dict(user)}
+def encode_cursor(claim_date, claim_id):
+    raw = json.dumps([claim_date, claim_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        claim_date, claim_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(claim_id, int):
+        raise ValueError("Invalid cursor")
+    return claim_date, claim_id
+
+
+def get_checks_for_claim(policy_obj):
+    return build_checks(get_db(), policy_obj)
+
+
+def get_check_summary(db, id):
+    summary = {"total": 0, "pending": 0, "passed": 0, "failed": 0}
+    for row in db.execute(
+        "SELECT status, COUNT(*) FROM ClaimsProcessingChecks WHERE claim_id = ? GROUP BY status",
+        (id,),
+    ):
+        summary["total"] += row[1]
+        if row[0].lower() in summary:
+            summary[row[0].lower()] = row[1]
+    return summary
+
+
+def build_claim_bundle(db, id):
+    """
+    Build the review bundle of a claim and store it in ClaimBundles. The
+    reads and the store share one transaction: if a writer commits in
+    between, storing fails and the bundle is served without being kept, so
+    a snapshot never outlives the data it was built from. Returns a dict
+    with payload and etag, or None when the claim does not exist.
+    """
+    db.execute("BEGIN")
+    try:
+        claim = db.execute("SELECT * FROM Claims WHERE id = ?", (id,)).fetchone()
+        if not claim:
+            return None
+        checks = db.execute(
+            "SELECT * FROM ClaimsProcessingChecks WHERE claim_id = ? ORDER BY id",
+            (id,),
+        ).fetchall()
+        summary = {"total": len(checks), "pending": 0, "passed": 0, "failed": 0}
+        for check in checks:
+            if check["status"].lower() in summary:
+                summary[check["status"].lower()] += 1
 
-    return combined_policy
+        invoice = None
+        claim_dict = dict(claim)
+        if claim["invoices"]:
+            claim_dict["invoices"] = f"/claims/{id}/invoices"
+            invoice = {
+                "url": claim_dict["invoices"],
+                "sha256": claim["invoice_sha256"],
+                "size": claim["invoice_size"],
+                "mime_type": claim["invoice_mime_type"],
+                "filename": claim["invoice_filename"],
+            }
+        extraction = get_extraction(db, claim["invoice_sha256"])
+
+        payload = json.dumps(
+            marshal(
+                {
+                    "claim": claim_dict,
+                    "policy": load_policy_processing_objects(db, [id]).get(id),
+                    "checks": [dict(check) for check in checks],
+                    "check_summary": summary,
+                    "invoice": invoice,
+                    "invoice_data": (
+                        extraction_response(extraction)
+                        if extraction and extraction["status"] != "Pending"
+                        else None
+                    ),
+                    "built_at": time.time(),
+                },
+                claim_bundle_model,
+            )
+        )
+        etag = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO ClaimBundles (claim_id, payload, etag, built_at) VALUES (?, ?, ?, ?)",
+                (id, payload, etag, time.time()),
+            )
+            db.commit()
+        except sqlite3.OperationalError:
+            # Another connection wrote since this transaction's snapshot
+            db.rollback()
+        return {"payload": payload, "etag": etag}
+    finally:
+        if db.in_transaction:
+            db.rollback()
+
+
+def get_check_facts(db, id, invoice=None):
+    """
+    Gather the facts checks are evaluated against: the claim's columns, its
+    combined policy object, and the invoice fields extracted on upload or
+    passed in ``invoice``. Returns None when the claim does not exist.
+    """
+    claim = db.execute("SELECT * FROM Claims WHERE id = ?", (id,)).fetchone()
+    if not claim:
+        return None
+    # Submitted invoice facts win over the cached extraction, and claim and
+    # policy data win over both
+    facts = cached_fields(db, claim["invoice_sha256"])
+    facts.update(invoice or {})
+    facts.update(claim)
+    facts.update(load_policy_processing_objects(db, [id]).get(id) or {})
+    return facts
+
+
+# Tables joined by the policy loader, keyed by the alias prefix used for their
+# columns in the joined row
+POLICY_LOADER_TABLES = {
+    "policy": "Policy",
+    "user": "User",
+    "vehicle": "Vehicles",
+    "device": "Devices",
+}
+POLICY_LOADER_BATCH_SIZE = 500
+
+_policy_loader_select = None
+
+
+def get_policy_loader_select(db):
+    """
+    Build (once per process) the SELECT column list for the joined loader and
+    the slice of the result row that holds each table's columns.
+    """
+    global _policy_loader_select
+    if _policy_loader_select is None:
+        select, slices, offset = ["c.id"], {}, 1
+        for prefix, table in POLICY_LOADER_TABLES.items():
+            columns = [
+                row[1] for row in db.execute(f"PRAGMA table_info({table})").fetchall()
+            ]
+            select.extend(f'{prefix[0]}."{column}"' for column in columns)
+            slices[prefix] = (columns, offset, offset + len(columns))
+            offset += len(columns)
+        _policy_loader_select = (", ".join(select), slices)
+    return _policy_loader_select
+
+
+def load_policy_processing_objects(db, claim_ids):
+    """
+    Load the combined policy object for many claims with one JOIN query per
+    POLICY_LOADER_BATCH_SIZE ids. Returns a dict of claim id -> combined policy
+    (or None when the claim's policy no longer exists); unknown claim ids are
+    left out.
+    """
+    select, slices = get_policy_loader_select(db)
+
+    claim_ids = list(dict.fromkeys(claim_ids))
+    results = {}
+    for i in range(0, len(claim_ids), POLICY_LOADER_BATCH_SIZE):
+        batch = claim_ids[i : i + POLICY_LOADER_BATCH_SIZE]
+        rows = db.execute(
+            f"""
+            SELECT {select}
+            FROM Claims c
+            LEFT JOIN Policy p ON p.id = c.policy_id
+            LEFT JOIN User u ON u.id = p.user_id
+            LEFT JOIN Vehicles v ON v.id = p.vehicle_id
+            LEFT JOIN Devices d ON d.id = p.device_id
+            WHERE c.id IN ({", ".join("?" * len(batch))})
+            """,
+            batch,
+        ).fetchall()
+
+        for row in rows:
+            row = tuple(row)
+            parts = {}
+            for prefix, (columns, start, stop) in slices.items():
+                # A NULL id means the LEFT JOIN found no row for this table
+                if row[start] is not None:
+                    parts[prefix] = dict(zip(columns, row[start:stop]))
+
+            if "policy" not in parts:
+                results[row[0]] = None
+                continue
+
+            policy_data = parts["policy"]
+            if "vehicle" in parts:
+                policy_data["vehicle"] = parts["vehicle"]
+            if "device" in parts:
+                policy_data["device"] = parts["device"]
+            results[row[0]] = {
+                "policy": policy_data,
+                "policy_holder": parts.get("user"),
+            }
+
+    return results
+
+
+def get_policy_processing_object(id):
+    combined = load_policy_processing_objects(get_db(), [id])
+    if id not in combined:
+        return {"message": "Claim not found"}, 404
+    if combined[id] is None:
+        return {"message": "Policy not found"}, 404
+    return combined[id]
 
 
 if __name__ == "__main__":
+    start_checkpointer()
+    start_change_pruner()
     app.run(host="0.0.0.0", port=5100, debug=True)
@@ -0,0 +1,186 @@
+import copy
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from functools import wraps
+
+import flask_jwt_extended
+
+from flask import g, jsonify
+from flask_jwt_extended import JWTManager, get_jwt_identity
+
+from db import get_db
+from metrics import get_logger
+
+# HS256 is the cheapest algorithm to verify. Asymmetric algorithms (RS256,
+# ES256, ...) need the cryptography package and a key pair in
+# JWT_PRIVATE_KEY_FILE and JWT_PUBLIC_KEY_FILE.
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+JWT_PRIVATE_KEY_FILE = os.getenv("JWT_PRIVATE_KEY_FILE", "")
+JWT_PUBLIC_KEY_FILE = os.getenv("JWT_PUBLIC_KEY_FILE", "")
+# Number of verified tokens kept per process; 0 verifies every request
+JWT_VERIFY_CACHE_SIZE = int(os.getenv("JWT_VERIFY_CACHE_SIZE", "1024"))
+# CachingJWTManager overrides a private method of flask_jwt_extended; it is
+# only known to work with these releases (see requirements.txt)
+JWT_CACHE_SUPPORTED_VERSIONS = ("4.6.",)
+
+log = get_logger(__name__)
+
+
+class CachingJWTManager(JWTManager):
+    """
+    A JWTManager that remembers the claims of tokens it has verified, so a
+    client sending the same token on every request pays for the signature
+    check once. Cached claims are only used until the token's exp. Every
+    caller gets its own copy of the claims, so a handler changing them does
+    not change them for later requests.
+
+    With a flask_jwt_extended release it was not checked against, the cache
+    is disabled rather than relying on the private method it overrides.
+    """
+
+    def __init__(self, app=None, cache_size=JWT_VERIFY_CACHE_SIZE, **kwargs):
+        if cache_size and not flask_jwt_extended.__version__.startswith(
+            JWT_CACHE_SUPPORTED_VERSIONS
+        ):
+            log.warning(
+                "Token cache disabled: flask_jwt_extended %s is not a supported release",
+                flask_jwt_extended.__version__,
+            )
+            cache_size = 0
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_stats = {"hits": 0, "misses": 0}
+        super().__init__(app, **kwargs)
+
+    def _decode_jwt_from_config(
+        self, encoded_token, csrf_value=None, allow_expired=False
+    ):
+        if not self.cache_size:
+            return super()._decode_jwt_from_config(
+                encoded_token, csrf_value, allow_expired
+            )
+
+        key = (encoded_token, csrf_value)
+        with self._cache_lock:
+            claims = self._cache.get(key)
+            if claims is not None:
+                if allow_expired or claims.get("exp", float("inf")) > time.time():
+                    self._cache.move_to_end(key)
+                    self._cache_stats["hits"] += 1
+                    return copy.deepcopy(claims)
+                del self._cache[key]
+            self._cache_stats["misses"] += 1
+
+        # Expired or invalid tokens raise here and are never cached
+        claims = super()._decode_jwt_from_config(
+            encoded_token, csrf_value, allow_expired
+        )
+        if not allow_expired:
+            with self._cache_lock:
+                self._cache[key] = copy.deepcopy(claims)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return claims
+
+    def cache_stats(self):
+        with self._cache_lock:
+            stats = dict(self._cache_stats)
+            stats["size"] = len(self._cache)
+        stats["max_size"] = self.cache_size
+        stats["algorithm"] = JWT_ALGORITHM
+        return stats
+
+
+def init_jwt(app, cache_size=JWT_VERIFY_CACHE_SIZE):
+    """
+    Configure token signing for ``app`` from JWT_ALGORITHM and return its
+    JWTManager. HMAC algorithms sign with the app's JWT_SECRET_KEY.
+    """
+    app.config["JWT_ALGORITHM"] = JWT_ALGORITHM
+    app.config["JWT_DECODE_ALGORITHMS"] = [JWT_ALGORITHM]
+    if not JWT_ALGORITHM.startswith("HS"):
+        with open(JWT_PRIVATE_KEY_FILE) as f:
+            app.config["JWT_PRIVATE_KEY"] = f.read()
+        with open(JWT_PUBLIC_KEY_FILE) as f:
+            app.config["JWT_PUBLIC_KEY"] = f.read()
+    return CachingJWTManager(app, cache_size=cache_size)
+
+
+def current_identity():
+    """
+    The identity of the current request's token, resolved once per request.
+    """
+    if "identity" not in g:
+        g.identity = get_jwt_identity()
+    return g.identity
+
+
+def current_policy():
+    """
+    The Policy row resolved by policy_belongs_to_user_or_admin for this
+    request, or None.
+    """
+    return g.get("policy")
+
+
+def admin_required(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        current_user = current_identity()
+        if current_user["username"] != "admin":
+            return jsonify({"message": "Access forbidden: Admins only"}), 403
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def owner_or_admin_required(resource_user_id_param="id"):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            current_user = current_identity()
+            resource_user_id = kwargs.get(resource_user_id_param)
+            if (
+                current_user["username"] != "admin"
+                and current_user["id"] != resource_user_id
+            ):
+                return (
+                    jsonify({"message": "Access forbidden: Unauthorized access"}),
+                    403,
+                )
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def policy_belongs_to_user_or_admin(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        conn = get_db()
+        current_user = current_identity()
+        user_id = kwargs.get("user_id")
+        policy_number = kwargs.get("policy_number")
+        if policy_number is None or policy_number == "undefined":
+            return jsonify({"message": "Invalid request"}), 400
+
+        # Verify that the policy belongs to the user
+        policy = conn.execute(
+            "SELECT * FROM Policy WHERE policy_number = ? AND user_id = ?",
+            (policy_number, user_id),
+        ).fetchone()
+
+        # If no policy is found, or the user is not the owner and not an admin, return a forbidden response
+        if not policy and current_user["username"] != "admin":
+            return jsonify({"message": "Policy not found or access forbidden"}), 404
+        # Keep the row for the handler, and pass the policy's internal ID to it
+        g.policy = policy
+        kwargs["policy_internal_id"] = policy["id"] if policy else None
+        return fn(*args, **kwargs)
+
+    return wrapper
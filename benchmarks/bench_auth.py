@@ -0,0 +1,119 @@
+"""
+Measure the per-request cost of authentication: an open route against a
+jwt_required route and a jwt_required + admin_required route, with the token
+verification cache on and off, for each signing algorithm available.
+
+    python benchmarks/bench_auth.py --requests 5000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE"] = os.path.join(_tmp.name, "bench.db")
+
+from flask import Flask  # noqa: E402
+from flask_jwt_extended import create_access_token, jwt_required  # noqa: E402
+
+from auth import CachingJWTManager, admin_required  # noqa: E402
+
+
+def generate_keys(algorithm):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    if algorithm.startswith("RS"):
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        key = ec.generate_private_key(ec.SECP256R1())
+    private = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public = key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    return private, public
+
+
+def build_app(algorithm, cache_size):
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "bench-secret"
+    app.config["JWT_ALGORITHM"] = algorithm
+    app.config["JWT_DECODE_ALGORITHMS"] = [algorithm]
+    if not algorithm.startswith("HS"):
+        private, public = generate_keys(algorithm)
+        app.config["JWT_PRIVATE_KEY"] = private
+        app.config["JWT_PUBLIC_KEY"] = public
+    CachingJWTManager(app, cache_size=cache_size)
+
+    @app.route("/open")
+    def open_route():
+        return "ok"
+
+    @app.route("/protected")
+    @jwt_required()
+    def protected_route():
+        return "ok"
+
+    @app.route("/admin")
+    @jwt_required()
+    @admin_required
+    def admin_route():
+        return "ok"
+
+    with app.app_context():
+        token = create_access_token(identity={"id": 1, "username": "admin"})
+    return app, token
+
+
+def time_route(client, path, headers, requests):
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200, response.data
+    return (time.perf_counter() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument(
+        "--algorithms", default="HS256,RS256,ES256", help="Comma separated list"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'algorithm':<10} {'cache':>6} {'open us':>9} {'jwt us':>9} {'admin us':>9} {'overhead us':>12}"
+    )
+    for algorithm in args.algorithms.split(","):
+        for cache_size in (0, 1024):
+            try:
+                app, token = build_app(algorithm, cache_size)
+            except ImportError:
+                print(f"{algorithm:<10} skipped: cryptography is not installed")
+                break
+            client = app.test_client()
+            headers = {"Authorization": f"Bearer {token}"}
+            # Warm up the routes (and the cache) before timing
+            time_route(client, "/admin", headers, 10)
+
+            open_time = time_route(client, "/open", {}, args.requests)
+            jwt_time = time_route(client, "/protected", headers, args.requests)
+            admin_time = time_route(client, "/admin", headers, args.requests)
+            print(
+                f"{algorithm:<10} {'on' if cache_size else 'off':>6} "
+                f"{open_time * 1e6:>9.1f} {jwt_time * 1e6:>9.1f} {admin_time * 1e6:>9.1f} "
+                f"{(admin_time - open_time) * 1e6:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
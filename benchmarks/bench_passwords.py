@@ -0,0 +1,82 @@
+"""
+Measure password hashing cost: milliseconds per hash on one thread, and
+logins per second per core when PASSWORD_HASH_WORKERS hashes run at once,
+for a range of scrypt and PBKDF2 cost settings. Use it to pick the highest
+cost that still fits the login rate the deployment has to absorb.
+
+    python benchmarks/bench_passwords.py --seconds 2 --workers 4
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from passwords import (  # noqa: E402
+    PASSWORD_HASH_WORKERS,
+    PBKDF2Hasher,
+    ScryptHasher,
+)
+
+SETTINGS = [
+    ("scrypt n=2^12", ScryptHasher(n=2**12)),
+    ("scrypt n=2^14", ScryptHasher(n=2**14)),
+    ("scrypt n=2^15", ScryptHasher(n=2**15)),
+    ("scrypt n=2^16", ScryptHasher(n=2**16)),
+    ("pbkdf2 100k", PBKDF2Hasher(iterations=100_000)),
+    ("pbkdf2 300k", PBKDF2Hasher(iterations=300_000)),
+    ("pbkdf2 600k", PBKDF2Hasher(iterations=600_000)),
+]
+
+
+def run_for(seconds, fn):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        fn()
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--workers", type=int, default=PASSWORD_HASH_WORKERS)
+    args = parser.parse_args()
+
+    cores = min(args.workers, os.cpu_count() or 1)
+    print(f"{os.cpu_count()} cores, {args.workers} hashing workers")
+    print(
+        f"{'setting':<15} {'ms/hash':>8} {'logins/s':>9} {'per core':>9} {'scaling':>8}"
+    )
+    for name, hasher in SETTINGS:
+        encoded = hasher.hash("correct horse battery staple")
+
+        def verify():
+            assert hasher.verify("correct horse battery staple", encoded)
+
+        started = time.perf_counter()
+        single = run_for(args.seconds, verify)
+        single_rate = single / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            counts = list(
+                executor.map(
+                    lambda _: run_for(args.seconds, verify), range(args.workers)
+                )
+            )
+        rate = sum(counts) / (time.perf_counter() - started)
+
+        print(
+            f"{name:<15} {1000 / single_rate:>8.1f} {rate:>9.1f} "
+            f"{rate / cores:>9.1f} {rate / single_rate:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
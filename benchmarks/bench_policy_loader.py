@@ -0,0 +1,113 @@
+"""
+Compare the per-claim five query policy loader with the joined loader and its
+batch variant on a synthetic database.
+
+    python benchmarks/bench_policy_loader.py --claims 5000 --lookups 2000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE"] = os.path.join(_tmp.name, "bench.db")
+
+import migrate  # noqa: E402
+from agent_api import load_policy_processing_objects  # noqa: E402
+
+
+def legacy_loader(db, id):
+    # The loader as it was before it was rewritten as a single JOIN
+    claim = db.execute("SELECT policy_id FROM Claims WHERE id = ?", (id,)).fetchone()
+    policy = db.execute(
+        "SELECT * FROM Policy WHERE id = ?", (claim["policy_id"],)
+    ).fetchone()
+    user = db.execute(
+        "SELECT * FROM User WHERE id = ?", (policy["user_id"],)
+    ).fetchone()
+    vehicle = None
+    if policy["vehicle_id"]:
+        vehicle = db.execute(
+            "SELECT * FROM Vehicles WHERE id = ?", (policy["vehicle_id"],)
+        ).fetchone()
+    device = None
+    if policy["device_id"]:
+        device = db.execute(
+            "SELECT * FROM Devices WHERE id = ?", (policy["device_id"],)
+        ).fetchone()
+    policy_data = dict(policy)
+    if vehicle:
+        policy_data["vehicle"] = dict(vehicle)
+    if device:
+        policy_data["device"] = dict(device)
+    return {"policy": policy_data, "policy_holder": dict(user)}
+
+
+def seed(claims):
+    migrate.create_tables()
+    migrate.run_migrations()
+    conn = sqlite3.connect(os.environ["DATABASE"])
+    users = max(claims // 5, 1)
+    conn.executemany(
+        "INSERT INTO User (first_name, last_name, username) VALUES (?, ?, ?)",
+        ((f"First{i}", f"Last{i}", f"user{i}") for i in range(users)),
+    )
+    conn.executemany(
+        "INSERT INTO Vehicles (make, model, year, license_plate) VALUES ('VW', 'Golf', 2020, ?)",
+        ((f"PLATE{i}",) for i in range(users)),
+    )
+    conn.executemany(
+        "INSERT INTO Policy (type, user_id, policy_number, deductible, vehicle_id) VALUES ('Windscreen', ?, ?, 100, ?)",
+        ((i + 1, f"POL{i}", i + 1) for i in range(users)),
+    )
+    conn.executemany(
+        "INSERT INTO Claims (policy_id, damage_date, date_of_repair, invoices) VALUES (?, '2024-01-01', '2024-01-02', 'invoice.pdf')",
+        ((random.randint(1, users),) for _ in range(claims)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def timed(label, lookups, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28}{elapsed * 1000:>10.1f} ms{lookups / elapsed:>14.0f} claims/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--claims", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    seed(args.claims)
+    db = sqlite3.connect(os.environ["DATABASE"])
+    db.row_factory = sqlite3.Row
+    ids = [random.randint(1, args.claims) for _ in range(args.lookups)]
+
+    assert (
+        legacy_loader(db, ids[0]) == load_policy_processing_objects(db, ids[:1])[ids[0]]
+    )
+
+    timed(
+        "legacy (5 queries/claim)",
+        len(ids),
+        lambda: [legacy_loader(db, i) for i in ids],
+    )
+    timed(
+        "joined (1 query/claim)",
+        len(ids),
+        lambda: [load_policy_processing_objects(db, [i]) for i in ids],
+    )
+    timed("joined batch", len(ids), lambda: load_policy_processing_objects(db, ids))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Compare request throughput of the customer API under the development server
+(app.run(debug=True), as `python customer_api.py` runs it, without the
+reloader) and under serve.py (gunicorn).
+
+Each mode gets a fresh database with one user and policy. Client threads
+then issue an authenticated policy listing and an unauthenticated feature
+check in turn, for --seconds.
+
+    python benchmarks/bench_serving.py --clients 32 --seconds 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODES = {
+    "dev": [
+        sys.executable,
+        "-c",
+        "import sys, customer_api; "
+        "customer_api.app.run(port=int(sys.argv[1]), debug=True, use_reloader=False)",
+    ],
+    "serve": [sys.executable, "serve.py", "customer"],
+}
+
+
+def start_server(mode, port, workdir):
+    env = dict(
+        os.environ,
+        DATABASE=os.path.join(workdir, "bench.db"),
+        UPLOAD_FOLDER=os.path.join(workdir, "uploads") + "/",
+        CUSTOMER_API_BIND=f"127.0.0.1:{port}",
+        SQL_LOG_SAMPLE_RATE="0",
+    )
+    os.makedirs(env["UPLOAD_FOLDER"], exist_ok=True)
+    subprocess.run(
+        [sys.executable, "migrate.py"],
+        cwd=ROOT,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    command = MODES[mode] + ([str(port)] if mode == "dev" else [])
+    server = subprocess.Popen(
+        command,
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{base}/system/features", timeout=1)
+            return server, base
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def prepare(base):
+    requests.post(
+        f"{base}/users/",
+        json={
+            "first_name": "Bench",
+            "last_name": "User",
+            "username": "bench",
+            "password": "bench-password",
+        },
+    )
+    login = requests.post(
+        f"{base}/users/login",
+        json={"username": "bench", "password": "bench-password"},
+    ).json()
+    headers = {"Authorization": f"Bearer {login['access_token']}"}
+    user_id = login["user"]["id"]
+    requests.post(
+        f"{base}/users/{user_id}/policies",
+        json={"type": "Windscreen", "policy_number": "BENCH-1", "deductible": 100},
+        headers=headers,
+    )
+    return [
+        (f"{base}/users/{user_id}/policies", headers),
+        (f"{base}/system/features", {}),
+    ]
+
+
+def run_load(targets, clients, seconds):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        session = requests.Session()
+        local, failed, i = [], 0, 0
+        while time.perf_counter() < deadline:
+            url, headers = targets[i % len(targets)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                if session.get(url, headers=headers, timeout=30).status_code != 200:
+                    failed += 1
+            except requests.RequestException:
+                failed += 1
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "per_second": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0,
+        "errors": errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=5901)
+    parser.add_argument("--modes", default="dev,serve", help="Comma separated list")
+    args = parser.parse_args()
+
+    print(
+        f"{'mode':<6} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    )
+    for mode in args.modes.split(","):
+        with tempfile.TemporaryDirectory() as workdir:
+            server, base = start_server(mode, args.port, workdir)
+            try:
+                targets = prepare(base)
+                result = run_load(targets, args.clients, args.seconds)
+            finally:
+                server.terminate()
+                server.wait()
+        print(
+            f"{mode:<6} {result['requests']:>9} {result['per_second']:>9.1f} "
+            f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Reader/writer throughput against insurance.db-shaped data for each storage
+profile in db.STORAGE_PROFILES.
+
+    python benchmarks/bench_storage.py --readers 8 --writers 2 --duration 5
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db import STORAGE_PROFILES, apply_storage_profile  # noqa: E402
+
+
+def seed(path, profile, claims):
+    conn = sqlite3.connect(path)
+    apply_storage_profile(conn, profile)
+    conn.execute(
+        """
+        CREATE TABLE Claims (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            policy_id INTEGER NOT NULL,
+            claim_date DATETIME NOT NULL,
+            status TEXT NOT NULL DEFAULT 'Pending',
+            internal_status TEXT NOT NULL DEFAULT 'Pending',
+            internal_status_message TEXT
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO Claims (policy_id, claim_date) VALUES (?, date('now'))",
+        ((random.randint(1, 1000),) for _ in range(claims)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def worker(path, profile, claims, deadline, write, counts):
+    conn = sqlite3.connect(path, timeout=0)
+    apply_storage_profile(conn, profile)
+    ops = locked = 0
+    while time.monotonic() < deadline:
+        claim_id = random.randint(1, claims)
+        try:
+            if write:
+                conn.execute(
+                    "UPDATE Claims SET internal_status_message = ? WHERE id = ?",
+                    (f"checked {time.time()}", claim_id),
+                )
+                conn.commit()
+            else:
+                conn.execute(
+                    "SELECT * FROM Claims WHERE policy_id = ?", (claim_id % 1000,)
+                ).fetchall()
+            ops += 1
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+            if conn.in_transaction:
+                conn.rollback()
+    conn.close()
+    key = "write" if write else "read"
+    with counts["lock"]:
+        counts[key] += ops
+        counts[f"{key}_locked"] += locked
+
+
+def run(profile_name, args):
+    profile = dict(STORAGE_PROFILES[profile_name])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(path, profile, args.claims)
+        counts = {
+            "lock": threading.Lock(),
+            "read": 0,
+            "write": 0,
+            "read_locked": 0,
+            "write_locked": 0,
+        }
+        deadline = time.monotonic() + args.duration
+        threads = [
+            threading.Thread(
+                target=worker,
+                args=(path, profile, args.claims, deadline, i < args.writers, counts),
+            )
+            for i in range(args.readers + args.writers)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return {
+        "profile": profile_name,
+        "reads/s": counts["read"] / args.duration,
+        "writes/s": counts["write"] / args.duration,
+        "read locked": counts["read_locked"],
+        "write locked": counts["write_locked"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--claims", type=int, default=10000)
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        default=list(STORAGE_PROFILES),
+        choices=STORAGE_PROFILES,
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'profile':<10}{'reads/s':>12}{'writes/s':>12}{'read locked':>14}{'write locked':>14}"
+    )
+    for name in args.profiles:
+        r = run(name, args)
+        print(
+            f"{r['profile']:<10}{r['reads/s']:>12.0f}{r['writes/s']:>12.0f}"
+            f"{r['read locked']:>14}{r['write locked']:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
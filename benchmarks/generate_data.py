@@ -0,0 +1,403 @@
+"""
+Fill a database with synthetic users, policies, vehicles, devices, claims and
+checks, and the invoice store with synthetic invoice PDFs, for benchmarks and
+load tests. The same --seed against an empty database gives the same data,
+salted password hashes aside.
+
+    DATABASE=bench.db UPLOAD_FOLDER=bench-uploads/ \\
+        python benchmarks/generate_data.py --users 1000000
+
+The data is skewed the way production data is: most users hold one policy,
+claims per policy follow a Pareto distribution (most policies have none, a
+few have dozens), claim dates cluster in the recent past, and recent claims
+are still Pending or Reviewing while older ones are settled. Claims past
+Pending have the check catalogue's checks, resolved according to the claim's
+status. Every generated user logs in as user<id> with --password.
+
+Migrations are applied first. Rows are written with synchronous=OFF in one
+transaction per --chunk users; rerun from scratch if generation is
+interrupted.
+"""
+
+import argparse
+import io
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import migrate  # noqa: E402
+from checks import build_checks  # noqa: E402
+from db import DATABASE, configure_connection  # noqa: E402
+from invoices import store as invoice_store  # noqa: E402
+from passwords import hash_password  # noqa: E402
+from synthetic import (  # noqa: E402
+    CAUSES,
+    DEVICES,
+    STORES,
+    VEHICLES,
+    invoice_lines,
+    invoice_pdf,
+    person,
+    weighted,
+)
+
+POLICIES_PER_USER = [(1, 75), (2, 18), (3, 5), (5, 2)]
+DEVICE_POLICY_SHARE = 0.35
+PARETO_ALPHA = 1.3
+MAX_CLAIMS_PER_POLICY = 100
+# Claims younger than this many days may still be open
+OPEN_CLAIM_DAYS = 45
+SETTLED_STATUSES = [("Approved", 75), ("Denied", 20), ("Reviewing", 5)]
+OPEN_STATUSES = [("Pending", 35), ("Reviewing", 35), ("Approved", 20), ("Denied", 10)]
+
+CLAIM_COLUMNS = [
+    "id",
+    "policy_id",
+    "claim_date",
+    "damage_date",
+    "date_of_repair",
+    "invoices",
+    "invoice_sha256",
+    "invoice_size",
+    "invoice_mime_type",
+    "invoice_filename",
+    "status",
+    "status_message",
+    "internal_status",
+    "internal_status_message",
+    "cause_of_damage",
+]
+DEVICE_COLUMNS = [
+    "id",
+    "manufacturer",
+    "model",
+    "storage",
+    "serial_number",
+    "purchase_date",
+    "purchase_amount",
+    "purchase_location",
+    "depreciation_years",
+    "depreciation_rate",
+]
+
+
+def insert_sql(table, columns):
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))})"
+    )
+
+
+def claims_for_policy(rng, mean):
+    # Pareto(alpha) - 1 has mean 1 / (alpha - 1); scale it to the wanted mean
+    # and round up with probability of the fraction, which keeps the mean
+    count = (rng.paretovariate(PARETO_ALPHA) - 1) * mean * (PARETO_ALPHA - 1)
+    return min(int(count + rng.random()), MAX_CLAIMS_PER_POLICY)
+
+
+class Generator:
+    def __init__(self, conn, rng, args):
+        self.conn = conn
+        self.rng = rng
+        self.args = args
+        self.end_date = date.fromisoformat(args.end_date)
+        self.password = hash_password(args.password)
+        self.counts = dict.fromkeys(
+            ["User", "Policy", "Vehicles", "Devices", "Claims", "Checks", "Invoices"], 0
+        )
+        self.next_id = {
+            table: conn.execute(
+                f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}"
+            ).fetchone()[0]
+            for table in ["User", "Policy", "Vehicles", "Devices", "Claims"]
+        }
+        # Older databases lack some Devices columns (depreciation_years)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(Devices)")}
+        self.device_columns = [c for c in DEVICE_COLUMNS if c in existing]
+        self.invoice_pool = [
+            self.store_invoice(invoice_lines(rng, self.random_date(720)))
+            for _ in range(args.invoice_pool)
+        ]
+
+    def take_id(self, table):
+        value = self.next_id[table]
+        self.next_id[table] += 1
+        return value
+
+    def random_date(self, max_age_days):
+        # 1 - sqrt(u) puts more of the mass on recent dates
+        age = int(max_age_days * (1 - self.rng.random() ** 0.5))
+        return self.end_date - timedelta(days=age)
+
+    def store_invoice(self, lines):
+        pdf = invoice_pdf(lines)
+        self.counts["Invoices"] += 1
+        return invoice_store.save_stream(
+            io.BytesIO(pdf), "application/pdf", "invoice.pdf"
+        )
+
+    def vehicle(self, user_id):
+        make, model, _ = weighted(self.rng, VEHICLES)
+        vehicle_id = self.take_id("Vehicles")
+        return {
+            "id": vehicle_id,
+            "make": make,
+            "model": model,
+            "year": self.rng.randint(2005, self.end_date.year),
+            "license_plate": f"{self.rng.choice('ABCDEFGHJKLMNPRSTUVWXYZ')}{vehicle_id:07d}",
+            "drivers": str(user_id),
+        }
+
+    def device(self):
+        manufacturer, model, storage, price, _ = weighted(self.rng, DEVICES)
+        amount = round(price * self.rng.uniform(0.85, 1.1), 2)
+        device_id = self.take_id("Devices")
+        return {
+            "id": device_id,
+            "manufacturer": manufacturer,
+            "model": model,
+            "storage": self.rng.choice(storage),
+            "serial_number": f"SN{device_id:010d}",
+            "purchase_date": self.random_date(1095).isoformat(),
+            "purchase_amount": amount,
+            "purchase_location": self.rng.choice(STORES),
+            # The same depreciation DeviceList.post applies
+            "depreciation_years": 10 if amount > 5000 else 5,
+            "depreciation_rate": 0.10 if amount > 5000 else 0.20,
+        }
+
+    def claim(self, policy, holder):
+        claim_date = self.random_date(self.args.years * 365)
+        damage_date = claim_date - timedelta(days=self.rng.randint(1, 30))
+        repair_date = damage_date + timedelta(
+            days=self.rng.randint(0, (claim_date - damage_date).days)
+        )
+        age = (self.end_date - claim_date).days
+        status = weighted(
+            self.rng, OPEN_STATUSES if age < OPEN_CLAIM_DAYS else SETTLED_STATUSES
+        )[0]
+
+        if self.invoice_pool:
+            invoice = self.rng.choice(self.invoice_pool)
+        else:
+            invoice = self.store_invoice(
+                invoice_lines(
+                    self.rng,
+                    repair_date.isoformat(),
+                    (policy.get("vehicle") or {}).get("license_plate"),
+                    policy["policy_number"],
+                    f"{holder['first_name']} {holder['last_name']}",
+                )
+            )
+        return {
+            "id": self.take_id("Claims"),
+            "policy_id": policy["id"],
+            "claim_date": claim_date.isoformat(),
+            "damage_date": damage_date.isoformat(),
+            "date_of_repair": repair_date.isoformat(),
+            "invoices": invoice.key,
+            "invoice_sha256": invoice.sha256,
+            "invoice_size": invoice.size,
+            "invoice_mime_type": invoice.mime_type,
+            "invoice_filename": "invoice.pdf",
+            "status": status,
+            "status_message": None,
+            "internal_status": status,
+            "internal_status_message": None,
+            "cause_of_damage": (
+                self.rng.choice(CAUSES) if policy["type"] == "Device" else None
+            ),
+        }
+
+    def checks(self, claim, checks):
+        """
+        Rows for a claim's checks: all passed for approved claims, one to
+        three failed for denied ones, and partly reviewed for claims under
+        review.
+        """
+        statuses = ["Passed"] * len(checks)
+        if claim["status"] == "Denied":
+            for i in self.rng.sample(
+                range(len(checks)), min(len(checks), self.rng.randint(1, 3))
+            ):
+                statuses[i] = "Failed"
+        elif claim["status"] == "Reviewing":
+            statuses = [
+                self.rng.choice(["Pending", "Pending", "Passed"]) for _ in checks
+            ]
+        processed_at = f"{claim['claim_date']} 12:00:00"
+        return [
+            (
+                claim["id"],
+                name,
+                expected,
+                reviewed,
+                operator,
+                subject,
+                status,
+                None if status == "Pending" else "synthetic",
+                None if status == "Pending" else processed_at,
+            )
+            for (name, expected, reviewed, operator, subject), status in zip(
+                checks, statuses
+            )
+        ]
+
+    def chunk(self, users):
+        rows = {
+            name: []
+            for name in ["User", "Vehicles", "Devices", "Policy", "Claims", "Checks"]
+        }
+        for _ in range(users):
+            first_name, last_name = person(self.rng)
+            user_id = self.take_id("User")
+            holder = {"first_name": first_name, "last_name": last_name}
+            rows["User"].append(
+                (
+                    user_id,
+                    first_name,
+                    last_name,
+                    f"555-{self.rng.randint(0, 9999):04d}",
+                    f"user{user_id}@example.com",
+                    f"user{user_id}",
+                    self.password,
+                )
+            )
+            for _ in range(weighted(self.rng, POLICIES_PER_USER)[0]):
+                policy = {
+                    "id": self.take_id("Policy"),
+                    "type": (
+                        "Device"
+                        if self.rng.random() < DEVICE_POLICY_SHARE
+                        else "Windscreen"
+                    ),
+                    "user_id": user_id,
+                    "deductible": self.rng.choice([0.0, 50.0, 100.0, 250.0, 500.0]),
+                }
+                policy["policy_number"] = f"POL-{policy['id']:08d}"
+                if policy["type"] == "Device":
+                    policy["device"] = self.device()
+                    rows["Devices"].append(
+                        tuple(policy["device"][c] for c in self.device_columns)
+                    )
+                else:
+                    policy["vehicle"] = self.vehicle(user_id)
+                    rows["Vehicles"].append(tuple(policy["vehicle"].values()))
+                rows["Policy"].append(
+                    (
+                        policy["id"],
+                        policy["type"],
+                        user_id,
+                        policy["policy_number"],
+                        policy["deductible"],
+                        (policy.get("device") or {}).get("id"),
+                        (policy.get("vehicle") or {}).get("id"),
+                    )
+                )
+
+                checks = None
+                for _ in range(
+                    claims_for_policy(self.rng, self.args.claims_per_policy)
+                ):
+                    claim = self.claim(policy, holder)
+                    rows["Claims"].append(tuple(claim[c] for c in CLAIM_COLUMNS))
+                    if claim["status"] == "Pending":
+                        continue
+                    if checks is None:
+                        checks = build_checks(
+                            self.conn, {"policy": policy, "policy_holder": holder}
+                        )
+                    rows["Checks"].extend(self.checks(claim, checks))
+
+        self.conn.execute("BEGIN")
+        self.conn.executemany(
+            "INSERT INTO User (id, first_name, last_name, phone, email, username, password) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows["User"],
+        )
+        self.conn.executemany(
+            "INSERT INTO Vehicles (id, make, model, year, license_plate, drivers) VALUES (?, ?, ?, ?, ?, ?)",
+            rows["Vehicles"],
+        )
+        self.conn.executemany(
+            insert_sql("Devices", self.device_columns), rows["Devices"]
+        )
+        self.conn.executemany(
+            "INSERT INTO Policy (id, type, user_id, policy_number, deductible, device_id, vehicle_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows["Policy"],
+        )
+        self.conn.executemany(insert_sql("Claims", CLAIM_COLUMNS), rows["Claims"])
+        self.conn.executemany(
+            """
+            INSERT INTO ClaimsProcessingChecks
+            (claim_id, check_name, expected_value, reviewed_value, operator, subject, status, result_message, processed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows["Checks"],
+        )
+        self.conn.execute("COMMIT")
+        for name, table_rows in rows.items():
+            self.counts[name] += len(table_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--claims-per-policy", type=float, default=1.0, help="Mean claims per policy"
+    )
+    parser.add_argument("--years", type=int, default=3, help="Span of claim dates")
+    parser.add_argument(
+        "--end-date", default="2025-06-30", help="Date of the most recent claims"
+    )
+    parser.add_argument(
+        "--invoice-pool",
+        type=int,
+        default=500,
+        help="Distinct invoices shared by the claims; 0 writes one per claim, "
+        "matching its policy",
+    )
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--chunk", type=int, default=2000, help="Users per transaction")
+    args = parser.parse_args()
+
+    migrate.create_tables()
+    migrate.run_migrations()
+    migrate.seed_database()
+
+    conn = sqlite3.connect(DATABASE, isolation_level=None)
+    configure_connection(conn)
+    conn.execute("PRAGMA synchronous = OFF")
+    generator = Generator(conn, random.Random(args.seed), args)
+
+    started = time.perf_counter()
+    done = 0
+    while done < args.users:
+        users = min(args.chunk, args.users - done)
+        generator.chunk(users)
+        done += users
+        rows = sum(generator.counts.values())
+        elapsed = time.perf_counter() - started
+        print(
+            f"{done}/{args.users} users, {rows} rows, {rows / elapsed:,.0f} rows/s",
+            file=sys.stderr,
+        )
+    conn.execute("PRAGMA optimize")
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    for name, count in generator.counts.items():
+        print(f"{name:<10}{count:>12}")
+    print(f"{'seconds':<10}{elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
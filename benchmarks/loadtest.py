@@ -0,0 +1,511 @@
+"""
+Replay a mix of customer and agent traffic against customer_api and
+agent_api and report throughput and tail latency per endpoint.
+
+    python benchmarks/loadtest.py --clients 32 --seconds 60
+    python benchmarks/loadtest.py --database bench.db --uploads bench-uploads/ \\
+        --json today.json --baseline yesterday.json
+
+Without --customer-url and --agent-url, both APIs are started with serve.py
+against --database (or a fresh 2000 user database made with
+generate_data.py), with claim dispatch pointed at fake_otto, the stand-in
+workflow server, run by this script. Against running servers, point their
+OTTO_SERVER_URL at the fake workflow server address printed at startup, and
+pass the --database they use: the users, policies and claims to exercise are
+sampled from it.
+
+Clients pick a scenario per request by the --mix weights. Customer reads
+send If-None-Match with the last ETag they saw, like a browser; 304s count as
+successes. With --baseline, endpoints whose throughput fell or whose p99 rose
+by more than --tolerance are listed and the exit status is 1.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from werkzeug.serving import make_server
+
+from synthetic import invoice_lines, invoice_pdf
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import fake_otto  # noqa: E402
+
+MIX = {
+    "customer_login": 1,
+    "customer_policies": 30,
+    "customer_policy": 20,
+    "customer_claim_upload": 4,
+    "agent_claims_page": 10,
+    "agent_claim_policy": 5,
+    "agent_checks": 12,
+    "agent_check_update": 6,
+    "agent_bundle": 12,
+}
+
+
+def start_workflow_server(port):
+    """
+    Serve fake_otto, the stand-in for the workflow server, from a background
+    thread. Returns the server and its URL.
+    """
+    # Werkzeug logs every request, which would drown the report
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", port, fake_otto.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def wait_until_up(url, process=None):
+    for _ in range(300):
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server for {url} exited with {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_apis(args, workflow_url):
+    env = dict(
+        os.environ,
+        DATABASE=os.path.abspath(args.database),
+        UPLOAD_FOLDER=os.path.abspath(args.uploads) + "/",
+        OTTO_SERVER_URL=workflow_url,
+        CUSTOMER_API_BIND=f"127.0.0.1:{args.port}",
+        AGENT_API_BIND=f"127.0.0.1:{args.port + 1}",
+        WEB_WORKERS=str(args.workers),
+        SQL_LOG_SAMPLE_RATE="0",
+    )
+    servers = [
+        subprocess.Popen(
+            [sys.executable, "serve.py", name],
+            cwd=ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        for name in ["customer", "agent"]
+    ]
+    customer_url = f"http://127.0.0.1:{args.port}"
+    agent_url = f"http://127.0.0.1:{args.port + 1}"
+    wait_until_up(f"{customer_url}/system/features", servers[0])
+    wait_until_up(f"{agent_url}/swagger.json", servers[1])
+    return servers, customer_url, agent_url
+
+
+def generate_database(args, workdir):
+    args.database = os.path.join(workdir, "loadtest.db")
+    args.uploads = os.path.join(workdir, "uploads")
+    subprocess.run(
+        [sys.executable, "benchmarks/generate_data.py", "--users", "2000"],
+        cwd=ROOT,
+        env=dict(os.environ, DATABASE=args.database, UPLOAD_FOLDER=args.uploads + "/"),
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def sample_fixtures(args, rng):
+    """
+    Pick the generated users (with their policies) and the claims under
+    review (with their checks) that clients will use.
+    """
+    conn = sqlite3.connect(f"file:{os.path.abspath(args.database)}?mode=ro", uri=True)
+    max_user = conn.execute("SELECT MAX(id) FROM User").fetchone()[0] or 0
+    ids = rng.sample(range(1, max_user + 1), min(args.users * 4, max_user))
+    users = []
+    for user_id, username, policies in conn.execute(
+        f"""
+        SELECT u.id, u.username, group_concat(p.policy_number)
+        FROM User u JOIN Policy p ON p.user_id = u.id
+        WHERE u.username LIKE 'user%' AND u.id IN ({", ".join("?" * len(ids))})
+        GROUP BY u.id
+        """,
+        ids,
+    ):
+        users.append(
+            {"id": user_id, "username": username, "policies": policies.split(",")}
+        )
+    claims = [
+        {"id": claim_id, "checks": [int(c) for c in checks.split(",")]}
+        for claim_id, checks in conn.execute(
+            """
+            SELECT k.claim_id, group_concat(k.id)
+            FROM ClaimsProcessingChecks k JOIN Claims c ON c.id = k.claim_id
+            WHERE c.internal_status = 'Reviewing'
+            GROUP BY k.claim_id
+            LIMIT ?
+            """,
+            (args.claims,),
+        )
+    ]
+    conn.close()
+    if not users or not claims:
+        raise SystemExit(
+            "The database has no generated users or claims under review; "
+            "fill it with generate_data.py"
+        )
+    return users[: args.users], claims
+
+
+def log_in(args, customer_url, agent_url, users):
+    for user in users:
+        response = requests.post(
+            f"{customer_url}/users/login",
+            json={"username": user["username"], "password": args.password},
+        )
+        response.raise_for_status()
+        user["headers"] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = requests.post(
+        f"{agent_url}/login",
+        json={"username": "admin", "password": args.admin_password},
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+class Client:
+    """
+    One simulated client: a keep-alive session for each API, and the ETags
+    it has seen.
+    """
+
+    def __init__(self, load, rng):
+        self.load = load
+        self.rng = rng
+        self.customer = requests.Session()
+        self.agent = requests.Session()
+        self.etags = {}
+
+    def conditional_get(self, label, url, headers):
+        etag = self.etags.get(url)
+        if etag:
+            headers = {**headers, "If-None-Match": etag}
+        response = self.customer.get(url, headers=headers, timeout=30)
+        if response.headers.get("ETag"):
+            self.etags[url] = response.headers["ETag"]
+        return label, response
+
+    def customer_login(self):
+        user = self.rng.choice(self.load.users)
+        return "POST /users/login", self.customer.post(
+            f"{self.load.customer_url}/users/login",
+            json={"username": user["username"], "password": self.load.password},
+            timeout=30,
+        )
+
+    def customer_policies(self):
+        user = self.rng.choice(self.load.users)
+        return self.conditional_get(
+            "GET /users/<id>/policies",
+            f"{self.load.customer_url}/users/{user['id']}/policies",
+            user["headers"],
+        )
+
+    def customer_policy(self):
+        user = self.rng.choice(self.load.users)
+        return self.conditional_get(
+            "GET /users/<id>/policies/<number>",
+            f"{self.load.customer_url}/users/{user['id']}/policies/"
+            f"{self.rng.choice(user['policies'])}",
+            user["headers"],
+        )
+
+    def customer_claim_upload(self):
+        user = self.rng.choice(self.load.users)
+        return "POST /users/<id>/policies/<number>/claims", self.customer.post(
+            f"{self.load.customer_url}/users/{user['id']}/policies/"
+            f"{self.rng.choice(user['policies'])}/claims",
+            files={
+                "invoice": (
+                    "invoice.pdf",
+                    self.rng.choice(self.load.invoices),
+                    "application/pdf",
+                )
+            },
+            data={
+                "claim_date": "2025-06-20",
+                "damage_date": "2025-06-10",
+                "date_of_repair": "2025-06-15",
+            },
+            headers=user["headers"],
+            timeout=30,
+        )
+
+    def agent_claims_page(self):
+        return "GET /claims", self.agent.get(
+            f"{self.load.agent_url}/claims",
+            params={"status": "Reviewing", "limit": 50},
+            headers=self.load.admin_headers,
+            timeout=30,
+        )
+
+    def agent_claim_policy(self):
+        claim = self.rng.choice(self.load.claims)
+        return "GET /claims/<id>/policy", self.agent.get(
+            f"{self.load.agent_url}/claims/{claim['id']}/policy",
+            headers=self.load.admin_headers,
+            timeout=30,
+        )
+
+    def agent_checks(self):
+        claim = self.rng.choice(self.load.claims)
+        return "GET /claims/<id>/checks", self.agent.get(
+            f"{self.load.agent_url}/claims/{claim['id']}/checks",
+            headers=self.load.admin_headers,
+            timeout=30,
+        )
+
+    def agent_check_update(self):
+        claim = self.rng.choice(self.load.claims)
+        return "PUT /claims/<id>/checks/<check_id>", self.agent.put(
+            f"{self.load.agent_url}/claims/{claim['id']}/checks/"
+            f"{self.rng.choice(claim['checks'])}",
+            json={
+                "status": self.rng.choice(["Passed", "Failed"]),
+                "result_message": "load test",
+                "reviewed_value": "checked",
+            },
+            headers=self.load.admin_headers,
+            timeout=30,
+        )
+
+    def agent_bundle(self):
+        claim = self.rng.choice(self.load.claims)
+        return "GET /claims/<id>/bundle", self.agent.get(
+            f"{self.load.agent_url}/claims/{claim['id']}/bundle",
+            headers=self.load.admin_headers,
+            timeout=30,
+        )
+
+
+class LoadTest:
+    def __init__(self, args, customer_url, agent_url, users, claims, admin_headers):
+        self.customer_url = customer_url
+        self.agent_url = agent_url
+        self.users = users
+        self.claims = claims
+        self.admin_headers = admin_headers
+        self.password = args.password
+        self.mix = args.mix
+        self.clients = args.clients
+        self.seed = args.seed
+        rng = random.Random(args.seed)
+        self.invoices = [
+            invoice_pdf(invoice_lines(rng, "2025-06-15")) for _ in range(20)
+        ]
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def client(self, index, measure_from, deadline):
+        client = Client(self, random.Random(self.seed * 1000 + index))
+        scenarios = [getattr(client, name) for name in self.mix]
+        weights = list(self.mix.values())
+        results = {}
+        while time.perf_counter() < deadline:
+            scenario = client.rng.choices(scenarios, weights)[0]
+            started = time.perf_counter()
+            try:
+                label, response = scenario()
+                ok = response.status_code < 400
+            except requests.RequestException as e:
+                label, ok = scenario.__name__, False
+                print(f"{label}: {e}", file=sys.stderr)
+            elapsed = time.perf_counter() - started
+            if started < measure_from:
+                continue
+            latencies, errors = results.setdefault(label, ([], [0]))
+            latencies.append(elapsed)
+            if not ok:
+                errors[0] += 1
+        with self.lock:
+            for label, (latencies, errors) in results.items():
+                total_latencies, total_errors = self.results.setdefault(
+                    label, ([], [0])
+                )
+                total_latencies.extend(latencies)
+                total_errors[0] += errors[0]
+
+    def run(self, seconds, warmup):
+        measure_from = time.perf_counter() + warmup
+        deadline = measure_from + seconds
+        threads = [
+            threading.Thread(target=self.client, args=(i, measure_from, deadline))
+            for i in range(self.clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(self.results, seconds)
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+
+def summarize(results, seconds):
+    summary = {}
+    for label, (latencies, errors) in sorted(results.items()):
+        ordered = sorted(latencies)
+        summary[label] = {
+            "requests": len(ordered),
+            "per_second": len(ordered) / seconds,
+            "errors": errors[0],
+            "p50_ms": percentile(ordered, 0.50),
+            "p95_ms": percentile(ordered, 0.95),
+            "p99_ms": percentile(ordered, 0.99),
+            "max_ms": ordered[-1] * 1000,
+        }
+    return summary
+
+
+def print_summary(summary):
+    width = max([len(label) for label in summary] + [8])
+    print(
+        f"{'endpoint':<{width}} {'requests':>9} {'req/s':>8} {'errors':>7} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    for label, row in summary.items():
+        print(
+            f"{label:<{width}} {row['requests']:>9} {row['per_second']:>8.1f} "
+            f"{row['errors']:>7} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+            f"{row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}"
+        )
+
+
+def regressions(summary, baseline, tolerance):
+    found = []
+    for label, row in summary.items():
+        before = baseline.get(label)
+        if before is None:
+            continue
+        if row["per_second"] < before["per_second"] * (1 - tolerance):
+            found.append(
+                f"{label}: {before['per_second']:.1f} -> {row['per_second']:.1f} req/s"
+            )
+        if row["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            found.append(
+                f"{label}: p99 {before['p99_ms']:.1f} -> {row['p99_ms']:.1f} ms"
+            )
+    return found
+
+
+def parse_mix(value):
+    mix = dict(MIX)
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in MIX:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name.strip()}")
+        mix[name.strip()] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=dict(MIX),
+        help="Scenario weights to change, e.g. customer_login=0,agent_bundle=20",
+    )
+    parser.add_argument("--database", help="Database filled by generate_data.py")
+    parser.add_argument("--uploads", help="Its UPLOAD_FOLDER")
+    parser.add_argument("--customer-url")
+    parser.add_argument("--agent-url")
+    parser.add_argument("--port", type=int, default=5910)
+    parser.add_argument("--workflow-port", type=int, default=5909)
+    parser.add_argument("--workers", type=int, default=2, help="WEB_WORKERS per API")
+    parser.add_argument("--users", type=int, default=200, help="Customers to log in")
+    parser.add_argument("--claims", type=int, default=500, help="Claims to review")
+    parser.add_argument("--password", default="password")
+    parser.add_argument(
+        "--admin-password", default=os.getenv("ADMIN_PASSWORD", "samsonite")
+    )
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    external = bool(args.customer_url and args.agent_url)
+    if external and not args.database:
+        parser.error("--database is needed to sample fixtures from running servers")
+
+    workflow, workflow_url = start_workflow_server(args.workflow_port)
+    print(f"Fake workflow server at {workflow_url}", file=sys.stderr)
+
+    rng = random.Random(args.seed)
+    servers = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if not args.database:
+                generate_database(args, workdir)
+            if external:
+                customer_url, agent_url = args.customer_url, args.agent_url
+            else:
+                if not args.uploads:
+                    parser.error("--uploads is needed with --database")
+                servers, customer_url, agent_url = start_apis(args, workflow_url)
+            users, claims = sample_fixtures(args, rng)
+            admin_headers = log_in(args, customer_url, agent_url, users)
+            load = LoadTest(args, customer_url, agent_url, users, claims, admin_headers)
+            summary = load.run(args.seconds, args.warmup)
+        finally:
+            for server in servers:
+                server.terminate()
+            for server in servers:
+                server.wait()
+        workflow.shutdown()
+
+    print_summary(summary)
+    total = sum(row["requests"] for row in summary.values())
+    print(
+        f"{total / args.seconds:.1f} req/s in total, "
+        f"{len(fake_otto.invocations)} workflow invocations received"
+    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "clients": args.clients,
+                    "seconds": args.seconds,
+                    "endpoints": summary,
+                },
+                f,
+                indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(summary, json.load(f)["endpoints"], args.tolerance)
+        for line in found:
+            print(f"Regression: {line}")
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
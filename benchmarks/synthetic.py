@@ -0,0 +1,121 @@
+"""
+Catalogues and document builders shared by generate_data.py and
+loadtest.py. Only uses the standard library, so importing it has no effect
+on the database or the invoice store.
+"""
+
+FIRST_NAMES = """
+    James Mary John Patricia Robert Jennifer Michael Linda William Elizabeth
+    David Barbara Richard Susan Joseph Jessica Thomas Sarah Charles Karen
+    Daniel Nancy Matthew Lisa Anthony Betty Mark Margaret
+""".split()
+LAST_NAMES = """
+    Smith Johnson Williams Brown Jones Garcia Miller Davis Rodriguez Martinez
+    Hernandez Lopez Gonzalez Wilson Anderson Thomas Taylor Moore Jackson Martin
+""".split()
+
+# (make, model, weight); weights skew towards the common models
+VEHICLES = [
+    ("Toyota", "Corolla", 12),
+    ("Toyota", "RAV4", 10),
+    ("Honda", "Civic", 9),
+    ("Ford", "F-150", 9),
+    ("Volkswagen", "Golf", 7),
+    ("Tesla", "Model 3", 6),
+    ("BMW", "3 Series", 4),
+    ("Subaru", "Outback", 4),
+    ("Kia", "Sportage", 4),
+    ("Mercedes-Benz", "C-Class", 3),
+    ("Volvo", "XC60", 2),
+    ("Mazda", "CX-5", 3),
+]
+# (manufacturer, model, storage options, list price, weight)
+DEVICES = [
+    ("Apple", "iPhone 15", ["128GB", "256GB", "512GB"], 999, 14),
+    ("Apple", "iPhone 14", ["128GB", "256GB"], 799, 9),
+    ("Samsung", "Galaxy S24", ["128GB", "256GB"], 899, 9),
+    ("Google", "Pixel 8", ["128GB", "256GB"], 699, 5),
+    ("Apple", "MacBook Pro", ["512GB", "1TB"], 2499, 4),
+    ("Dell", "XPS 13", ["512GB", "1TB"], 1399, 3),
+    ("Apple", "iPad Air", ["64GB", "256GB"], 599, 5),
+    ("Canon", "EOS R5", [None], 6999, 1),
+]
+STORES = ["Apple Store", "Best Buy", "Amazon", "Carrier Store", "Costco"]
+SHOPS = ["Safelite AutoGlass", "Glass Doctor", "ACME Auto Glass", "Speedy Glass"]
+CAUSES = ["Cracked screen", "Water damage", "Dropped", "Battery failure", None]
+
+
+def weighted(rng, items, weight=lambda item: item[-1]):
+    return rng.choices(items, weights=[weight(item) for item in items])[0]
+
+
+def person(rng):
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def invoice_lines(
+    rng, invoice_date, license_plate=None, policy_number=None, customer_name=None
+):
+    """
+    The text lines of a windscreen repair invoice in the layout the
+    extraction parser reads, with line items priced around the check
+    catalogue's limits.
+    """
+    items = [
+        ("Windscreen glass", rng.uniform(250, 700)),
+        ("Labor installation", rng.uniform(60, 180)),
+        ("Urethane adhesive", rng.uniform(15, 50)),
+        ("Moulding clips", rng.uniform(3, 14)),
+    ]
+    if rng.random() < 0.4:
+        items.append(("Camera calibration", rng.uniform(60, 130)))
+    if rng.random() < 0.2:
+        items.append(("Rain sensor gel pad", rng.uniform(5, 15)))
+    total = sum(price for _, price in items)
+
+    lines = [rng.choice(SHOPS), f"Invoice Date: {invoice_date}"]
+    if customer_name:
+        lines.append(f"Bill To: {customer_name}")
+    if policy_number:
+        lines.append(f"Policy Number: {policy_number}")
+    if license_plate:
+        lines.append(f"License Plate: {license_plate}")
+    lines += [f"{name} 1 {price:.2f} {price:.2f}" for name, price in items]
+    lines.append(f"Total Due: ${total:.2f}")
+    return lines
+
+
+def pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def invoice_pdf(lines):
+    """
+    A one page PDF with the given lines as its text layer.
+    """
+    content = (
+        "BT /F1 11 Tf 50 750 Td 16 TL "
+        + " ".join(f"({pdf_escape(line)}) Tj T*" for line in lines)
+        + " ET"
+    )
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R"
+        " /Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(content)} >>\nstream\n{content}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n"
+    ).encode("latin-1")
+    return out
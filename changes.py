@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import time
+
+from db import pool
+from metrics import get_logger
+
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "500"))
+CHANGES_MAX_WAIT = float(os.getenv("CHANGES_MAX_WAIT", "30"))
+# Writers in this process wake waiting readers directly; changes committed by
+# other processes (e.g. claim creation in customer_api) are picked up by
+# polling at this interval
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", "1"))
+CHANGES_HEARTBEAT = float(os.getenv("CHANGES_HEARTBEAT", "15"))
+# A stream ends after this many seconds and the EventSource reconnects with
+# Last-Event-ID, so streams do not hold request threads indefinitely
+CHANGES_STREAM_MAX_AGE = float(os.getenv("CHANGES_STREAM_MAX_AGE", "300"))
+# Changes older than this are pruned; clients further behind must resync.
+# 0 keeps every change.
+CHANGES_RETENTION_DAYS = float(os.getenv("CHANGES_RETENTION_DAYS", "7"))
+CHANGES_PRUNE_INTERVAL = float(os.getenv("CHANGES_PRUNE_INTERVAL", "3600"))
+CHANGES_PRUNE_BATCH = int(os.getenv("CHANGES_PRUNE_BATCH", "10000"))
+
+log = get_logger(__name__)
+
+# Claim columns carried in a claim change
+CLAIM_CHANGE_FIELDS = [
+    "id",
+    "policy_id",
+    "claim_date",
+    "damage_date",
+    "date_of_repair",
+    "status",
+    "status_message",
+    "internal_status",
+    "internal_status_message",
+]
+
+_changed = threading.Condition()
+_generation = 0
+
+
+def record_claim_change(conn, claim_id):
+    """
+    Append the current state of a claim to ClaimChanges. Runs on the caller's
+    connection and does not commit, so the change is published together with
+    the write it describes.
+    """
+    claim = conn.execute(
+        f"SELECT {', '.join(CLAIM_CHANGE_FIELDS)} FROM Claims WHERE id = ?",
+        (claim_id,),
+    ).fetchone()
+    if claim is None:
+        return
+    conn.execute(
+        "INSERT INTO ClaimChanges (entity, entity_id, claim_id, payload) VALUES ('claim', ?, ?, ?)",
+        (claim_id, claim_id, json.dumps(dict(claim))),
+    )
+
+
+def record_check_changes(conn, claim_id, check_ids=None):
+    """
+    Append the current state of a claim's checks (all of them, or only
+    ``check_ids``) to ClaimChanges. Does not commit.
+    """
+    query = "SELECT * FROM ClaimsProcessingChecks WHERE claim_id = ?"
+    params = [claim_id]
+    if check_ids is not None:
+        if not check_ids:
+            return
+        query += f" AND id IN ({', '.join('?' * len(check_ids))})"
+        params.extend(check_ids)
+    checks = conn.execute(query + " ORDER BY id", params).fetchall()
+    conn.executemany(
+        "INSERT INTO ClaimChanges (entity, entity_id, claim_id, payload) VALUES ('check', ?, ?, ?)",
+        [
+            (check["id"], claim_id, json.dumps(dict(check), default=str))
+            for check in checks
+        ],
+    )
+
+
+def notify_changes():
+    """
+    Wake readers waiting in this process. Call after committing a change.
+    """
+    global _generation
+    with _changed:
+        _generation += 1
+        _changed.notify_all()
+
+
+def latest_seq(conn):
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM ClaimChanges").fetchone()[0]
+
+
+def oldest_kept_seq(conn):
+    """
+    The sequence of the oldest change still in the feed, or of the next one
+    when everything has been pruned.
+    """
+    oldest = conn.execute("SELECT MIN(seq) FROM ClaimChanges").fetchone()[0]
+    if oldest is not None:
+        return oldest
+    last = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'ClaimChanges'"
+    ).fetchone()
+    return (last[0] if last else 0) + 1
+
+
+def is_pruned(conn, since):
+    """
+    Whether changes after ``since`` have been pruned, so a client resuming
+    from it would miss some and has to reload instead.
+    """
+    return since + 1 < oldest_kept_seq(conn)
+
+
+def prune_changes(conn, retention_days=CHANGES_RETENTION_DAYS):
+    """
+    Delete the changes older than ``retention_days``, in batches with a
+    commit after each. Returns the number of changes deleted.
+    """
+    # seq follows created_at, so everything before the first change to keep
+    # goes
+    keep = conn.execute(
+        "SELECT seq FROM ClaimChanges WHERE created_at >= datetime('now', ?) ORDER BY seq LIMIT 1",
+        (f"-{retention_days} days",),
+    ).fetchone()
+    end = keep[0] if keep else latest_seq(conn) + 1
+    deleted = 0
+    while True:
+        cursor = conn.execute(
+            "DELETE FROM ClaimChanges WHERE seq IN (SELECT seq FROM ClaimChanges WHERE seq < ? ORDER BY seq LIMIT ?)",
+            (end, CHANGES_PRUNE_BATCH),
+        )
+        conn.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < CHANGES_PRUNE_BATCH:
+            return deleted
+
+
+class ChangePruner(threading.Thread):
+    """
+    Periodically prunes the change feed down to CHANGES_RETENTION_DAYS.
+    """
+
+    def __init__(self, interval=CHANGES_PRUNE_INTERVAL):
+        super().__init__(name="change-pruner", daemon=True)
+        self.interval = interval
+        self.pruned = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                with pool.connection() as conn:
+                    self.pruned += prune_changes(conn)
+            except Exception as e:
+                log.error("Pruning the change feed failed: %s", e)
+            if self._stop_event.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_pruner = None
+
+
+def start_change_pruner():
+    global _pruner
+    if not CHANGES_RETENTION_DAYS:
+        return None
+    if _pruner is None or not _pruner.is_alive():
+        _pruner = ChangePruner()
+        _pruner.start()
+    return _pruner
+
+
+def fetch_changes(conn, since, limit=CHANGES_PAGE_SIZE):
+    rows = conn.execute(
+        "SELECT seq, entity, entity_id, claim_id, payload, created_at FROM ClaimChanges WHERE seq > ? ORDER BY seq LIMIT ?",
+        (since, limit),
+    ).fetchall()
+    return [
+        {
+            "seq": row["seq"],
+            "entity": row["entity"],
+            "entity_id": row["entity_id"],
+            "claim_id": row["claim_id"],
+            "data": json.loads(row["payload"]),
+            "created_at": row["created_at"],
+        }
+        for row in rows
+    ]
+
+
+def wait_for_changes(since, timeout, limit=CHANGES_PAGE_SIZE):
+    """
+    Return the changes after ``since``, waiting up to ``timeout`` seconds for
+    one to arrive. Checks out a pooled connection only while querying, so a
+    waiting client does not hold one.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        with _changed:
+            generation = _generation
+        with pool.connection() as conn:
+            changes = fetch_changes(conn, since, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        with _changed:
+            if _generation == generation:
+                _changed.wait(min(remaining, CHANGES_POLL_INTERVAL))
+
+
+def stream_changes(since, max_age=CHANGES_STREAM_MAX_AGE):
+    """
+    Generate Server-Sent Events for every change after ``since``, with a
+    comment line as a heartbeat when nothing changes for CHANGES_HEARTBEAT
+    seconds. The event id is the change sequence, so a reconnecting
+    EventSource resumes from Last-Event-ID. The stream ends after
+    ``max_age`` seconds.
+    """
+    yield "retry: 3000\n\n"
+    deadline = time.monotonic() + max_age
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            # An id without data only moves the client's Last-Event-ID, so it
+            # resumes from here even if no change arrived on this stream
+            yield f"id: {since}\n\n"
+            return
+        changes = wait_for_changes(since, min(CHANGES_HEARTBEAT, remaining))
+        if not changes:
+            yield ": keepalive\n\n"
+            continue
+        for change in changes:
+            yield (
+                f"id: {change['seq']}\n"
+                f"event: {change['entity']}\n"
+                f"data: {json.dumps(change)}\n\n"
+            )
+            since = change["seq"]
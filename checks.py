@@ -0,0 +1,341 @@
+import math
+import operator
+import re
+import string
+import threading
+
+from collections import namedtuple
+from datetime import datetime
+
+CheckRule = namedtuple(
+    "CheckRule", "policy_type version position check_name render operator subject"
+)
+
+# expected_value forms the evaluator understands
+FACT_COMPARISON = re.compile(r"^(\w+)\s*(<=|>=|<|>|=)\s*(\w+)$")
+DATE_DELTA = re.compile(r"^delta between (\w+) and (\w+) <= (\d+)$")
+COST_RANGE = re.compile(
+    r"^(\d+(?:\.\d+)?)\s*<=\s*cost\s*<=\s*(\d+(?:\.\d+)?)( or not present)?$"
+)
+# Amounts given as text must be a plain decimal, optionally after a currency sign
+AMOUNT = re.compile(r"^[$€£]?\s*([-+]?\d+(?:\.\d+)?)$")
+
+COMPARATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "=": operator.eq,
+}
+
+_formatter = string.Formatter()
+
+
+def compile_template(template):
+    """
+    Compile an expected_value template from ClaimCheckRules into a function
+    of the combined policy object. Templates use str.format syntax against
+    the combined policy, e.g. "{policy[vehicle][license_plate]}". A template
+    that is a single field keeps the field's value as is (including None);
+    anything else renders to a string.
+    """
+    if template is None:
+        return lambda policy_obj: None
+
+    parsed = list(_formatter.parse(template))
+    fields = [field for _, field, _, _ in parsed if field is not None]
+    if not fields:
+        return lambda policy_obj: template
+
+    if len(parsed) == 1 and parsed[0][0] == "" and not parsed[0][2]:
+        field = parsed[0][1]
+        return lambda policy_obj: _formatter.get_field(field, (), policy_obj)[0]
+
+    return lambda policy_obj: template.format_map(policy_obj)
+
+
+class CheckRuleRegistry:
+    """
+    The active check catalogue, loaded from ClaimCheckRules and kept in
+    memory with its templates compiled. For each policy type the highest
+    active version is used. Triggers bump CheckRuleGeneration on every
+    change to ClaimCheckRules; the catalogue is loaded again when the
+    generation differs from the one it was loaded at, so every process
+    sharing the database picks up changes.
+    """
+
+    def __init__(self):
+        self._rules = None
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def generation(self, conn):
+        row = conn.execute("SELECT generation FROM CheckRuleGeneration").fetchone()
+        return row[0] if row else 0
+
+    def load(self, conn):
+        # Read before the rules: a change in between only causes another load
+        generation = self.generation(conn)
+        rows = conn.execute(
+            """
+            SELECT r.policy_type, r.version, r.position, r.check_name, r.expected_value, r.operator, r.subject
+            FROM ClaimCheckRules r
+            WHERE r.active = 1 AND r.version = (
+                SELECT MAX(version) FROM ClaimCheckRules
+                WHERE policy_type = r.policy_type AND active = 1
+            )
+            ORDER BY r.policy_type, r.position
+            """
+        ).fetchall()
+
+        rules = {}
+        for row in rows:
+            rules.setdefault(row["policy_type"], []).append(
+                CheckRule(
+                    policy_type=row["policy_type"],
+                    version=row["version"],
+                    position=row["position"],
+                    check_name=row["check_name"],
+                    render=compile_template(row["expected_value"]),
+                    operator=row["operator"],
+                    subject=row["subject"],
+                )
+            )
+        with self._lock:
+            self._rules = rules
+            self._generation = generation
+        return rules
+
+    def reload(self, conn):
+        """
+        Bump the generation so that every process loads the catalogue again
+        on its next use, and load it in this one. Commits.
+        """
+        conn.execute("UPDATE CheckRuleGeneration SET generation = generation + 1")
+        conn.commit()
+        return self.load(conn)
+
+    def rules(self, conn):
+        rules = self._rules
+        if rules is None or self._generation != self.generation(conn):
+            rules = self.load(conn)
+        return rules
+
+    def rules_for(self, conn, policy_type):
+        return self.rules(conn).get(policy_type, [])
+
+    def versions(self, conn):
+        rules = self.rules(conn)
+        return {
+            policy_type: type_rules[0].version
+            for policy_type, type_rules in rules.items()
+        }
+
+
+registry = CheckRuleRegistry()
+
+
+def build_checks(conn, policy_obj):
+    """
+    Render the check list for a claim's combined policy object as
+    (check_name, expected_value, reviewed_value, operator, subject) tuples.
+    """
+    return [
+        (rule.check_name, rule.render(policy_obj), None, rule.operator, rule.subject)
+        for rule in registry.rules_for(conn, policy_obj["policy"]["type"])
+    ]
+
+
+def create_checks(conn, claim_id, checks):
+    """
+    Insert a claim's processing checks with a single executemany. Checks the
+    claim already has are skipped. Does not commit; the caller owns the
+    transaction.
+    """
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO ClaimsProcessingChecks
+        (claim_id, check_name, expected_value, reviewed_value, operator, subject, status, result_message, processed_at)
+        VALUES (?, ?, ?, ?, ?, ?, 'Pending', NULL, NULL)
+        """,
+        [(claim_id, *check) for check in checks],
+    )
+
+
+def lookup(facts, path):
+    value = facts
+    for key in path.split("."):
+        if not isinstance(value, dict) or value.get(key) is None:
+            return None
+        value = value[key]
+    return value
+
+
+def parse_date(value):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+
+
+def parse_amount(value):
+    """
+    The amount in a number, or in a string such as "120", "120.50" or
+    "$120.50". Anything else is unclear and gives None, including thousands
+    separators: "1.234,00" and "1,234.00" cannot be told apart safely.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+    if not isinstance(value, str):
+        return None
+    match = AMOUNT.match(value.strip())
+    return float(match.group(1)) if match else None
+
+
+def normalize(value):
+    # Plates, policy numbers and names compare without case, spacing or punctuation
+    return re.sub(r"[^0-9A-Z]", "", str(value).upper())
+
+
+def outcome(passed, reviewed_value, detail):
+    return (
+        "Passed" if passed else "Failed",
+        reviewed_value,
+        f"Evaluated automatically: {detail}",
+    )
+
+
+def evaluate_check(check, facts):
+    """
+    Decide a check from facts about its claim. ``check`` needs the
+    expected_value, operator and subject columns. Returns (status,
+    reviewed_value, result_message), or None when the check needs judgment or
+    a fact it depends on is missing.
+    """
+    expected = check["expected_value"]
+    subject = check["subject"]
+    if expected is None:
+        return None
+
+    if subject is None:
+        match = FACT_COMPARISON.match(expected)
+        if match:
+            left_name, op, right_name = match.groups()
+            left = parse_date(lookup(facts, left_name))
+            right = parse_date(lookup(facts, right_name))
+            if left is None or right is None:
+                return None
+            return outcome(
+                COMPARATORS[op](left, right),
+                f"{left_name}={left.date()}, {right_name}={right.date()}",
+                f"{left_name} {left.date()} {op} {right_name} {right.date()}",
+            )
+
+        match = DATE_DELTA.match(expected)
+        if match:
+            left_name, right_name, days = match.groups()
+            left = parse_date(lookup(facts, left_name))
+            right = parse_date(lookup(facts, right_name))
+            if left is None or right is None:
+                return None
+            delta = abs((left.date() - right.date()).days)
+            return outcome(
+                delta <= int(days),
+                f"{delta} days",
+                f"{left_name} {left.date()} and {right_name} {right.date()} are {delta} days apart (limit {days})",
+            )
+        return None
+
+    match = COST_RANGE.match(expected)
+    if match:
+        low, high, optional = match.groups()
+        parent, _, item = subject.rpartition(".")
+        items = lookup(facts, parent) if parent else facts
+        # Without extracted line items, or with line items in a shape other
+        # than costs per kind, there is nothing to decide on
+        if not isinstance(items, dict):
+            return None
+        costs = items.get(item)
+        if costs is None:
+            if optional:
+                return outcome(True, "not present", f"no {item} line on the invoice")
+            return None
+        if not isinstance(costs, list):
+            costs = [costs]
+        amounts = [parse_amount(cost) for cost in costs]
+        if None in amounts:
+            return None
+        in_range = all(float(low) <= amount <= float(high) for amount in amounts)
+        reviewed = ", ".join(f"{amount:.2f}" for amount in amounts)
+        return outcome(
+            in_range,
+            reviewed,
+            f"{item} cost {reviewed} {'within' if in_range else 'outside'} {low}-{high}",
+        )
+
+    actual = lookup(facts, subject)
+    if actual is None:
+        return None
+
+    op = check["operator"]
+    if op in ("<", "<=", ">", ">="):
+        actual_amount = parse_amount(actual)
+        expected_amount = parse_amount(expected)
+        if actual_amount is None or expected_amount is None:
+            return None
+        return outcome(
+            COMPARATORS[op](actual_amount, expected_amount),
+            f"{actual_amount:.2f}",
+            f"{subject} {actual_amount:.2f} {op} {expected_amount:.2f}",
+        )
+    # A rule rendering to an empty value would match anything; the reviewer
+    # decides until it is fixed
+    if op in ("=", "IN") and not normalize(expected):
+        return None
+    if op == "=":
+        return outcome(
+            normalize(actual) == normalize(expected),
+            str(actual),
+            f"{subject} {actual!r} = {expected!r}",
+        )
+    if op == "IN":
+        found = normalize(expected) in normalize(actual)
+        return outcome(
+            found,
+            expected if found else "not found",
+            f"{expected!r} {'found' if found else 'not found'} in {subject}",
+        )
+    return None
+
+
+def evaluate_claim_checks(conn, claim_id, facts):
+    """
+    Evaluate a claim's pending checks against ``facts`` and record every one
+    that can be decided as Passed or Failed. The rest stay Pending for the
+    agent. Does not commit; returns the ids of the checks decided.
+    """
+    checks = conn.execute(
+        "SELECT id, expected_value, operator, subject FROM ClaimsProcessingChecks WHERE claim_id = ? AND status = 'Pending'",
+        (claim_id,),
+    ).fetchall()
+
+    processed_at = datetime.now()
+    updates = []
+    for check in checks:
+        result = evaluate_check(check, facts)
+        if result is not None:
+            updates.append((*result, processed_at, check["id"]))
+
+    conn.executemany(
+        """
+        UPDATE ClaimsProcessingChecks
+        SET status = ?, reviewed_value = ?, result_message = ?, processed_at = ?
+        WHERE id = ? AND status = 'Pending'
+        """,
+        updates,
+    )
+    return [update[-1] for update in updates]
@@ -0,0 +1,448 @@
+"""
+Bulk claim import and export.
+
+    python claims_tool.py import claims.jsonl --invoices ./invoices
+    python claims_tool.py export claims claims.jsonl
+    python claims_tool.py export checks checks.parquet
+
+Import reads JSONL or CSV records with policy_number, claim_date,
+damage_date, date_of_repair and invoice (a file name under --invoices), and
+optionally cause_of_damage, status, status_message, internal_status and
+internal_status_message. Invoices go into the content-addressed invoice
+store; claims are inserted --batch-size at a time, one transaction per
+batch. No workflow invocations are queued unless --dispatch is given; note
+that with the claim scheduler enabled, claims imported as internal_status
+Pending are still picked up by it, so backfill historic claims with their
+final status.
+
+Each batch commits together with the import's checkpoint, so rerunning an
+interrupted import resumes after the last committed record. Records that
+cannot be imported are reported and skipped.
+
+Export streams Claims or ClaimsProcessingChecks in id order as JSONL, or as
+Parquet when pyarrow is installed, from one read transaction.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from datetime import datetime
+from functools import lru_cache
+
+from dateutil import parser as date_parser
+
+from changes import record_claim_change
+from db import DATABASE, configure_connection
+from dispatch import enqueue_claim_dispatch
+from invoices import store as invoice_store
+from scheduler import CLAIM_SCHEDULER_ENABLED
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "5"))
+
+EXPORT_TABLES = {"claims": "Claims", "checks": "ClaimsProcessingChecks"}
+FORMATS = {
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".json": "jsonl",
+    ".csv": "csv",
+    ".parquet": "parquet",
+}
+
+CLAIM_STATUSES = {"Pending", "Reviewing", "Approved", "Denied"}
+INTERNAL_STATUSES = CLAIM_STATUSES | {"Scheduled", "2nd Level Review"}
+CLAIM_DATES = ["claim_date", "damage_date", "date_of_repair"]
+TEXT_FIELDS = [
+    "invoice",
+    "status",
+    "status_message",
+    "internal_status",
+    "internal_status_message",
+    "cause_of_damage",
+]
+
+
+class RecordError(Exception):
+    pass
+
+
+class Progress:
+    """
+    Counts rows and prints the rate to stderr at most every
+    PROGRESS_INTERVAL seconds, and once more when done.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.started = time.perf_counter()
+        self._reported = self.started
+
+    def add(self, n):
+        self.count += n
+        now = time.perf_counter()
+        if now - self._reported >= PROGRESS_INTERVAL:
+            self._reported = now
+            self.report()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def report(self, suffix=""):
+        print(
+            f"{self.label}: {self.count} rows, {self.rate():,.0f} rows/s{suffix}",
+            file=sys.stderr,
+        )
+
+
+def connect():
+    conn = sqlite3.connect(DATABASE, isolation_level=None)
+    configure_connection(conn)
+    return conn
+
+
+def format_for(path, requested=None):
+    if requested:
+        return requested
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise SystemExit(f"Cannot tell the format of {path}; pass --format")
+    return fmt
+
+
+def is_utf8(text):
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def parse_json_record(line):
+    if not is_utf8(line):
+        return RecordError("not valid UTF-8")
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return RecordError(f"bad JSON: {e}")
+    if not isinstance(record, dict):
+        return RecordError("not a JSON object")
+    return record
+
+
+def parse_csv_record(row):
+    if None in row:
+        return RecordError("more fields than the header")
+    if not all(is_utf8(value) for value in row.values() if value is not None):
+        return RecordError("not valid UTF-8")
+    return {key: value for key, value in row.items() if value != ""}
+
+
+def read_records(path, fmt):
+    """
+    Yield the records of a JSONL or CSV file one at a time, with a
+    RecordError in place of each record that cannot be read, so one bad line
+    does not stop the import. Empty CSV cells are treated as missing.
+    """
+    # Undecodable bytes become surrogates here and fail only their record
+    with open(path, newline="", encoding="utf-8", errors="surrogateescape") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            while True:
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as e:
+                    yield RecordError(f"bad CSV row: {e}")
+                    continue
+                yield parse_csv_record(row)
+        else:
+            for line in f:
+                if line.strip():
+                    yield parse_json_record(line)
+
+
+@lru_cache(maxsize=4096)
+def to_date(value):
+    # Most exports already hold ISO dates, which parse far faster than
+    # dateutil's general parser; backfills repeat the same few dates
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d")
+    except ValueError:
+        return date_parser.parse(value).strftime("%Y-%m-%d")
+
+
+class ClaimImporter:
+    def __init__(self, conn, invoices_dir, dispatch=False):
+        self.conn = conn
+        self.invoices_dir = invoices_dir
+        self.dispatch = dispatch
+        self._policies = {}
+
+    def policy_id(self, policy_number):
+        if policy_number not in self._policies:
+            row = self.conn.execute(
+                "SELECT id FROM Policy WHERE policy_number = ?", (policy_number,)
+            ).fetchone()
+            self._policies[policy_number] = row["id"] if row else None
+        policy_id = self._policies[policy_number]
+        if policy_id is None:
+            raise RecordError(f"unknown policy {policy_number}")
+        return policy_id
+
+    def prepare(self, record):
+        """
+        Validate a record and store its invoice. Runs before the batch's
+        transaction; blobs are content-addressed, so storing one again when a
+        batch is retried is harmless.
+        """
+        missing = [
+            name
+            for name in ["policy_number", "invoice", *CLAIM_DATES]
+            if not record.get(name)
+        ]
+        if missing:
+            raise RecordError(f"missing {', '.join(missing)}")
+        for name in TEXT_FIELDS:
+            if record.get(name) is not None and not isinstance(record[name], str):
+                raise RecordError(f"bad {name} {record[name]!r}")
+        claim = {"policy_id": self.policy_id(str(record["policy_number"]))}
+        for name in CLAIM_DATES:
+            try:
+                claim[name] = to_date(str(record[name]))
+            except (ValueError, OverflowError):
+                raise RecordError(f"bad {name} {record[name]!r}")
+
+        claim["status"] = record.get("status") or "Pending"
+        claim["internal_status"] = record.get("internal_status") or claim["status"]
+        if claim["status"] not in CLAIM_STATUSES:
+            raise RecordError(f"bad status {claim['status']!r}")
+        if claim["internal_status"] not in INTERNAL_STATUSES:
+            raise RecordError(f"bad internal_status {claim['internal_status']!r}")
+        for name in ["status_message", "internal_status_message", "cause_of_damage"]:
+            claim[name] = record.get(name)
+
+        path = os.path.join(self.invoices_dir, record["invoice"])
+        try:
+            invoice = invoice_store.save_path(path)
+        except OSError as e:
+            raise RecordError(f"cannot read invoice: {e}")
+        claim.update(
+            invoices=invoice.key,
+            invoice_sha256=invoice.sha256,
+            invoice_size=invoice.size,
+            invoice_mime_type=invoice.mime_type,
+            invoice_filename=os.path.basename(record["invoice"]),
+        )
+        return claim
+
+    def insert(self, claim):
+        claim_id = self.conn.execute(
+            """
+            INSERT INTO Claims (policy_id, invoices, invoice_sha256, invoice_size, invoice_mime_type, invoice_filename, claim_date, damage_date, date_of_repair, cause_of_damage, status, status_message, internal_status, internal_status_message)
+            VALUES (:policy_id, :invoices, :invoice_sha256, :invoice_size, :invoice_mime_type, :invoice_filename, :claim_date, :damage_date, :date_of_repair, :cause_of_damage, :status, :status_message, :internal_status, :internal_status_message)
+            """,
+            claim,
+        ).lastrowid
+        record_claim_change(self.conn, claim_id)
+        if (
+            self.dispatch
+            and not CLAIM_SCHEDULER_ENABLED
+            and claim["internal_status"] == "Pending"
+        ):
+            enqueue_claim_dispatch(self.conn, claim_id)
+
+    def commit_batch(self, name, position, claims, rejected):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for claim in claims:
+                self.insert(claim)
+            self.conn.execute(
+                """
+                INSERT INTO ImportCheckpoints (name, position, imported, rejected, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    position = excluded.position,
+                    imported = imported + excluded.imported,
+                    rejected = rejected + excluded.rejected,
+                    updated_at = excluded.updated_at
+                """,
+                (name, position, len(claims), rejected, time.time()),
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+
+def import_claims(args):
+    fmt = format_for(args.source, args.format)
+    if fmt not in ("jsonl", "csv"):
+        raise SystemExit("Import reads JSONL or CSV")
+    name = args.name or os.path.abspath(args.source)
+    conn = connect()
+    importer = ClaimImporter(conn, args.invoices, dispatch=args.dispatch)
+
+    if args.restart:
+        conn.execute("DELETE FROM ImportCheckpoints WHERE name = ?", (name,))
+    checkpoint = conn.execute(
+        "SELECT * FROM ImportCheckpoints WHERE name = ?", (name,)
+    ).fetchone()
+    resume_at = checkpoint["position"] if checkpoint else 0
+    if resume_at:
+        print(f"Resuming {name} after record {resume_at}", file=sys.stderr)
+
+    progress = Progress("import")
+    claims, rejected, position = [], 0, resume_at
+    total_rejected = 0
+    try:
+        for position, record in enumerate(read_records(args.source, fmt), 1):
+            if position <= resume_at:
+                continue
+            try:
+                if isinstance(record, RecordError):
+                    raise record
+                claims.append(importer.prepare(record))
+            except RecordError as e:
+                print(f"{args.source}: record {position}: {e}", file=sys.stderr)
+                rejected += 1
+            if len(claims) + rejected >= args.batch_size:
+                importer.commit_batch(name, position, claims, rejected)
+                progress.add(len(claims))
+                total_rejected += rejected
+                claims, rejected = [], 0
+        if position > resume_at:
+            importer.commit_batch(name, position, claims, rejected)
+            progress.add(len(claims))
+            total_rejected += rejected
+    finally:
+        conn.close()
+    progress.report(f", {total_rejected} rejected")
+
+
+def parquet_schema(conn, table):
+    import pyarrow as pa
+
+    types = {"INTEGER": pa.int64(), "REAL": pa.float64()}
+    return pa.schema(
+        [
+            (column["name"], types.get(column["type"].upper(), pa.string()))
+            for column in conn.execute(f"PRAGMA table_info({table})")
+        ]
+    )
+
+
+def write_parquet(conn, cursor, table, out, batch_size, progress):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet export needs pyarrow")
+
+    schema = parquet_schema(conn, table)
+    # SQLite columns are loosely typed, so text columns may hold numbers
+    text_columns = {field.name for field in schema if pa.types.is_string(field.type)}
+    with pq.ParquetWriter(out, schema) as writer:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            columns = {
+                name: [
+                    (
+                        str(row[name])
+                        if name in text_columns and row[name] is not None
+                        else row[name]
+                    )
+                    for row in rows
+                ]
+                for name in schema.names
+            }
+            writer.write_table(pa.table(columns, schema=schema))
+            progress.add(len(rows))
+
+
+def write_jsonl(cursor, out, batch_size, progress):
+    f = sys.stdout if out == "-" else open(out, "w", encoding="utf-8")
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            f.writelines(json.dumps(dict(row)) + "\n" for row in rows)
+            progress.add(len(rows))
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def export_table(args):
+    table = EXPORT_TABLES[args.table]
+    fmt = "jsonl" if args.out == "-" else format_for(args.out, args.format)
+    if fmt not in ("jsonl", "parquet"):
+        raise SystemExit("Export writes JSONL or Parquet")
+    conn = connect()
+    progress = Progress(f"export {args.table}")
+    try:
+        # One read transaction, so the export is a consistent snapshot while
+        # the APIs keep writing
+        conn.execute("BEGIN")
+        cursor = conn.execute(f"SELECT * FROM {table} ORDER BY id")
+        if fmt == "parquet":
+            write_parquet(conn, cursor, table, args.out, args.batch_size, progress)
+        else:
+            write_jsonl(cursor, args.out, args.batch_size, progress)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    progress.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="Import claims and invoices")
+    importer.add_argument("source", help="JSONL or CSV file of claims")
+    importer.add_argument(
+        "--invoices", default=".", help="Directory the invoice names are relative to"
+    )
+    importer.add_argument("--format", choices=["jsonl", "csv"])
+    importer.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    importer.add_argument(
+        "--name", help="Checkpoint name; defaults to the source file's path"
+    )
+    importer.add_argument(
+        "--restart", action="store_true", help="Ignore the checkpoint and start over"
+    )
+    importer.add_argument(
+        "--dispatch",
+        action="store_true",
+        help="Queue the claim workflow for claims imported as Pending",
+    )
+    importer.set_defaults(run=import_claims)
+
+    exporter = commands.add_parser("export", help="Export claims or checks")
+    exporter.add_argument("table", choices=sorted(EXPORT_TABLES))
+    exporter.add_argument("out", help="Output file, or - for JSONL on stdout")
+    exporter.add_argument("--format", choices=["jsonl", "parquet"])
+    exporter.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    exporter.set_defaults(run=export_table)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
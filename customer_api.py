@@ -1,29 +1,47 @@
 import sqlite3
-import hashlib
 import os
-import requests
 
-from functools import wraps
 from datetime import timedelta, datetime
 from dateutil import parser
 
-from flask import Flask, request, jsonify
+from flask import Flask, request
 from flask_restx import Api, Resource, fields, reqparse
 from flask_jwt_extended import (
-    JWTManager,
     create_access_token,
     jwt_required,
-    get_jwt_identity,
 )
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 
+from auth import (
+    admin_required,
+    current_policy,
+    init_jwt,
+    owner_or_admin_required,
+    policy_belongs_to_user_or_admin,
+)
+from db import get_db, pool, init_app as init_db, start_checkpointer
+from invoices import UPLOAD_FOLDER, InvoiceRequest, store as invoice_store
+from metrics import get_logger, init_request_metrics, logging_stats, query_stats
+from changes import record_claim_change
+from extraction import schedule_extraction
+from dispatch import (
+    enqueue_claim_dispatch,
+    get_dispatcher,
+    notify_dispatcher,
+    start_dispatcher,
+)
+from scheduler import (
+    CLAIM_SCHEDULER_ENABLED,
+    notify_scheduler,
+    published_stats,
+    start_scheduler,
+)
+from passwords import HasherBusy, authenticate, hash_password, hashing_pool
+from response_cache import cached_policy_read, invalidate_policy, policy_cache
+
 app = Flask(__name__)
 
-UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "./uploads/")
-OTTO_SERVER_URL = os.getenv("OTTO_SERVER_URL", "http://127.0.0.1:8080")
-OTTO_WORKFLOW = os.getenv("OTTO_WORKFLOW", "windscreen-claim")
-OTTO_BEARER_TOKEN = os.getenv("OTTO_BEARER_TOKEN", "")
 SECRET_KEY = os.getenv("SECRET_KEY", "changemesecret")
 
 # Define the servers for the OpenAPI spec
@@ -34,7 +52,14 @@ servers = [
 app.config["JWT_SECRET_KEY"] = SECRET_KEY
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=10)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
-jwt = JWTManager(app)
+app.request_class = InvoiceRequest
+# Larger request bodies are rejected with 413 before they are read
+app.config["MAX_CONTENT_LENGTH"] = int(
+    os.getenv("MAX_CONTENT_LENGTH", str(25 * 1024 * 1024))
+)
+jwt = init_jwt(app)
+init_db(app)
+init_request_metrics(app, "customer")
 
 # Define the JWT Bearer auth security scheme
 authorizations = {
@@ -58,75 +83,49 @@ api = Api(
 )
 
 
-# Hashing function for passwords
-def hash_password(password):
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
-
+# Maximum number of ids bound into a single IN (...) query
+HYDRATE_BATCH_SIZE = 500
 
-def admin_required(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        current_user = get_jwt_identity()
-        if current_user["username"] != "admin":
-            return jsonify({"message": "Access forbidden: Admins only"}), 403
-        return fn(*args, **kwargs)
+log = get_logger(__name__)
 
-    return wrapper
 
+def fetch_rows_by_id(conn, table, ids):
+    ids = list({i for i in ids if i is not None})
+    rows = {}
+    for i in range(0, len(ids), HYDRATE_BATCH_SIZE):
+        batch = ids[i : i + HYDRATE_BATCH_SIZE]
+        for row in conn.execute(
+            f"SELECT * FROM {table} WHERE id IN ({', '.join('?' * len(batch))})",
+            batch,
+        ):
+            rows[row["id"]] = dict(row)
+    return rows
 
-def owner_or_admin_required(resource_user_id_param="id"):
-    def decorator(fn):
-        @wraps(fn)
-        def wrapper(*args, **kwargs):
-            current_user = get_jwt_identity()
-            resource_user_id = kwargs.get(resource_user_id_param)
-            if (
-                current_user["username"] != "admin"
-                and current_user["id"] != resource_user_id
-            ):
-                return (
-                    jsonify({"message": "Access forbidden: Unauthorized access"}),
-                    403,
-                )
-            return fn(*args, **kwargs)
-
-        return wrapper
-
-    return decorator
-
-
-def policy_belongs_to_user_or_admin(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        conn = get_db()
-        current_user = get_jwt_identity()
-        user_id = kwargs.get("user_id")
-        policy_number = kwargs.get("policy_number")
-        if policy_number is None or policy_number == "undefined":
-            return jsonify({"message": "Invalid request"}), 400
-
-        # Verify that the policy belongs to the user
-        policy = conn.execute(
-            "SELECT * FROM Policy WHERE policy_number = ? AND user_id = ?",
-            (policy_number, user_id),
-        ).fetchone()
-
-        # If no policy is found, or the user is not the owner and not an admin, return a forbidden response
-        if not policy and current_user["username"] != "admin":
-            return jsonify({"message": "Policy not found or access forbidden"}), 404
-        # Pass the policy's internal ID to the wrapped function
-        kwargs["policy_internal_id"] = policy["id"] if policy else None
-        return fn(*args, **kwargs)
-
-    return wrapper
 
+def hydrate_policies(conn, policies):
+    """
+    Attach the device (Device policies) or vehicle (Windscreen policies) to
+    each policy row, loading them for the whole batch with one IN (...) query
+    per table instead of one query per policy.
+    """
+    devices = fetch_rows_by_id(
+        conn, "Devices", (p["device_id"] for p in policies if p["type"] == "Device")
+    )
+    vehicles = fetch_rows_by_id(
+        conn,
+        "Vehicles",
+        (p["vehicle_id"] for p in policies if p["type"] == "Windscreen"),
+    )
 
-# Database connection function
-def get_db():
-    conn = sqlite3.connect("insurance.db")
-    conn.set_trace_callback(print)
-    conn.row_factory = sqlite3.Row
-    return conn
+    result = []
+    for policy in policies:
+        policy_dict = dict(policy)
+        if policy["type"] == "Device":
+            policy_dict["device"] = devices.get(policy["device_id"])
+        elif policy["type"] == "Windscreen":
+            policy_dict["vehicle"] = vehicles.get(policy["vehicle_id"])
+        result.append(policy_dict)
+    return result
 
 
 # Models for API documentation
@@ -383,12 +382,19 @@ class UserList(Resource):
 
         conn = get_db()
         data = request.json
-        hashed_password = hash_password(data["password"])
-
         # Ensure that 'admin' username cannot be created through public sign-up
         if data["username"].lower() == "admin":
             return {"message": "Invalid username"}, 400
 
+        try:
+            hashed_password = hashing_pool.run(hash_password, data["password"])
+        except HasherBusy:
+            return (
+                {"message": "Too many requests, try again shortly"},
+                503,
+                {"Retry-After": "1"},
+            )
+
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO User (first_name, last_name, phone, email, username, password) VALUES (?, ?, ?, ?, ?, ?)",
@@ -432,9 +438,18 @@ class User(Resource):
         """Update a user by ID"""
         conn = get_db()
         data = request.json
-        hashed_password = (
-            hash_password(data["password"]) if "password" in data else None
-        )
+        try:
+            hashed_password = (
+                hashing_pool.run(hash_password, data["password"])
+                if "password" in data
+                else None
+            )
+        except HasherBusy:
+            return (
+                {"message": "Too many requests, try again shortly"},
+                503,
+                {"Retry-After": "1"},
+            )
         conn.execute(
             "UPDATE User SET first_name = ?, last_name = ?, phone = ?, email = ?, username = ?, password = ? WHERE id = ?",
             (
@@ -454,7 +469,9 @@ class User(Resource):
 @ns_user.route("/<int:user_id>/policies")
 class UserPolicies(Resource):
     @jwt_required()
+    @cached_policy_read
     @owner_or_admin_required(resource_user_id_param="user_id")
+    @ns_policy.response(304, "Not modified")
     @ns_policy.marshal_list_with(policy_model_output)
     def get(self, user_id):
         """List all policies for a specific user"""
@@ -464,22 +481,7 @@ class UserPolicies(Resource):
         ).fetchall()
 
         # Include associated device or vehicle details
-        result = []
-        for policy in policies:
-            policy_dict = dict(policy)
-            if policy["type"] == "Device":
-                device = conn.execute(
-                    "SELECT * FROM Devices WHERE id = ?", (policy["device_id"],)
-                ).fetchone()
-                policy_dict["device"] = dict(device) if device else None
-            elif policy["type"] == "Windscreen":
-                vehicle = conn.execute(
-                    "SELECT * FROM Vehicles WHERE id = ?", (policy["vehicle_id"],)
-                ).fetchone()
-                policy_dict["vehicle"] = dict(vehicle) if vehicle else None
-            result.append(policy_dict)
-
-        return result
+        return hydrate_policies(conn, policies)
 
     @jwt_required()
     @owner_or_admin_required(resource_user_id_param="user_id")
@@ -500,37 +502,25 @@ class UserPolicies(Resource):
             (data["type"], user_id, data["policy_number"], new_deductible),
         )
         conn.commit()
+        invalidate_policy(user_id, data["policy_number"])
         return {"message": "Policy created successfully"}, 201
 
 
 @ns_user.route("/<int:user_id>/policies/<string:policy_number>")
 class SpecificPolicy(Resource):
     @jwt_required()
+    @cached_policy_read
     @policy_belongs_to_user_or_admin
+    @ns_policy.response(304, "Not modified")
     @ns_policy.marshal_with(policy_model_output)
     def get(self, user_id, policy_number, policy_internal_id):
         """Get a specific policy for a specific user"""
         conn = get_db()
-        policy = conn.execute(
-            "SELECT * FROM Policy WHERE id = ? AND policy_number = ? AND user_id = ?",
-            (policy_internal_id, policy_number, user_id),
-        ).fetchone()
+        policy = current_policy()
         if policy is None:
             return {"message": "Policy not found"}, 404
 
-        policy_dict = dict(policy)
-        if policy["type"] == "Device":
-            device = conn.execute(
-                "SELECT * FROM Devices WHERE id = ?", (policy["device_id"],)
-            ).fetchone()
-            policy_dict["device"] = dict(device) if device else None
-        elif policy["type"] == "Windscreen":
-            vehicle = conn.execute(
-                "SELECT * FROM Vehicles WHERE id = ?", (policy["vehicle_id"],)
-            ).fetchone()
-            policy_dict["vehicle"] = dict(vehicle) if vehicle else None
-
-        return policy_dict
+        return hydrate_policies(conn, [policy])[0]
 
     @jwt_required()
     @policy_belongs_to_user_or_admin
@@ -553,6 +543,7 @@ class SpecificPolicy(Resource):
         )
 
         conn.commit()
+        invalidate_policy(user_id, policy_number, data["policy_number"])
         return {"message": "Policy updated successfully"}
 
 
@@ -586,33 +577,28 @@ class PolicyClaims(Resource):
         date_of_repair = convert_to_iso8601(args["date_of_repair"])
         cause_of_damage = args["cause_of_damage"]
 
+        # Bound only after the invoice is stored, so a slow upload does not
+        # hold a pooled connection
+        conn = None
         try:
             if file and file.filename != "":
-                print("File received:", file.filename)
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                file.save(file_path)
+                invoice = invoice_store.save(file)
 
                 conn = get_db()
                 cursor = conn.cursor()
                 # Start a transaction
-                print("Transaction starting")
                 cursor.execute("BEGIN TRANSACTION")
 
-                print(
-                    "Inserting values: ",
-                    policy_internal_id,
-                    file_path,
-                    claim_date,
-                    damage_date,
-                    date_of_repair,
-                )
-                # Insert a new claim with the file path as the invoice location
+                # Insert a new claim referencing the stored invoice blob
                 cursor.execute(
-                    "INSERT INTO Claims (policy_id, invoices, claim_date, damage_date, date_of_repair, cause_of_damage) VALUES (?, ?, ?, ?, ?, ?)",
+                    "INSERT INTO Claims (policy_id, invoices, invoice_sha256, invoice_size, invoice_mime_type, invoice_filename, claim_date, damage_date, date_of_repair, cause_of_damage) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
                     (
                         policy_internal_id,
-                        file_path,
+                        invoice.key,
+                        invoice.sha256,
+                        invoice.size,
+                        invoice.mime_type,
+                        secure_filename(file.filename),
                         claim_date,
                         damage_date,
                         date_of_repair,
@@ -620,49 +606,46 @@ class PolicyClaims(Resource):
                     ),
                 )
 
+                # Queue the workflow invocation in the same transaction, so a
+                # committed claim is always eventually dispatched. With the
+                # scheduler enabled it picks up the Pending claim itself.
+                claim_id = cursor.lastrowid
+                if not CLAIM_SCHEDULER_ENABLED:
+                    enqueue_claim_dispatch(conn, claim_id)
+                record_claim_change(conn, claim_id)
+
                 # Commit the transaction
                 conn.commit()
+                notify_dispatcher()
+                notify_scheduler()
+                schedule_extraction(
+                    conn,
+                    invoice.sha256,
+                    invoice_store.path_for(invoice.key),
+                    invoice.mime_type,
+                )
 
                 # Fetch the newly created claim
-                claim_id = cursor.lastrowid
                 claim = conn.execute(
                     "SELECT * FROM Claims WHERE id = ?", (claim_id,)
                 ).fetchone()
 
-                try:
-                    headers = {}
-                    if OTTO_BEARER_TOKEN:
-                        headers["Authorization"] = f"Bearer {OTTO_BEARER_TOKEN}"
-
-                    requests.post(
-                        f"{OTTO_SERVER_URL}/api/invoke/{OTTO_WORKFLOW}?async=true",
-                        json={"input": f"Process claim with ID: {claim_id}"},
-                        headers=headers,
-                    )
-                except Exception as e:
-                    print("Error invoking Otto server:", e)
-                except:
-                    print("Error invoking Otto server")
-
                 return dict(claim), 201
 
         except sqlite3.Error as e:
             # Rollback the transaction on error
-            print(e)
-            print("SQLite error occurred")
-            conn.rollback()
+            log.exception("Database error filing a claim on policy %s", policy_number)
+            if conn is not None:
+                conn.rollback()
             return {"message": "An error occurred: " + str(e)}, 500
 
         except Exception as e:
             # Rollback the transaction on error
-            print(e)
-            print("Exception occurred")
-            conn.rollback()
+            log.exception("Error filing a claim on policy %s", policy_number)
+            if conn is not None:
+                conn.rollback()
             return {"message": "An error occurred: " + str(e)}, 500
 
-        finally:
-            conn.close()
-
         return {"message": "File upload failed"}, 400
 
 
@@ -695,15 +678,17 @@ class Claim(Resource):
         file = request.files.get("invoice")
 
         if file:
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-            file.save(file_path)
+            invoice = invoice_store.save(file)
 
             # Update the claim with the provided data
             claim = conn.execute(
-                "UPDATE Claims SET invoices = ?, claim_date = ?, repair_date = ?, date_of_repair = ? WHERE id = ? AND policy_id = ?",
+                "UPDATE Claims SET invoices = ?, invoice_sha256 = ?, invoice_size = ?, invoice_mime_type = ?, invoice_filename = ?, claim_date = ?, repair_date = ?, date_of_repair = ? WHERE id = ? AND policy_id = ?",
                 (
-                    file_path,
+                    invoice.key,
+                    invoice.sha256,
+                    invoice.size,
+                    invoice.mime_type,
+                    secure_filename(file.filename),
                     data["claim_date"],
                     data["repair_date"],
                     data["date_of_repair"],
@@ -712,6 +697,12 @@ class Claim(Resource):
                 ),
             )
             conn.commit()
+            schedule_extraction(
+                conn,
+                invoice.sha256,
+                invoice_store.path_for(invoice.key),
+                invoice.mime_type,
+            )
             return dict(claim), 201
 
         return {"message": "File upload failed"}, 400
@@ -752,7 +743,6 @@ class DeviceList(Resource):
         policy_internal_id = policy["id"]
 
         data = request.json
-        print("Data:", data)
         if float(data.get("purchase_amount", 0.0)) > 5000.00:
             depreciation_years = 10
             depreciation_rate = 0.10
@@ -777,13 +767,12 @@ class DeviceList(Resource):
 
         # Update Policy
         device_id = cursor.lastrowid
-        print("DEVICEID:", device_id)
-        print("POLICYID:", policy_id)
         cursor.execute(
             "UPDATE Policy SET device_id = ? WHERE id = ?",
             (device_id, policy_internal_id),
         )
         conn.commit()
+        invalidate_policy(user_id, policy_id)
 
         return {"message": "Device created successfully"}, 201
 
@@ -826,6 +815,7 @@ class Device(Resource):
             ),
         )
         conn.commit()
+        invalidate_policy(user_id, policy_id)
         return {"message": "Device updated successfully"}
 
     @jwt_required()
@@ -837,6 +827,7 @@ class Device(Resource):
             "DELETE FROM Devices WHERE id = ? AND policy_id = ?", (device_id, policy_id)
         )
         conn.commit()
+        invalidate_policy(user_id, policy_id)
         return {"message": "Device deleted successfully"}, 204
 
 
@@ -848,10 +839,7 @@ class VehicleList(Resource):
     def get(self, user_id, policy_number, policy_internal_id):
         """List all vehicles for a specific policy"""
         conn = get_db()
-        policy = conn.execute(
-            "SELECT * FROM Policy WHERE id = ?", (policy_internal_id,)
-        ).fetchone()
-        policy = dict(policy)
+        policy = dict(current_policy())
         vehicles = conn.execute(
             "SELECT * FROM Vehicles WHERE id = ?", (policy["vehicle_id"],)
         ).fetchall()
@@ -884,6 +872,7 @@ class VehicleList(Resource):
             (vehicle_id, policy_internal_id),
         )
         conn.commit()
+        invalidate_policy(user_id, policy_number)
 
         return {"message": "Vehicle created successfully"}, 201
 
@@ -926,6 +915,7 @@ class Vehicle(Resource):
             ),
         )
         conn.commit()
+        invalidate_policy(user_id, policy_number)
         return {"message": "Vehicle updated successfully"}
 
     @jwt_required()
@@ -935,6 +925,7 @@ class Vehicle(Resource):
         conn = get_db()
         conn.execute("DELETE FROM Vehicles WHERE id = ?", (vehicle_id,))
         conn.commit()
+        invalidate_policy(user_id, policy_number)
         return {"message": "Vehicle deleted successfully"}, 204
 
 
@@ -958,11 +949,14 @@ class UserLogin(Resource):
         """Log in a user and return a success message if the credentials are correct"""
         conn = get_db()
         data = request.json
-        hashed_password = hash_password(data["password"])
-        user = conn.execute(
-            "SELECT * FROM User WHERE username = ? AND password = ?",
-            (data["username"], hashed_password),
-        ).fetchone()
+        try:
+            user = authenticate(conn, data["username"], data["password"])
+        except HasherBusy:
+            return (
+                {"message": "Too many login attempts, try again shortly"},
+                503,
+                {"Retry-After": "1"},
+            )
 
         if user:
             token_data = {"id": user["id"], "username": user["username"]}
@@ -984,10 +978,102 @@ class SystemFeaturesResource(Resource):
         }
 
 
+@api.route("/system/db")
+class SystemDatabaseResource(Resource):
+    @jwt_required()
+    @admin_required
+    def get(self):
+        """
+        Get connection pool statistics (Admin only)
+        """
+        return pool.stats()
+
+
+@api.route("/system/metrics")
+class SystemMetricsResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.doc(
+        params={
+            "limit": "Number of statements to return, most total time first",
+            "reset": "Set to true to clear the collected statistics",
+        }
+    )
+    def get(self):
+        """
+        Get per-statement SQL timings with p50/p95/p99 in milliseconds (Admin only)
+        """
+        limit = request.args.get("limit", type=int)
+        queries = query_stats.snapshot(limit)
+        if request.args.get("reset", "false").lower() == "true":
+            query_stats.reset()
+        return {"queries": queries, "logging": logging_stats()}
+
+
+@api.route("/system/auth")
+class SystemAuthResource(Resource):
+    @jwt_required()
+    @admin_required
+    def get(self):
+        """
+        Get token verification cache and password hashing statistics (Admin only)
+        """
+        return {**jwt.cache_stats(), "password_hashing": hashing_pool.stats()}
+
+
+@api.route("/system/cache")
+class SystemCacheResource(Resource):
+    @jwt_required()
+    @admin_required
+    @api.doc(params={"clear": "Set to true to empty this process's policy cache"})
+    def get(self):
+        """
+        Get policy response cache statistics for this process (Admin only)
+        """
+        stats = policy_cache.stats()
+        if request.args.get("clear", "false").lower() == "true":
+            policy_cache.clear()
+        return stats
+
+
+@api.route("/system/dispatch")
+class SystemDispatchResource(Resource):
+    @jwt_required()
+    @admin_required
+    def get(self):
+        """
+        Get workflow dispatch queue statistics (Admin only)
+        """
+        dispatcher = get_dispatcher()
+        if dispatcher is None:
+            return {"message": "Dispatcher is not running in this process"}, 404
+        return dispatcher.stats()
+
+
+@api.route("/system/scheduler")
+class SystemSchedulerResource(Resource):
+    @jwt_required()
+    @admin_required
+    def get(self):
+        """
+        Get claim scheduler throughput, latency and queue statistics (Admin only)
+        """
+        # Schedulers usually run in their own process and publish their
+        # statistics to the database
+        schedulers = published_stats(get_db())
+        if not schedulers:
+            return {"message": "No claim scheduler is running"}, 404
+        return {"schedulers": schedulers}
+
+
 def convert_to_iso8601(date_str):
     date_obj = parser.parse(date_str)
     return date_obj.strftime("%Y-%m-%d")
 
 
 if __name__ == "__main__":
+    start_checkpointer()
+    start_dispatcher()
+    if CLAIM_SCHEDULER_ENABLED:
+        start_scheduler()
     app.run(debug=True)
@@ -0,0 +1,376 @@
+import os
+import sqlite3
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g
+
+from metrics import get_logger, query_stats, start_log_listener
+
+DATABASE = os.getenv("DATABASE", "insurance.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+STORAGE_PROFILE = os.getenv("STORAGE_PROFILE", "wal")
+WAL_CHECKPOINT_INTERVAL = float(os.getenv("WAL_CHECKPOINT_INTERVAL", "30"))
+
+log = get_logger(__name__)
+
+# Named sets of pragmas. "legacy" matches SQLite's defaults (rollback journal),
+# "wal" lets readers proceed while a writer commits, and "durable" keeps WAL
+# but fsyncs on every commit.
+STORAGE_PROFILES = {
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "cache_size": -2000,
+        "mmap_size": 0,
+    },
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -20000,
+        "mmap_size": 268435456,
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 10000,
+        "cache_size": -20000,
+        "mmap_size": 268435456,
+    },
+}
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    pass
+
+
+def get_storage_profile(name=None):
+    """
+    Return the pragmas for a storage profile. Individual pragmas can be
+    overridden with SQLITE_<PRAGMA> environment variables, e.g.
+    SQLITE_BUSY_TIMEOUT=10000.
+    """
+    name = name or STORAGE_PROFILE
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {name}")
+    profile = dict(STORAGE_PROFILES[name])
+    for pragma in profile:
+        override = os.getenv(f"SQLITE_{pragma.upper()}")
+        if override:
+            profile[pragma] = override
+    return profile
+
+
+def apply_storage_profile(conn, profile=None):
+    if profile is None or isinstance(profile, str):
+        profile = get_storage_profile(profile)
+    # busy_timeout goes first so the remaining pragmas wait out other writers
+    pragmas = sorted(profile.items(), key=lambda item: item[0] != "busy_timeout")
+    for pragma, value in pragmas:
+        if pragma == "journal_mode":
+            # journal_mode is persistent and changing it takes a lock, so only
+            # switch it when the database file is not already in that mode
+            current = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            if current.upper() == str(value).upper():
+                continue
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return profile
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    A cursor that records each statement's fingerprint, duration and row
+    count in metrics.query_stats. Time spent fetching counts towards the
+    statement, which is recorded once its rows are exhausted, the cursor
+    runs another statement, or the cursor is closed or dropped.
+    """
+
+    _query = None
+
+    def _finish(self):
+        query, self._query = self._query, None
+        if query is not None:
+            query_stats.record(*query)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except sqlite3.Error as e:
+            query_stats.record_error(sql, e)
+            raise
+        elapsed = time.perf_counter() - started
+        if self.description is None:
+            query_stats.record(sql, elapsed, max(self.rowcount, 0))
+        else:
+            self._query = [sql, elapsed, 0]
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error as e:
+            query_stats.record_error(sql, e)
+            raise
+        query_stats.record(sql, time.perf_counter() - started, max(self.rowcount, 0))
+        return self
+
+    def _fetched(self, started, rows, done):
+        if self._query is not None:
+            self._query[1] += time.perf_counter() - started
+            self._query[2] += rows
+            if done:
+                self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def configure_connection(conn):
+    # Applied once when a connection is opened, not on every checkout
+    apply_storage_profile(conn)
+    conn.row_factory = sqlite3.Row
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections shared by the request threads of one
+    process. Idle connections are reused; when all ``max_size`` connections
+    are checked out, callers wait up to ``timeout`` seconds for one to return.
+    """
+
+    def __init__(self, database, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "opens": 0,
+            "hits": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "discards": 0,
+        }
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.database, check_same_thread=False, factory=InstrumentedConnection
+        )
+        configure_connection(conn)
+        return conn
+
+    def acquire(self):
+        started = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    self._stats["hits"] += 1
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    self._stats["opens"] += 1
+                    conn = None
+                    break
+                if started is None:
+                    started = time.monotonic()
+                    self._stats["waits"] += 1
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    self._stats["wait_time"] += time.monotonic() - started
+                    raise PoolTimeout("Timed out waiting for a database connection")
+                self._cond.wait(remaining)
+            if started is not None:
+                self._stats["wait_time"] += time.monotonic() - started
+
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                # Never hand a connection with an open transaction to the next request
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        with self._cond:
+            if discard:
+                self._size -= 1
+                self._stats["discards"] += 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+        if discard:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def after_fork(self):
+        """
+        Forget the connections inherited from the parent process. SQLite
+        connections must not be used across fork(), and closing them here
+        could disturb the parent's locks, so they are left unreferenced.
+        """
+        self._abandoned = list(self._idle)
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max_size"] = self.max_size
+        return stats
+
+
+pool = ConnectionPool(DATABASE)
+# Forking servers (gunicorn with preload) give each worker a fresh pool
+os.register_at_fork(after_in_child=pool.after_fork)
+
+
+class WalCheckpointer(threading.Thread):
+    """
+    Periodically checkpoints the WAL from a dedicated connection so request
+    threads rarely pay for an automatic checkpoint on commit.
+    """
+
+    def __init__(self, database, interval=WAL_CHECKPOINT_INTERVAL):
+        super().__init__(name="wal-checkpointer", daemon=True)
+        self.database = database
+        self.interval = interval
+        self.checkpoints = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.database)
+        try:
+            while not self._stop_event.wait(self.interval):
+                try:
+                    conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+                    self.checkpoints += 1
+                except sqlite3.Error as e:
+                    log.warning("WAL checkpoint failed: %s", e)
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_checkpointer = None
+
+
+def start_checkpointer():
+    global _checkpointer
+    if get_storage_profile()["journal_mode"].upper() != "WAL":
+        return None
+    if _checkpointer is None or not _checkpointer.is_alive():
+        _checkpointer = WalCheckpointer(DATABASE)
+        _checkpointer.start()
+    return _checkpointer
+
+
+def get_db():
+    """
+    Return the connection bound to the current request, checking one out of
+    the pool on first use. It goes back to the pool on app context teardown.
+    """
+    if "db" not in g:
+        g.db = pool.acquire()
+    return g.db
+
+
+def close_db(exception=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        pool.release(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+    start_log_listener()
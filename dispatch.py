@@ -0,0 +1,247 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from db import pool
+from metrics import get_logger, start_log_listener
+
+OTTO_SERVER_URL = os.getenv("OTTO_SERVER_URL", "http://127.0.0.1:8080")
+OTTO_WORKFLOW = os.getenv("OTTO_WORKFLOW", "windscreen-claim")
+OTTO_BEARER_TOKEN = os.getenv("OTTO_BEARER_TOKEN", "")
+
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", "4"))
+DISPATCH_MAX_ATTEMPTS = int(os.getenv("DISPATCH_MAX_ATTEMPTS", "8"))
+DISPATCH_BACKOFF_BASE = float(os.getenv("DISPATCH_BACKOFF_BASE", "2"))
+DISPATCH_BACKOFF_MAX = float(os.getenv("DISPATCH_BACKOFF_MAX", "300"))
+DISPATCH_POLL_INTERVAL = float(os.getenv("DISPATCH_POLL_INTERVAL", "1"))
+DISPATCH_LEASE = float(os.getenv("DISPATCH_LEASE", "60"))
+DISPATCH_CONNECT_TIMEOUT = float(os.getenv("DISPATCH_CONNECT_TIMEOUT", "3.05"))
+DISPATCH_READ_TIMEOUT = float(os.getenv("DISPATCH_READ_TIMEOUT", "10"))
+
+log = get_logger(__name__)
+
+
+class PermanentDispatchError(Exception):
+    pass
+
+
+def enqueue_claim_dispatch(conn, claim_id, workflow=OTTO_WORKFLOW):
+    """
+    Queue a workflow invocation for a claim. Runs on the caller's connection
+    and does not commit, so the outbox row lands in the same transaction as
+    the claim it refers to.
+    """
+    conn.execute(
+        "INSERT INTO ClaimDispatchOutbox (claim_id, workflow, payload, next_attempt_at) VALUES (?, ?, ?, ?)",
+        (
+            claim_id,
+            workflow,
+            json.dumps({"input": f"Process claim with ID: {claim_id}"}),
+            time.time(),
+        ),
+    )
+
+
+def create_session(pool_size=DISPATCH_CONCURRENCY):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if OTTO_BEARER_TOKEN:
+        session.headers["Authorization"] = f"Bearer {OTTO_BEARER_TOKEN}"
+    return session
+
+
+def invoke_workflow(session, workflow, payload, wait=False, timeout=None):
+    """
+    Invoke a workflow on the workflow server. By default the invocation is
+    asynchronous; with ``wait`` the request returns when the workflow run
+    finishes, or fails after ``timeout`` seconds.
+    """
+    response = session.post(
+        f"{OTTO_SERVER_URL}/api/invoke/{workflow}?async={'false' if wait else 'true'}",
+        json=payload,
+        timeout=(DISPATCH_CONNECT_TIMEOUT, timeout or DISPATCH_READ_TIMEOUT),
+    )
+    # Client errors other than timeouts and rate limiting will not succeed on retry
+    if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+        raise PermanentDispatchError(
+            f"{response.status_code} from workflow server: {response.text[:200]}"
+        )
+    response.raise_for_status()
+    return response
+
+
+def backoff_delay(attempts):
+    delay = min(DISPATCH_BACKOFF_MAX, DISPATCH_BACKOFF_BASE * 2 ** (attempts - 1))
+    # Full jitter over the upper half keeps retries from a burst apart
+    return delay * random.uniform(0.5, 1.0)
+
+
+class ClaimDispatcher(threading.Thread):
+    """
+    Drains ClaimDispatchOutbox: leases due rows, posts them to the workflow
+    server with at most ``concurrency`` requests in flight, and reschedules
+    failures with exponential backoff until ``max_attempts``, after which the
+    row is marked Dead.
+    """
+
+    def __init__(
+        self,
+        concurrency=DISPATCH_CONCURRENCY,
+        max_attempts=DISPATCH_MAX_ATTEMPTS,
+        poll_interval=DISPATCH_POLL_INTERVAL,
+    ):
+        super().__init__(name="claim-dispatcher", daemon=True)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.session = create_session(concurrency)
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"sent": 0, "retried": 0, "dead": 0}
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def run(self):
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="claim-dispatch"
+        ) as executor:
+            while not self._stop_event.is_set():
+                try:
+                    rows = self.lease_due()
+                except Exception as e:
+                    log.error("Error leasing claim dispatches: %s", e)
+                    rows = []
+
+                if rows:
+                    for future in [executor.submit(self.send, row) for row in rows]:
+                        future.result()
+                    # A full batch means more rows are probably due
+                    if len(rows) == self.concurrency:
+                        continue
+
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def lease_due(self):
+        now = time.time()
+        with pool.connection() as conn:
+            rows = conn.execute(
+                """
+                UPDATE ClaimDispatchOutbox
+                SET status = 'InFlight', locked_until = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM ClaimDispatchOutbox
+                    WHERE (status = 'Pending' AND next_attempt_at <= ?)
+                       OR (status = 'InFlight' AND locked_until < ?)
+                    ORDER BY next_attempt_at
+                    LIMIT ?
+                )
+                RETURNING id, claim_id, workflow, payload, attempts
+                """,
+                (now + DISPATCH_LEASE, now, now, self.concurrency),
+            ).fetchall()
+            conn.commit()
+        return rows
+
+    def send(self, row):
+        try:
+            invoke_workflow(self.session, row["workflow"], json.loads(row["payload"]))
+        except PermanentDispatchError as e:
+            self.complete(row, str(e), permanent=True)
+        except Exception as e:
+            self.complete(row, str(e))
+        else:
+            self.complete(row, None)
+
+    def complete(self, row, error, permanent=False):
+        with pool.connection() as conn:
+            if error is None:
+                conn.execute(
+                    "UPDATE ClaimDispatchOutbox SET status = 'Sent', sent_at = datetime('now'), locked_until = NULL, last_error = NULL WHERE id = ?",
+                    (row["id"],),
+                )
+                outcome = "sent"
+            elif permanent or row["attempts"] >= self.max_attempts:
+                conn.execute(
+                    "UPDATE ClaimDispatchOutbox SET status = 'Dead', locked_until = NULL, last_error = ? WHERE id = ?",
+                    (error, row["id"]),
+                )
+                outcome = "dead"
+                log.warning(
+                    "Claim %s dispatch dead-lettered: %s", row["claim_id"], error
+                )
+            else:
+                conn.execute(
+                    "UPDATE ClaimDispatchOutbox SET status = 'Pending', locked_until = NULL, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                    (error, time.time() + backoff_delay(row["attempts"]), row["id"]),
+                )
+                outcome = "retried"
+            conn.commit()
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        with pool.connection() as conn:
+            stats["outbox"] = {
+                row["status"]: row["count"]
+                for row in conn.execute(
+                    "SELECT status, COUNT(*) AS count FROM ClaimDispatchOutbox GROUP BY status"
+                )
+            }
+        return stats
+
+
+def requeue_dead(conn):
+    cursor = conn.execute(
+        "UPDATE ClaimDispatchOutbox SET status = 'Pending', attempts = 0, next_attempt_at = ? WHERE status = 'Dead'",
+        (time.time(),),
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+dispatcher = None
+
+
+def start_dispatcher():
+    global dispatcher
+    if dispatcher is None or not dispatcher.is_alive():
+        dispatcher = ClaimDispatcher()
+        dispatcher.start()
+    return dispatcher
+
+
+def get_dispatcher():
+    return dispatcher
+
+
+def notify_dispatcher():
+    if dispatcher is not None:
+        dispatcher.notify()
+
+
+if __name__ == "__main__":
+    if "--requeue-dead" in sys.argv:
+        with pool.connection() as conn:
+            print("Requeued", requeue_dead(conn), "dead dispatches")
+    else:
+        start_log_listener()
+        start_dispatcher().join()
@@ -0,0 +1,393 @@
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from dateutil import parser as date_parser
+from flask import after_this_request, has_request_context
+
+from db import pool
+from metrics import get_logger
+
+EXTRACTION_ENABLED = os.getenv("EXTRACTION_ENABLED", "true").lower() == "true"
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "2"))
+# "tesseract", or "package.module:function" for a callable taking
+# (path, mime_type) and returning the text of the invoice
+EXTRACTION_OCR_BACKEND = os.getenv("EXTRACTION_OCR_BACKEND", "")
+# A text layer shorter than this is treated as a scanned PDF
+EXTRACTION_MIN_TEXT = int(os.getenv("EXTRACTION_MIN_TEXT", "40"))
+# Pending extractions older than this are assumed lost and run again
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "600"))
+
+# Bump when the parsing below changes, so cached fields are extracted again
+EXTRACTOR_VERSION = 1
+
+log = get_logger(__name__)
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def extract_text_layer(path):
+    """
+    Return the embedded text of a PDF, or None when pypdf is not installed or
+    the PDF has no usable text layer (a scan).
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+    try:
+        reader = PdfReader(path)
+        text = "\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception as e:
+        raise ExtractionError(f"Could not read PDF: {e}")
+    return text if len(text.strip()) >= EXTRACTION_MIN_TEXT else None
+
+
+def tesseract_backend(path, mime_type):
+    try:
+        import pytesseract
+        from PIL import Image
+    except ImportError:
+        raise ExtractionError("The tesseract backend needs pytesseract and Pillow")
+    if mime_type == "application/pdf":
+        try:
+            from pdf2image import convert_from_path
+        except ImportError:
+            raise ExtractionError("OCR of PDFs needs pdf2image")
+        pages = convert_from_path(path)
+    else:
+        pages = [Image.open(path)]
+    return "\n".join(pytesseract.image_to_string(page) for page in pages)
+
+
+OCR_BACKENDS = {"tesseract": tesseract_backend}
+
+_ocr_backend = None
+
+
+def get_ocr_backend():
+    global _ocr_backend
+    if _ocr_backend is None and EXTRACTION_OCR_BACKEND:
+        if EXTRACTION_OCR_BACKEND in OCR_BACKENDS:
+            _ocr_backend = OCR_BACKENDS[EXTRACTION_OCR_BACKEND]
+        else:
+            module, _, name = EXTRACTION_OCR_BACKEND.partition(":")
+            _ocr_backend = getattr(importlib.import_module(module), name)
+    return _ocr_backend
+
+
+LABEL = r"[^\S\n]*[:#]?[^\S\n]*"
+# A run of digits and separators, read whole so that "1.234,00" is not
+# taken for 1.23; only US-style amounts are converted to numbers
+NUMBER = r"(?<![\d.,])(\d(?:[\d.,]*\d)?)"
+MONEY = rf"\$?[^\S\n]*{NUMBER}"
+NUMBERS = re.compile(NUMBER)
+US_AMOUNT = re.compile(r"(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d{2})?")
+US_CENTS = re.compile(r"(?:\d{1,3}(?:,\d{3})+|\d+)\.\d{2}")
+
+INVOICE_DATE = [
+    re.compile(rf"invoice[^\S\n]*date{LABEL}([^\n]{{6,30}})", re.I),
+    re.compile(rf"\bdate{LABEL}([^\n]{{6,30}})", re.I),
+]
+# Most specific label first; within a label the last occurrence wins
+INVOICE_TOTAL = [
+    re.compile(
+        rf"(?:grand[^\S\n]+total|total[^\S\n]+due|amount[^\S\n]+due|balance[^\S\n]+due){LABEL}{MONEY}",
+        re.I,
+    ),
+    re.compile(rf"invoice[^\S\n]+total{LABEL}{MONEY}", re.I),
+    re.compile(rf"\btotal\b[^\S\n]*(?:\([^)\n]*\))?{LABEL}{MONEY}", re.I),
+]
+LICENSE_PLATE = re.compile(
+    rf"(?:licen[cs]e[^\S\n]*plate|plate[^\S\n]*(?:no\.?|number)?|registration[^\S\n]*(?:no\.?|number)?|reg\.?[^\S\n]*no\.?){LABEL}([A-Z0-9][A-Z0-9 \-]{{0,10}}[A-Z0-9])\b",
+    re.I,
+)
+POLICY_NUMBER = re.compile(
+    rf"policy[^\S\n]*(?:no\.?|number|#){LABEL}([A-Z0-9][A-Z0-9\-]*)", re.I
+)
+CUSTOMER_NAME = re.compile(
+    r"(?:customer(?:[^\S\n]*name)?|bill(?:ed)?[^\S\n]*to|insured)[^\S\n]*:[^\S\n]*([^\n]+)",
+    re.I,
+)
+# Line item kinds the check catalogue prices; checked in this order, so a
+# "sensor calibration" line counts as calibration
+LINE_ITEM_KINDS = [
+    ("calibration", re.compile(r"calibrat", re.I)),
+    ("sensor", re.compile(r"\bsensor", re.I)),
+    ("adhesive", re.compile(r"adhesive|urethane|primer", re.I)),
+    ("labor", re.compile(r"\blabou?r\b|installation", re.I)),
+    ("materials", re.compile(r"material|moulding|molding|clips|disposal", re.I)),
+]
+TOTAL_LINE = re.compile(r"\b(?:sub)?total\b|amount due|balance due|\btax\b", re.I)
+
+
+def parse_invoice_date(text):
+    for pattern in INVOICE_DATE:
+        for match in pattern.finditer(text):
+            try:
+                return date_parser.parse(match.group(1), fuzzy=True).date().isoformat()
+            except (ValueError, OverflowError):
+                continue
+    return None
+
+
+def parse_invoice_total(text):
+    """
+    The invoice total, or None when there is none or its separators are
+    ambiguous (such as "1.234,00"), which leaves the total checks to a
+    reviewer.
+    """
+    for pattern in INVOICE_TOTAL:
+        matches = pattern.findall(text)
+        if matches:
+            if not US_AMOUNT.fullmatch(matches[-1]):
+                return None
+            return float(matches[-1].replace(",", ""))
+    return None
+
+
+def parse_line_items(text):
+    items = {}
+    for line in text.splitlines():
+        if TOTAL_LINE.search(line):
+            continue
+        # Numbers without separators are quantities or part numbers
+        amounts = [n for n in NUMBERS.findall(line) if "." in n or "," in n]
+        if not amounts:
+            continue
+        # The last amount on a line is its extended price. One with ambiguous
+        # separators is kept as text, which the check evaluator refuses to
+        # decide on, rather than left out and taken for a missing line.
+        amount = amounts[-1]
+        if US_CENTS.fullmatch(amount):
+            amount = float(amount.replace(",", ""))
+        for kind, pattern in LINE_ITEM_KINDS:
+            if pattern.search(line):
+                items.setdefault(kind, []).append(amount)
+                break
+    return items
+
+
+def parse_invoice_fields(text):
+    """
+    Pull the fields the check evaluator uses out of an invoice's text. Fields
+    that cannot be found are left out.
+    """
+    fields = {
+        "invoice_date": parse_invoice_date(text),
+        "invoice_total": parse_invoice_total(text),
+        "line_items": parse_line_items(text) or None,
+    }
+    for name, pattern in (
+        ("invoice_license_plate", LICENSE_PLATE),
+        ("invoice_policy_number", POLICY_NUMBER),
+        ("invoice_customer_name", CUSTOMER_NAME),
+    ):
+        match = pattern.search(text)
+        fields[name] = match.group(1).strip() if match else None
+    return {name: value for name, value in fields.items() if value is not None}
+
+
+def extract_invoice(path, mime_type):
+    """
+    Return (source, text) for an invoice file: the PDF text layer when there
+    is one, otherwise the configured OCR backend's output. (None, None) when
+    neither is available.
+    """
+    if mime_type == "application/pdf":
+        text = extract_text_layer(path)
+        if text is not None:
+            return "text", text
+    backend = get_ocr_backend()
+    if backend is None:
+        return None, None
+    try:
+        return f"ocr:{EXTRACTION_OCR_BACKEND}", backend(path, mime_type)
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f"OCR failed: {e}")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_and_store(sha256, path, mime_type, conn=None):
+    """
+    Extract an invoice and cache the outcome under its content hash. Stores
+    on ``conn`` (and commits), or without one on a pooled connection taken
+    once the extraction is done. Returns the stored row.
+    """
+    try:
+        source, text = extract_invoice(path, mime_type)
+        if text is None:
+            status, fields, error = "NoText", None, None
+        else:
+            status, fields, error = "Extracted", parse_invoice_fields(text), None
+    except (ExtractionError, OSError) as e:
+        source, text, status, fields, error = None, None, "Failed", None, str(e)
+        log.warning("Invoice extraction failed for %s: %s", sha256, e)
+
+    if conn is None:
+        with pool.connection() as conn:
+            return store_extraction(conn, sha256, status, source, fields, text, error)
+    return store_extraction(conn, sha256, status, source, fields, text, error)
+
+
+def store_extraction(conn, sha256, status, source, fields, text, error):
+    now = time.time()
+    row = conn.execute(
+        """
+        INSERT INTO InvoiceExtractions (sha256, status, source, fields, text, error, extractor_version, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (sha256) DO UPDATE SET
+            status = excluded.status,
+            source = excluded.source,
+            fields = excluded.fields,
+            text = excluded.text,
+            error = excluded.error,
+            extractor_version = excluded.extractor_version,
+            updated_at = excluded.updated_at
+        RETURNING *
+        """,
+        (
+            sha256,
+            status,
+            source,
+            json.dumps(fields) if fields is not None else None,
+            text,
+            error,
+            EXTRACTOR_VERSION,
+            now,
+            now,
+        ),
+    ).fetchone()
+    conn.commit()
+    return row
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=EXTRACTION_WORKERS, thread_name_prefix="invoice-extraction"
+            )
+    return _executor
+
+
+def needs_extraction(row):
+    # Failed and NoText results stand until the invoice is uploaded again or
+    # a refresh is asked for
+    return (
+        row is None
+        or row["extractor_version"] < EXTRACTOR_VERSION
+        or (
+            row["status"] == "Pending"
+            and row["updated_at"] < time.time() - EXTRACTION_TIMEOUT
+        )
+    )
+
+
+def schedule_extraction(conn, sha256, path, mime_type):
+    """
+    Queue extraction of a stored invoice on the background executor, unless
+    the same content was already extracted or is being extracted. Marks the
+    extraction Pending on ``conn`` and commits. Within a request the work is
+    queued once the response is closed, after the request's connection went
+    back to the pool. Returns True when work was queued.
+    """
+    if not EXTRACTION_ENABLED:
+        return False
+    now = time.time()
+    claimed = conn.execute(
+        """
+        INSERT INTO InvoiceExtractions (sha256, status, extractor_version, created_at, updated_at)
+        VALUES (?, 'Pending', ?, ?, ?)
+        ON CONFLICT (sha256) DO UPDATE SET status = 'Pending', updated_at = excluded.updated_at
+        WHERE extractor_version < excluded.extractor_version
+            OR status = 'Failed'
+            OR (status = 'NoText' AND ?)
+            OR (status = 'Pending' AND updated_at < ?)
+        RETURNING sha256
+        """,
+        (
+            sha256,
+            EXTRACTOR_VERSION,
+            now,
+            now,
+            bool(EXTRACTION_OCR_BACKEND),
+            now - EXTRACTION_TIMEOUT,
+        ),
+    ).fetchone()
+    conn.commit()
+    if claimed is None:
+        return False
+
+    def submit():
+        _get_executor().submit(extract_and_store, sha256, path, mime_type)
+
+    if has_request_context():
+
+        @after_this_request
+        def submit_when_closed(response):
+            response.call_on_close(submit)
+            return response
+
+    else:
+        submit()
+    return True
+
+
+def get_extraction(conn, sha256):
+    if sha256 is None:
+        return None
+    return conn.execute(
+        "SELECT * FROM InvoiceExtractions WHERE sha256 = ?", (sha256,)
+    ).fetchone()
+
+
+def extraction_response(row):
+    """
+    The JSON form of an InvoiceExtractions row: its fields, with the full
+    text as invoice_text.
+    """
+    fields = json.loads(row["fields"]) if row["fields"] else {}
+    if row["text"] is not None:
+        fields["invoice_text"] = row["text"]
+    return {
+        "sha256": row["sha256"],
+        "status": row["status"],
+        "source": row["source"],
+        "error": row["error"],
+        "extracted_at": row["updated_at"],
+        "fields": fields,
+    }
+
+
+def cached_fields(conn, sha256):
+    """
+    The extracted fields of an invoice, for the check evaluator, or an empty
+    dict while there are none.
+    """
+    row = get_extraction(conn, sha256)
+    if row is None or row["status"] != "Extracted":
+        return {}
+    return extraction_response(row)["fields"]
@@ -0,0 +1,68 @@
+"""
+A stand-in for the Otto workflow server for local testing. It accepts
+workflow invocations, optionally slowly or with injected failures, and
+records them for inspection.
+
+    python fake_otto.py --port 8080 --latency 0.2 --failure-rate 0.1
+    OTTO_SERVER_URL=http://127.0.0.1:8080 python customer_api.py
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+app.config["LATENCY"] = 0.0
+app.config["FAILURE_RATE"] = 0.0
+
+_lock = threading.Lock()
+invocations = []
+
+
+@app.route("/api/invoke/<workflow>", methods=["POST"])
+def invoke(workflow):
+    if app.config["LATENCY"]:
+        time.sleep(app.config["LATENCY"])
+    if random.random() < app.config["FAILURE_RATE"]:
+        return jsonify({"error": "injected failure"}), 503
+
+    with _lock:
+        invocation = {
+            "id": len(invocations) + 1,
+            "workflow": workflow,
+            "async": request.args.get("async") == "true",
+            "input": (request.get_json(silent=True) or {}).get("input"),
+            "authorization": request.headers.get("Authorization"),
+            "received_at": time.time(),
+        }
+        invocations.append(invocation)
+    return jsonify({"id": invocation["id"], "workflow": workflow}), 200
+
+
+@app.route("/invocations", methods=["GET"])
+def list_invocations():
+    with _lock:
+        return jsonify(list(invocations))
+
+
+@app.route("/invocations", methods=["DELETE"])
+def clear_invocations():
+    with _lock:
+        invocations.clear()
+    return "", 204
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app.config["LATENCY"] = args.latency
+    app.config["FAILURE_RATE"] = args.failure_rate
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+import random
+import time
+
+IDEMPOTENCY_KEY_TTL = float(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 3600)))
+
+
+def request_fingerprint(body):
+    return hashlib.sha256(
+        json.dumps(body, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def lookup_response(conn, key, scope, fingerprint):
+    """
+    Return the stored (body, status) for an Idempotency-Key, an error tuple
+    when the key was used for a different request, or None for a new key.
+    Call inside the transaction that will store the response, so concurrent
+    requests with the same key serialize on the write lock.
+    """
+    row = conn.execute(
+        "SELECT request_hash, status_code, response FROM IdempotencyKeys WHERE key = ? AND scope = ? AND created_at > ?",
+        (key, scope, time.time() - IDEMPOTENCY_KEY_TTL),
+    ).fetchone()
+    if row is None:
+        return None
+    if row["request_hash"] != fingerprint:
+        return {
+            "message": "Idempotency-Key was already used for a different request"
+        }, 422
+    return json.loads(row["response"]), row["status_code"]
+
+
+def store_response(conn, key, scope, fingerprint, body, status_code=200):
+    """
+    Record the response for an Idempotency-Key. Does not commit; the caller
+    commits it together with the writes it describes.
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO IdempotencyKeys (key, scope, request_hash, status_code, response, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            key,
+            scope,
+            fingerprint,
+            status_code,
+            json.dumps(body, default=str),
+            time.time(),
+        ),
+    )
+    # Expired keys are cleared now and then rather than on every write
+    if random.random() < 0.01:
+        conn.execute(
+            "DELETE FROM IdempotencyKeys WHERE created_at < ?",
+            (time.time() - IDEMPOTENCY_KEY_TTL,),
+        )
@@ -0,0 +1,158 @@
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+from collections import namedtuple
+
+from flask import Request
+
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "./uploads/")
+INVOICE_CHUNK_SIZE = int(os.getenv("INVOICE_CHUNK_SIZE", str(64 * 1024)))
+
+BLOB_KEY = re.compile(r"^[0-9a-f]{64}$")
+
+# Leading bytes of the file types we expect invoices to arrive as
+MAGIC_NUMBERS = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+]
+
+StoredInvoice = namedtuple("StoredInvoice", "key sha256 size mime_type filename")
+
+
+class HashingSpool:
+    """
+    A temporary file inside the store that hashes everything written to it.
+    Werkzeug writes multipart file parts straight into it, so an upload is
+    hashed as it arrives and can be committed with a rename instead of a copy.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.committed = False
+        self._file = tempfile.NamedTemporaryFile(
+            dir=store.tmp_dir, prefix="upload-", delete=False
+        )
+        self.path = self._file.name
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        if len(self.head) < 16:
+            self.head += data[: 16 - len(self.head)]
+        return self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class InvoiceStore:
+    """
+    Content-addressed invoice storage. Blobs live under
+    ``<root>/blobs/<aa>/<bb>/<sha256>`` and are keyed by their SHA-256, so
+    identical uploads share one file on disk.
+    """
+
+    def __init__(self, root=UPLOAD_FOLDER, chunk_size=INVOICE_CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.blob_dir, key[:2], key[2:4], key)
+
+    def resolve(self, invoices):
+        """
+        Map the value of Claims.invoices to a file on disk. Older claims store
+        the upload path itself rather than a blob key.
+        """
+        if BLOB_KEY.match(invoices or ""):
+            return self.path_for(invoices)
+        return invoices
+
+    def open_spool(self):
+        return HashingSpool(self)
+
+    def save(self, file):
+        """
+        Store an uploaded FileStorage and return its StoredInvoice. Uploads
+        already spooled by InvoiceRequest are committed in place; anything
+        else is streamed into the store in ``chunk_size`` pieces.
+        """
+        spool = file.stream
+        if not (isinstance(spool, HashingSpool) and spool.store is self):
+            return self.save_stream(file.stream, file.mimetype, file.filename)
+        return self._commit(spool, file.mimetype, file.filename)
+
+    def save_path(self, path):
+        """
+        Store a file from disk, as bulk imports do, and return its
+        StoredInvoice. The type is sniffed from its content and name.
+        """
+        with open(path, "rb") as f:
+            return self.save_stream(f, None, os.path.basename(path))
+
+    def save_stream(self, stream, mime_type, filename):
+        spool = self.open_spool()
+        try:
+            for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+                spool.write(chunk)
+            return self._commit(spool, mime_type, filename)
+        finally:
+            spool.close()
+
+    def _commit(self, spool, client_mime_type, filename):
+        spool.flush()
+        key = spool.sha256.hexdigest()
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(spool.path, path)
+            spool.committed = True
+        # Otherwise the blob is a duplicate and the spool is discarded on close
+        return StoredInvoice(
+            key=key,
+            sha256=key,
+            size=spool.size,
+            mime_type=sniff_mime_type(spool.head, client_mime_type, filename),
+            filename=filename,
+        )
+
+
+def sniff_mime_type(head, client_mime_type=None, filename=None):
+    for magic, mime_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime_type
+    if client_mime_type and client_mime_type != "application/octet-stream":
+        return client_mime_type
+    if filename:
+        guessed, _ = mimetypes.guess_type(filename)
+        if guessed:
+            return guessed
+    return "application/octet-stream"
+
+
+store = InvoiceStore()
+
+
+class InvoiceRequest(Request):
+    # Spool uploaded files into the invoice store instead of Werkzeug's
+    # default temporary file, hashing them as they are received
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return store.open_spool()
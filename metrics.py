@@ -0,0 +1,461 @@
+import bisect
+import hmac
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+from collections import deque
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import Response, g, request
+
+# Fraction of statements logged in full; statements slower than
+# SQL_SLOW_QUERY_MS are always logged
+SQL_LOG_SAMPLE_RATE = float(os.getenv("SQL_LOG_SAMPLE_RATE", "0.01"))
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+# Distinct statement fingerprints tracked; the rest are counted under "other"
+SQL_METRICS_MAX_QUERIES = int(os.getenv("SQL_METRICS_MAX_QUERIES", "500"))
+HISTOGRAM_WINDOW = int(os.getenv("HISTOGRAM_WINDOW", "1024"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        name: samples[min(len(samples) - 1, int(len(samples) * q))]
+        for name, q in PERCENTILES
+        if samples
+    }
+
+
+class Histogram:
+    """
+    Count and total of every observation, with percentiles over the most
+    recent ``window`` observations.
+    """
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+            self._samples.append(value)
+
+    def snapshot(self):
+        with self._lock:
+            count, total, peak = self.count, self.total, self.max
+            samples = list(self._samples)
+        return {
+            "count": count,
+            "total": total,
+            "mean": total / count if count else 0.0,
+            "max": peak,
+            **percentiles(samples),
+        }
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    A QueueHandler that never blocks the caller: records are dropped, and
+    counted, while the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_handler = DroppingQueueHandler(_log_queue)
+_log_listener = None
+_log_listener_lock = threading.Lock()
+
+
+def start_log_listener():
+    """
+    Start, or restart after a fork, the thread that writes queued log records
+    to stderr. Until it runs, records wait in the queue.
+    """
+    global _log_listener
+    with _log_listener_lock:
+        if _log_listener is not None and _log_listener._thread is not None:
+            if _log_listener._thread.is_alive():
+                return _log_listener
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+        _log_listener = QueueListener(_log_queue, stream)
+        _log_listener.start()
+        return _log_listener
+
+
+def _reset_log_queue_after_fork():
+    # The listener thread does not survive fork() and may have held the
+    # queue's lock, so the child starts over with an empty queue
+    global _log_queue, _log_listener
+    _log_queue = _log_handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _log_listener = None
+
+
+os.register_at_fork(after_in_child=_reset_log_queue_after_fork)
+
+
+def get_logger(name):
+    """
+    A logger whose records go through the shared non-blocking queue.
+    """
+    logger = logging.getLogger(name)
+    if _log_handler not in logger.handlers:
+        logger.addHandler(_log_handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+    return logger
+
+
+sql_log = get_logger("sql")
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """
+    Normalize a statement so that executions differing only in literals,
+    whitespace or the length of an IN (?, ?, ...) list are grouped together.
+    """
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    sql = _LITERALS.sub("?", sql)
+    return _PLACEHOLDER_LISTS.sub("?, ...", sql)
+
+
+class ThreadState(threading.local):
+    # Seconds spent in SQL by this thread, read before and after a request
+    db_time = 0.0
+
+
+thread_state = ThreadState()
+
+
+class QueryStats:
+    def __init__(self, max_queries=SQL_METRICS_MAX_QUERIES):
+        self.max_queries = max_queries
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        entry = self._queries.get(key)
+        if entry is None:
+            with self._lock:
+                if key not in self._queries and len(self._queries) >= self.max_queries:
+                    key = "other"
+                entry = self._queries.setdefault(
+                    key, {"duration": Histogram(), "rows": 0, "errors": 0}
+                )
+        return entry
+
+    def record(self, sql, duration, rows):
+        entry = self._entry(fingerprint(sql))
+        entry["duration"].observe(duration)
+        thread_state.db_time += duration
+        # Unlocked counter: an occasional lost increment is acceptable here
+        entry["rows"] += rows
+
+        duration_ms = duration * 1000
+        if duration_ms >= SQL_SLOW_QUERY_MS:
+            sql_log.warning("slow query %.1fms rows=%d: %s", duration_ms, rows, sql)
+        elif SQL_LOG_SAMPLE_RATE and random.random() < SQL_LOG_SAMPLE_RATE:
+            sql_log.info("%.2fms rows=%d: %s", duration_ms, rows, sql)
+
+    def record_error(self, sql, error):
+        self._entry(fingerprint(sql))["errors"] += 1
+        sql_log.error("query failed: %s: %s", error, sql)
+
+    def snapshot(self, limit=None):
+        """
+        Per fingerprint counts and durations in milliseconds, most total time
+        first.
+        """
+        with self._lock:
+            queries = list(self._queries.items())
+        result = []
+        for query, entry in queries:
+            duration = entry["duration"].snapshot()
+            result.append(
+                {
+                    "query": query,
+                    "count": duration["count"],
+                    "rows": entry["rows"],
+                    "errors": entry["errors"],
+                    **{
+                        f"{name}_ms": round(duration[name] * 1000, 3)
+                        for name in ("total", "mean", "max", "p50", "p95", "p99")
+                        if name in duration
+                    },
+                }
+            )
+        result.sort(key=lambda query: query.get("total_ms", 0), reverse=True)
+        return result[:limit] if limit else result
+
+    def reset(self):
+        with self._lock:
+            self._queries = {}
+
+
+query_stats = QueryStats()
+
+
+def logging_stats():
+    return {
+        "queued": _log_queue.qsize(),
+        "dropped": _log_handler.dropped,
+        "sample_rate": SQL_LOG_SAMPLE_RATE,
+        "slow_query_ms": SQL_SLOW_QUERY_MS,
+    }
+
+
+class RouteShard:
+    """
+    One thread's counters for one route. Only the owning thread writes to
+    it, so recording a request takes no lock.
+    """
+
+    __slots__ = ("statuses", "latency", "latency_sum", "size", "size_sum", "db_sum")
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.size = [0] * (len(SIZE_BUCKETS) + 1)
+        self.size_sum = 0
+        self.db_sum = 0.0
+
+    def merge(self, other):
+        # list() so a concurrent write to a live shard cannot break iteration
+        for status, count in list(other.statuses.items()):
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.latency = [a + b for a, b in zip(self.latency, other.latency)]
+        self.latency_sum += other.latency_sum
+        self.size = [a + b for a, b in zip(self.size, other.size)]
+        self.size_sum += other.size_sum
+        self.db_sum += other.db_sum
+
+
+class ThreadShard:
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.routes = {}
+        self.started = 0
+        self.finished = 0
+
+
+class RequestMetrics:
+    """
+    Per route request counts by status, latency, response size and SQL time
+    histograms, and in-flight requests for one Flask app. Each request thread
+    records into its own shard; shards are summed when metrics are exported,
+    and the shards of threads that have exited are folded into a retired
+    total so the counters stay cumulative.
+    """
+
+    def __init__(self, app_name):
+        self.app_name = app_name
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._retired_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = ThreadShard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def before_request(self):
+        self._shard().started += 1
+        g._metrics_started = time.perf_counter()
+        g._metrics_db_time = thread_state.db_time
+
+    def after_request(self, response):
+        g._metrics_status = response.status_code
+        g._metrics_size = response.content_length or 0
+        return response
+
+    def teardown_request(self, exception=None):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        db_time = thread_state.db_time - g.pop("_metrics_db_time", 0.0)
+        status = g.pop("_metrics_status", 500)
+        size = g.pop("_metrics_size", 0)
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+
+        shard = self._shard()
+        route = shard.routes.get((rule, request.method))
+        if route is None:
+            route = shard.routes[(rule, request.method)] = RouteShard()
+        route.statuses[status] = route.statuses.get(status, 0) + 1
+        route.latency[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        route.latency_sum += elapsed
+        route.size[bisect.bisect_left(SIZE_BUCKETS, size)] += 1
+        route.size_sum += size
+        route.db_sum += db_time
+        shard.finished += 1
+
+    def collect(self):
+        """
+        Return ({(route, method): RouteShard}, in_flight) summed over all
+        threads.
+        """
+        with self._lock:
+            live = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    live.append(shard)
+                    continue
+                for key, route in shard.routes.items():
+                    self._retired.setdefault(key, RouteShard()).merge(route)
+                self._retired_in_flight += shard.started - shard.finished
+            self._shards = live
+
+            totals = {}
+            for key, route in self._retired.items():
+                totals.setdefault(key, RouteShard()).merge(route)
+            in_flight = self._retired_in_flight
+            for shard in live:
+                for key, route in list(shard.routes.items()):
+                    totals.setdefault(key, RouteShard()).merge(route)
+                in_flight += shard.started - shard.finished
+        return totals, in_flight
+
+    def prometheus(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        totals, in_flight = self.collect()
+        lines = []
+
+        def labels(rule, method, **extra):
+            pairs = {"app": self.app_name, "route": rule, "method": method, **extra}
+            return ",".join(
+                f'{key}="{_escape_label(value)}"' for key, value in pairs.items()
+            )
+
+        def histogram(name, help, buckets, counts_of, sum_of):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for (rule, method), route in sorted(totals.items()):
+                cumulative = 0
+                for bound, count in zip(buckets, counts_of(route)):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{{{labels(rule, method, le=bound)}}} {cumulative}"
+                    )
+                count = sum(counts_of(route))
+                lines.append(
+                    f'{name}_bucket{{{labels(rule, method, le="+Inf")}}} {count}'
+                )
+                lines.append(f"{name}_sum{{{labels(rule, method)}}} {sum_of(route)}")
+                lines.append(f"{name}_count{{{labels(rule, method)}}} {count}")
+
+        lines.append("# HELP http_requests_total Requests handled, by route and status")
+        lines.append("# TYPE http_requests_total counter")
+        for (rule, method), route in sorted(totals.items()):
+            for status, count in sorted(route.statuses.items()):
+                lines.append(
+                    f"http_requests_total{{{labels(rule, method, status=status)}}} {count}"
+                )
+
+        histogram(
+            "http_request_duration_seconds",
+            "Time from the start of request handling to teardown",
+            LATENCY_BUCKETS,
+            lambda route: route.latency,
+            lambda route: route.latency_sum,
+        )
+        histogram(
+            "http_response_size_bytes",
+            "Response body size, 0 for streamed responses",
+            SIZE_BUCKETS,
+            lambda route: route.size,
+            lambda route: route.size_sum,
+        )
+
+        lines.append("# HELP http_request_db_seconds Time spent in SQL per request")
+        lines.append("# TYPE http_request_db_seconds summary")
+        for (rule, method), route in sorted(totals.items()):
+            lines.append(
+                f"http_request_db_seconds_sum{{{labels(rule, method)}}} {route.db_sum}"
+            )
+            lines.append(
+                f"http_request_db_seconds_count{{{labels(rule, method)}}} {sum(route.latency)}"
+            )
+
+        lines.append("# HELP http_requests_in_flight Requests currently being handled")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        lines.append(
+            f'http_requests_in_flight{{app="{_escape_label(self.app_name)}"}} {in_flight}'
+        )
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def init_request_metrics(app, app_name):
+    """
+    Record per route request metrics for ``app`` and serve them in the
+    Prometheus text format at /metrics.
+    """
+    metrics = RequestMetrics(app_name)
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+    app.teardown_request(metrics.teardown_request)
+
+    def export():
+        if METRICS_TOKEN:
+            supplied = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(supplied, f"Bearer {METRICS_TOKEN}"):
+                return Response("Unauthorized\n", status=401, mimetype="text/plain")
+        return Response(
+            metrics.prometheus(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+    app.add_url_rule("/metrics", "metrics", export)
+    return metrics
@@ -1,13 +1,20 @@
 import sqlite3
-import hashlib
 import os
+import sys
+
+from db import DATABASE, apply_storage_profile
+from passwords import hash_password
 
 
 def create_tables():
     # Connect to the SQLite database (or create it if it doesn't exist)
-    conn = sqlite3.connect("insurance.db")
+    conn = sqlite3.connect(DATABASE)
     cursor = conn.cursor()
 
+    # Switch the journal mode and persistent pragmas for the storage profile
+    profile = apply_storage_profile(conn)
+    print("Storage profile applied:", profile)
+
     # Enable foreign key constraints
     cursor.execute("PRAGMA foreign_keys = ON")
 
@@ -88,7 +95,7 @@ def create_tables():
             invoices TEXT NOT NULL,             -- Stores the file location of the invoice on disk
             status TEXT NOT NULL DEFAULT 'Pending',  -- Status of the claim (Pending, Reviewing, Approved, Denied)
             status_message TEXT,                -- Message from the insurance company regarding the claim status
-            internal_status TEXT NOT NULL DEFAULT 'Pending',  -- Status of the claim (Pending, Reviewing, 2nd Level Review, Approved, Denied)
+            internal_status TEXT NOT NULL DEFAULT 'Pending',  -- Status of the claim (Pending, Scheduled, Reviewing, 2nd Level Review, Approved, Denied)
             internal_status_message TEXT,                -- Message from the insurance company regarding the claim status
             cause_of_damage TEXT,               -- The cause of the damage for devices
             FOREIGN KEY (policy_id) REFERENCES Policy(id)
@@ -131,12 +138,624 @@ def create_tables():
     conn.close()
 
 
-def hash_password(password):
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+def add_column_if_missing(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def add_invoice_blob_columns(conn):
+    add_column_if_missing(conn, "Claims", "invoice_sha256", "TEXT")
+    add_column_if_missing(conn, "Claims", "invoice_size", "INTEGER")
+    add_column_if_missing(conn, "Claims", "invoice_mime_type", "TEXT")
+    add_column_if_missing(conn, "Claims", "invoice_filename", "TEXT")
+
+
+# Version 1 of the check catalogue: (policy_type, version, position,
+# check_name, expected_value template, operator). Templates are rendered with
+# str.format against the combined policy object of the claim.
+CHECK_RULES = [
+    (
+        "Windscreen",
+        1,
+        1,
+        "Verify damage_date occurred before claim_date",
+        "damage_date < claim_date",
+        "<",
+    ),
+    (
+        "Windscreen",
+        1,
+        2,
+        "Verify claim_date is after date_of_repair",
+        "date_of_repair < claim_date",
+        "<",
+    ),
+    (
+        "Windscreen",
+        1,
+        3,
+        "Verify the date on the invoice is before claim_date",
+        "invoice_date < claim_date",
+        "<",
+    ),
+    (
+        "Windscreen",
+        1,
+        4,
+        "Verify the date on the invoice and date of repair are within 14 days of each other",
+        "delta between date_of_repair and invoice_date <= 14",
+        "<=",
+    ),
+    (
+        "Windscreen",
+        1,
+        5,
+        "Verify a license plate number of the vehicle is on the invoice",
+        "{policy[vehicle][license_plate]}",
+        "IN",
+    ),
+    (
+        "Windscreen",
+        1,
+        6,
+        "Verify License Plate of policy matches the plate on the invoice",
+        "{policy[vehicle][license_plate]}",
+        "=",
+    ),
+    (
+        "Windscreen",
+        1,
+        7,
+        "Verify Policy Number is on the invoice",
+        "{policy[policy_number]}",
+        "IN",
+    ),
+    (
+        "Windscreen",
+        1,
+        8,
+        "Verify Name on the invoice reasonably matches the policy holder",
+        "{policy_holder[first_name]} {policy_holder[last_name]}",
+        "=",
+    ),
+    (
+        "Windscreen",
+        1,
+        9,
+        "Verify Claim Total invoiced cost does not exceed 1200",
+        "1200",
+        "<=",
+    ),
+    (
+        "Windscreen",
+        1,
+        10,
+        "Verify the Claim invoiced total exceeds deductible",
+        "{policy[deductible]}",
+        ">",
+    ),
+    (
+        "Windscreen",
+        1,
+        11,
+        "Verify labor invoiced costs are in range",
+        "0<=cost<=150 or not present",
+        "<=",
+    ),
+    (
+        "Windscreen",
+        1,
+        12,
+        "Verify the adhesive set invoiced costs are in range",
+        "0<=cost<=40 or not present",
+        "<=",
+    ),
+    (
+        "Windscreen",
+        1,
+        13,
+        "Verify Env and small materials invoiced costs are in range",
+        "0<=cost<=10 or not present",
+        "<=",
+    ),
+    (
+        "Windscreen",
+        1,
+        14,
+        "Verify Sensor invoiced costs are in range",
+        "0<=cost<=10 or not present",
+        "<=",
+    ),
+    (
+        "Windscreen",
+        1,
+        15,
+        "Verify the calibration invoiced costs are in range",
+        "0<=cost<=100 or not present",
+        "<=",
+    ),
+    (
+        "Device",
+        1,
+        1,
+        "Determine and record the depreciated value of device based on purchase date and current replacement value",
+        None,
+        None,
+    ),
+    (
+        "Device",
+        1,
+        2,
+        "Check the current prices online to determine replacement value",
+        None,
+        None,
+    ),
+    ("Device", 1, 3, "Determine the repair cost of the device", None, None),
+    (
+        "Device",
+        1,
+        4,
+        "Find the minimum of the replacement value and repair cost",
+        "min(replacement_value, repair_cost)",
+        "min",
+    ),
+]
+
+
+def seed_check_rules(conn):
+    conn.executemany(
+        "INSERT OR IGNORE INTO ClaimCheckRules (policy_type, version, position, check_name, expected_value, operator) VALUES (?, ?, ?, ?, ?, ?)",
+        CHECK_RULES,
+    )
+
+
+# Fact each version 1 check compares against its expected_value, as a dotted
+# path into the facts the evaluator gathers for a claim. Checks whose
+# expected_value is itself a comparison between facts ("damage_date <
+# claim_date") need no subject; checks without one are left to the reviewer.
+CHECK_RULE_SUBJECTS = [
+    ("Windscreen", 1, 5, "invoice_text"),
+    ("Windscreen", 1, 6, "invoice_license_plate"),
+    ("Windscreen", 1, 7, "invoice_text"),
+    ("Windscreen", 1, 9, "invoice_total"),
+    ("Windscreen", 1, 10, "invoice_total"),
+    ("Windscreen", 1, 11, "line_items.labor"),
+    ("Windscreen", 1, 12, "line_items.adhesive"),
+    ("Windscreen", 1, 13, "line_items.materials"),
+    ("Windscreen", 1, 14, "line_items.sensor"),
+    ("Windscreen", 1, 15, "line_items.calibration"),
+]
+
+
+def add_scheduler_columns(conn):
+    add_column_if_missing(conn, "Claims", "scheduler_owner", "TEXT")
+    add_column_if_missing(conn, "Claims", "lease_until", "REAL")
+    add_column_if_missing(
+        conn, "Claims", "scheduler_attempts", "INTEGER NOT NULL DEFAULT 0"
+    )
+    add_column_if_missing(conn, "Claims", "scheduler_not_before", "REAL")
+
+
+def add_check_subjects(conn):
+    add_column_if_missing(conn, "ClaimCheckRules", "subject", "TEXT")
+    add_column_if_missing(conn, "ClaimsProcessingChecks", "subject", "TEXT")
+    conn.executemany(
+        "UPDATE ClaimCheckRules SET subject = ? WHERE policy_type = ? AND version = ? AND position = ?",
+        [
+            (subject, policy_type, version, position)
+            for policy_type, version, position, subject in CHECK_RULE_SUBJECTS
+        ],
+    )
+    # Checks created before this migration pick up the subject of their rule
+    conn.execute(
+        """
+        UPDATE ClaimsProcessingChecks
+        SET subject = (
+            SELECT r.subject FROM ClaimCheckRules r
+            WHERE r.check_name = ClaimsProcessingChecks.check_name AND r.subject IS NOT NULL
+            ORDER BY r.version DESC LIMIT 1
+        )
+        WHERE subject IS NULL
+        """
+    )
+
+
+# Every table a claim bundle is built from drops the bundles it feeds when it
+# changes, whichever process or code path writes to it. Claims columns only
+# the scheduler touches (leases, attempts) are left out.
+CLAIM_BUNDLE_CLAIM_COLUMNS = (
+    "policy_id, claim_date, damage_date, date_of_repair, status, status_message, "
+    "invoices, invoice_sha256, invoice_size, invoice_mime_type, invoice_filename, "
+    "internal_status, internal_status_message, cause_of_damage"
+)
+CLAIM_BUNDLE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS claim_bundles_claim_update
+    AFTER UPDATE OF {CLAIM_BUNDLE_CLAIM_COLUMNS} ON Claims
+    BEGIN
+        DELETE FROM ClaimBundles WHERE claim_id = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS claim_bundles_claim_delete
+    AFTER DELETE ON Claims
+    BEGIN
+        DELETE FROM ClaimBundles WHERE claim_id = OLD.id;
+    END
+    """,
+    *[
+        f"""
+        CREATE TRIGGER IF NOT EXISTS claim_bundles_check_{event.lower()}
+        AFTER {event} ON ClaimsProcessingChecks
+        BEGIN
+            DELETE FROM ClaimBundles WHERE claim_id = {row}.claim_id;
+        END
+        """
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "OLD"), ("DELETE", "OLD"))
+    ],
+    """
+    CREATE TRIGGER IF NOT EXISTS claim_bundles_policy_update
+    AFTER UPDATE ON Policy
+    BEGIN
+        DELETE FROM ClaimBundles WHERE claim_id IN (
+            SELECT id FROM Claims WHERE policy_id = OLD.id
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS claim_bundles_user_update
+    AFTER UPDATE OF first_name, last_name, phone, email, username ON User
+    BEGIN
+        DELETE FROM ClaimBundles WHERE claim_id IN (
+            SELECT c.id FROM Claims c JOIN Policy p ON p.id = c.policy_id
+            WHERE p.user_id = OLD.id
+        );
+    END
+    """,
+    *[
+        f"""
+        CREATE TRIGGER IF NOT EXISTS claim_bundles_{table.lower()}_{event.lower()}
+        AFTER {event} ON {table}
+        BEGIN
+            DELETE FROM ClaimBundles WHERE claim_id IN (
+                SELECT c.id FROM Claims c JOIN Policy p ON p.id = c.policy_id
+                WHERE p.{column} = OLD.id
+            );
+        END
+        """
+        for table, column in (("Vehicles", "vehicle_id"), ("Devices", "device_id"))
+        for event in ("UPDATE", "DELETE")
+    ],
+    *[
+        f"""
+        CREATE TRIGGER IF NOT EXISTS claim_bundles_extraction_{event.lower()}
+        AFTER {event} ON InvoiceExtractions
+        BEGIN
+            DELETE FROM ClaimBundles WHERE claim_id IN (
+                SELECT id FROM Claims WHERE invoice_sha256 = NEW.sha256
+            );
+        END
+        """
+        for event in ("INSERT", "UPDATE")
+    ],
+]
+
+# Every change to the check catalogue bumps the generation that
+# CheckRuleRegistry compares against in each process
+CHECK_RULE_GENERATION_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS check_rule_generation_{event.lower()}
+    AFTER {event} ON ClaimCheckRules
+    BEGIN
+        UPDATE CheckRuleGeneration SET generation = generation + 1;
+    END
+    """
+    for event in ("INSERT", "UPDATE", "DELETE")
+]
+
+
+# Versioned schema changes applied on top of create_tables(). Each entry is
+# (version, description, steps); a step is either a SQL statement or a
+# callable taking the connection. PRAGMA user_version records the last
+# version applied, and every step must be safe to run against a database
+# that already has the change.
+MIGRATIONS = [
+    (
+        1,
+        "Secondary indexes for claim, check and policy lookups",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_claims_status ON Claims (status, claim_date, id)",
+            "CREATE INDEX IF NOT EXISTS idx_claims_policy_id ON Claims (policy_id, claim_date, id)",
+            "CREATE INDEX IF NOT EXISTS idx_checks_claim_id ON ClaimsProcessingChecks (claim_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_policy_user_id ON Policy (user_id, type)",
+        ],
+    ),
+    (
+        2,
+        "Index for keyset pagination of claims by (claim_date, id)",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_claims_claim_date ON Claims (claim_date, id)",
+        ],
+    ),
+    (
+        3,
+        "Outbox for workflow invocations queued by claim creation",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ClaimDispatchOutbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                claim_id INTEGER NOT NULL,
+                workflow TEXT NOT NULL,             -- Workflow alias to invoke
+                payload TEXT NOT NULL,              -- JSON body posted to the workflow server
+                status TEXT NOT NULL DEFAULT 'Pending',  -- Pending, InFlight, Sent, Dead
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,      -- Unix time the next attempt is due
+                locked_until REAL,                  -- Lease held by the dispatcher while InFlight
+                last_error TEXT,
+                created_at DATETIME NOT NULL DEFAULT (datetime('now')),
+                sent_at DATETIME,
+                FOREIGN KEY (claim_id) REFERENCES Claims(id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_outbox_due ON ClaimDispatchOutbox (status, next_attempt_at)",
+        ],
+    ),
+    (
+        4,
+        "Content-addressed invoice metadata on Claims",
+        [
+            add_invoice_blob_columns,
+            "CREATE INDEX IF NOT EXISTS idx_claims_invoice_sha256 ON Claims (invoice_sha256)",
+        ],
+    ),
+    (
+        5,
+        "Versioned check catalogue used to create claim processing checks",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ClaimCheckRules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                policy_type TEXT NOT NULL,          -- Policy type the rule applies to (Windscreen, Device, ...)
+                version INTEGER NOT NULL,           -- Catalogue version; the highest active version is used
+                position INTEGER NOT NULL,          -- Order of the check within the catalogue
+                check_name TEXT NOT NULL,
+                expected_value TEXT,                -- str.format template rendered against the combined policy
+                operator TEXT,
+                active INTEGER NOT NULL DEFAULT 1,
+                UNIQUE (policy_type, version, position)
+            )
+            """,
+            seed_check_rules,
+        ],
+    ),
+    (
+        6,
+        "Subjects for checks the server can evaluate without the agent",
+        [add_check_subjects],
+    ),
+    (
+        7,
+        "Change feed of claim and check updates",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ClaimChanges (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,  -- Monotonic change sequence; clients resume after it
+                entity TEXT NOT NULL,               -- claim or check
+                entity_id INTEGER NOT NULL,
+                claim_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,              -- JSON of the row after the change
+                created_at DATETIME NOT NULL DEFAULT (datetime('now'))
+            )
+            """,
+        ],
+    ),
+    (
+        8,
+        "Scheduler leases on Claims",
+        [
+            add_scheduler_columns,
+            "CREATE INDEX IF NOT EXISTS idx_claims_internal_status ON Claims (internal_status, claim_date, id)",
+        ],
+    ),
+    (
+        9,
+        "One check per name per claim, and idempotency keys for claim updates",
+        [
+            # Concurrent Reviewing transitions could insert a claim's checks
+            # twice; keep the most processed copy of each check
+            """
+            DELETE FROM ClaimsProcessingChecks WHERE id NOT IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY claim_id, check_name
+                        ORDER BY status = 'Pending', id
+                    ) AS copy
+                    FROM ClaimsProcessingChecks
+                )
+                WHERE copy = 1
+            )
+            """,
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_checks_claim_check_name ON ClaimsProcessingChecks (claim_id, check_name)",
+            """
+            CREATE TABLE IF NOT EXISTS IdempotencyKeys (
+                key TEXT NOT NULL,                  -- Idempotency-Key header sent by the client
+                scope TEXT NOT NULL,                -- Method and path the key was used for
+                request_hash TEXT NOT NULL,         -- SHA-256 of the request body
+                status_code INTEGER NOT NULL,
+                response TEXT NOT NULL,             -- JSON response replayed for retries
+                created_at REAL NOT NULL,
+                PRIMARY KEY (key, scope)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON IdempotencyKeys (created_at)",
+        ],
+    ),
+    (
+        10,
+        "Cache of fields extracted from invoices, keyed by content hash",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS InvoiceExtractions (
+                sha256 TEXT PRIMARY KEY,            -- Content hash of the invoice blob
+                status TEXT NOT NULL,               -- Pending, Extracted, NoText or Failed
+                source TEXT,                        -- text (PDF text layer) or ocr:<backend>
+                fields TEXT,                        -- JSON of the structured invoice fields
+                text TEXT,                          -- Full text of the invoice
+                error TEXT,
+                extractor_version INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """,
+        ],
+    ),
+    (
+        11,
+        "Materialized claim review bundles, dropped by triggers on every write they depend on",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ClaimBundles (
+                claim_id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,              -- JSON served by GET /claims/<id>/bundle
+                etag TEXT NOT NULL,
+                built_at REAL NOT NULL
+            )
+            """,
+            *CLAIM_BUNDLE_TRIGGERS,
+        ],
+    ),
+    (
+        12,
+        "Progress of resumable bulk imports",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ImportCheckpoints (
+                name TEXT PRIMARY KEY,              -- Import name, by default the source file's path
+                position INTEGER NOT NULL,          -- Number of source records already committed
+                imported INTEGER NOT NULL DEFAULT 0,
+                rejected INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+            """,
+        ],
+    ),
+    (
+        13,
+        "Generation counter of the check catalogue, shared by all processes",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS CheckRuleGeneration (
+                id INTEGER PRIMARY KEY CHECK (id = 1),  -- Single row
+                generation INTEGER NOT NULL
+            )
+            """,
+            "INSERT OR IGNORE INTO CheckRuleGeneration (id, generation) VALUES (1, 0)",
+            *CHECK_RULE_GENERATION_TRIGGERS,
+        ],
+    ),
+    (
+        14,
+        "Statistics published by running claim schedulers",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS SchedulerStats (
+                owner TEXT PRIMARY KEY,             -- host:pid:nonce of the scheduler process
+                stats TEXT NOT NULL,                -- JSON of ClaimScheduler.stats()
+                updated_at REAL NOT NULL
+            )
+            """,
+        ],
+    ),
+]
+
+# Queries on request paths that must be served from an index. Parameters are
+# placeholders; only the plan matters.
+HOT_QUERIES = [
+    ("SELECT * FROM Claims WHERE status = ?", ("Pending",)),
+    ("SELECT * FROM Claims WHERE policy_id = ?", (1,)),
+    (
+        "SELECT * FROM Claims WHERE (claim_date, id) > (?, ?) ORDER BY claim_date, id LIMIT ?",
+        ("2024-01-01", 1, 51),
+    ),
+    (
+        "SELECT * FROM Claims WHERE status = ? AND (claim_date, id) > (?, ?) ORDER BY claim_date, id LIMIT ?",
+        ("Pending", "2024-01-01", 1, 51),
+    ),
+    ("SELECT * FROM ClaimsProcessingChecks WHERE claim_id = ?", (1,)),
+    (
+        "SELECT COUNT(*) FROM ClaimsProcessingChecks WHERE claim_id = ? AND status = ?",
+        (1, "Pending"),
+    ),
+    (
+        "SELECT status, COUNT(*) FROM ClaimsProcessingChecks WHERE claim_id = ? GROUP BY status",
+        (1,),
+    ),
+    ("SELECT * FROM Policy WHERE user_id = ?", (1,)),
+    (
+        "SELECT id FROM ClaimDispatchOutbox WHERE (status = 'Pending' AND next_attempt_at <= ?) OR (status = 'InFlight' AND locked_until < ?)",
+        (0, 0),
+    ),
+    ("SELECT * FROM Policy WHERE policy_number = ? AND user_id = ?", ("P1", 1)),
+    ("SELECT * FROM ClaimChanges WHERE seq > ? ORDER BY seq LIMIT ?", (0, 500)),
+    (
+        "SELECT id FROM Claims WHERE internal_status = 'Pending' ORDER BY claim_date, id LIMIT ?",
+        (8,),
+    ),
+    (
+        "SELECT id FROM Claims WHERE internal_status = 'Scheduled' AND lease_until < ?",
+        (0,),
+    ),
+]
+
+
+def run_migrations():
+    conn = sqlite3.connect(DATABASE)
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    try:
+        for version, description, steps in MIGRATIONS:
+            if version <= current:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print(f"Applied migration {version}: {description}")
+            current = version
+    finally:
+        conn.close()
+    return current
+
+
+def check_query_plans():
+    """
+    Run EXPLAIN QUERY PLAN for each of HOT_QUERIES and return the ones that
+    fall back to a full table scan, as (query, plan detail) pairs.
+    """
+    conn = sqlite3.connect(DATABASE)
+    failures = []
+    try:
+        for query, params in HOT_QUERIES:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+            for row in plan:
+                detail = row[3]
+                if detail.startswith("SCAN") and "INDEX" not in detail:
+                    failures.append((query, detail))
+    finally:
+        conn.close()
+    return failures
 
 
 def seed_database():
-    conn = sqlite3.connect("insurance.db")
+    conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     admin_exists = conn.execute(
         'SELECT * FROM User WHERE username = "admin"'
@@ -154,7 +773,7 @@ def seed_database():
 
 
 def integrity_check():
-    conn = sqlite3.connect("insurance.db")
+    conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     cursor.execute("PRAGMA integrity_check;")
@@ -165,6 +784,13 @@ def integrity_check():
 if __name__ == "__main__":
     create_tables()
     print("Tables created successfully.")
+    version = run_migrations()
+    print("Schema at version", version)
     seed_database()
     print("Database seeded successfully.")
     integrity_check()
+    scans = check_query_plans()
+    for query, detail in scans:
+        print(f"Hot query falls back to a scan: {query} -> {detail}")
+    if scans:
+        sys.exit(1)
@@ -0,0 +1,224 @@
+import base64
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import get_logger
+
+# scrypt (default) or pbkdf2_sha256. Existing hashes keep verifying after
+# either is changed and are upgraded on the user's next login.
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "scrypt")
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2**14)))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "600000"))
+
+# At most PASSWORD_HASH_WORKERS hashes run at once and PASSWORD_HASH_QUEUE
+# more wait for a worker; requests beyond that are turned away immediately
+PASSWORD_HASH_WORKERS = int(
+    os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))
+)
+PASSWORD_HASH_QUEUE = int(
+    os.getenv("PASSWORD_HASH_QUEUE", str(PASSWORD_HASH_WORKERS * 4))
+)
+
+LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+log = get_logger(__name__)
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(data):
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+class ScryptHasher:
+    name = "scrypt"
+
+    def __init__(self, n=None, r=None, p=None):
+        self.n = n or PASSWORD_SCRYPT_N
+        self.r = r or PASSWORD_SCRYPT_R
+        self.p = p or PASSWORD_SCRYPT_P
+
+    def _derive(self, password, salt, n, r, p):
+        return hashlib.scrypt(
+            password.encode("utf-8"),
+            salt=salt,
+            n=n,
+            r=r,
+            p=p,
+            maxmem=256 * n * r * p + 1024 * 1024,
+            dklen=32,
+        )
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        key = self._derive(password, salt, self.n, self.r, self.p)
+        return f"scrypt${self.n}${self.r}${self.p}${_b64encode(salt)}${_b64encode(key)}"
+
+    def verify(self, password, encoded):
+        _, n, r, p, salt, key = encoded.split("$")
+        derived = self._derive(password, _b64decode(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(derived, _b64decode(key))
+
+    def is_current(self, encoded):
+        return encoded.split("$")[1:4] == [str(self.n), str(self.r), str(self.p)]
+
+
+class PBKDF2Hasher:
+    name = "pbkdf2_sha256"
+
+    def __init__(self, iterations=None):
+        self.iterations = iterations or PASSWORD_PBKDF2_ITERATIONS
+
+    def _derive(self, password, salt, iterations):
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        key = self._derive(password, salt, self.iterations)
+        return f"pbkdf2_sha256${self.iterations}${_b64encode(salt)}${_b64encode(key)}"
+
+    def verify(self, password, encoded):
+        _, iterations, salt, key = encoded.split("$")
+        derived = self._derive(password, _b64decode(salt), int(iterations))
+        return hmac.compare_digest(derived, _b64decode(key))
+
+    def is_current(self, encoded):
+        return encoded.split("$")[1] == str(self.iterations)
+
+
+HASHERS = {hasher.name: hasher for hasher in (ScryptHasher, PBKDF2Hasher)}
+
+hasher = HASHERS[PASSWORD_HASHER]()
+
+
+def hash_password(password):
+    return hasher.hash(password)
+
+
+def verify_password(password, encoded):
+    """
+    Check a password against a stored hash of any supported scheme, including
+    the unsalted SHA-256 hex digests stored before salted hashing.
+    """
+    if not encoded:
+        return False
+    if LEGACY_SHA256.match(encoded):
+        legacy = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(legacy, encoded)
+    scheme = encoded.split("$", 1)[0]
+    if scheme not in HASHERS:
+        return False
+    try:
+        return HASHERS[scheme]().verify(password, encoded)
+    except ValueError as e:
+        # Malformed fields, bad base64 or parameters hashlib refuses
+        log.warning("Unreadable %s password hash: %s", scheme, e)
+        return False
+
+
+def needs_rehash(encoded):
+    return not encoded.startswith(hasher.name + "$") or not hasher.is_current(encoded)
+
+
+class HashingPool:
+    """
+    Runs password hashing on a small dedicated thread pool. hashlib releases
+    the GIL while deriving keys, so hashing proceeds in parallel without
+    tying up more than ``workers`` cores. Up to ``queue_size`` more callers
+    wait for a worker; any beyond that fail at once with HasherBusy instead
+    of piling up behind a login burst.
+    """
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, queue_size=PASSWORD_HASH_QUEUE):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {"completed": 0, "rejected": 0}
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise HasherBusy("Password hashing is overloaded")
+        try:
+            if self._executor is None:
+                with self._lock:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.workers, thread_name_prefix="password-hash"
+                        )
+            result = self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+        with self._lock:
+            self._stats["completed"] += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["workers"] = self.workers
+        stats["hasher"] = hasher.name
+        return stats
+
+
+hashing_pool = HashingPool()
+
+_dummy_hash = None
+_dummy_hash_lock = threading.Lock()
+
+
+def dummy_hash():
+    """
+    A hash of a random password in the current scheme, computed once
+    through the hashing pool.
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        with _dummy_hash_lock:
+            if _dummy_hash is None:
+                _dummy_hash = hashing_pool.run(hash_password, secrets.token_hex(16))
+    return _dummy_hash
+
+
+def authenticate(conn, username, password):
+    """
+    Return the User row for valid credentials, or None. Legacy and outdated
+    hashes are replaced with the current scheme on a successful login. Raises
+    HasherBusy when the hashing pool is saturated.
+    """
+    user = conn.execute("SELECT * FROM User WHERE username = ?", (username,)).fetchone()
+    if user is None:
+        # Spend the same work on unknown usernames as on wrong passwords
+        hashing_pool.run(verify_password, password, dummy_hash())
+        return None
+
+    if not hashing_pool.run(verify_password, password, user["password"]):
+        return None
+
+    if needs_rehash(user["password"]):
+        conn.execute(
+            "UPDATE User SET password = ? WHERE id = ? AND password = ?",
+            (
+                hashing_pool.run(hash_password, password),
+                user["id"],
+                user["password"],
+            ),
+        )
+        conn.commit()
+    return user
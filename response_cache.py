@@ -0,0 +1,274 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+from auth import current_identity
+from db import DATABASE
+from metrics import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; the table is then per process
+    fcntl = None
+
+POLICY_CACHE_ENABLED = os.getenv("POLICY_CACHE_ENABLED", "true").lower() == "true"
+# Entries older than this are read again even without a write, which bounds
+# staleness after writes by other programs (migrations, imports)
+POLICY_CACHE_TTL = float(os.getenv("POLICY_CACHE_TTL", "300"))
+POLICY_CACHE_MAX_ENTRIES = int(os.getenv("POLICY_CACHE_MAX_ENTRIES", "10000"))
+POLICY_CACHE_MAX_BYTES = int(os.getenv("POLICY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Shared by every process using the same database, so a write in one
+# gunicorn worker invalidates the entries of the others
+CACHE_GENERATION_FILE = os.getenv("CACHE_GENERATION_FILE", f"{DATABASE}-cachegen")
+CACHE_GENERATION_SLOTS = int(os.getenv("CACHE_GENERATION_SLOTS", "65536"))
+
+log = get_logger(__name__)
+
+SLOT = struct.Struct("<Q")
+
+
+class GenerationTable:
+    """
+    A fixed array of 64-bit counters in a memory-mapped file. Every cache key
+    hashes to a slot; writers bump the slot and readers compare it with the
+    value they saw when filling the entry. Keys sharing a slot only cost each
+    other spurious misses. Reading is a plain memory load, so checking an
+    entry needs no system call.
+    """
+
+    def __init__(self, path, slots=CACHE_GENERATION_SLOTS):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+
+    def _open(self):
+        with self._lock:
+            if self._map is not None:
+                return self._map
+            size = self.slots * SLOT.size
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+                self._fd = fd
+            except (OSError, ValueError) as e:
+                log.warning(
+                    "Cache generation table unavailable, using a local one: %s", e
+                )
+                self._map = bytearray(size)
+            return self._map
+
+    def slot(self, key):
+        # crc32 rather than hash(), which differs between processes
+        return zlib.crc32(repr(key).encode("utf-8")) % self.slots
+
+    def get(self, key):
+        table = self._map if self._map is not None else self._open()
+        return SLOT.unpack_from(table, self.slot(key) * SLOT.size)[0]
+
+    def bump(self, key):
+        table = self._map if self._map is not None else self._open()
+        offset = self.slot(key) * SLOT.size
+        with self._lock:
+            if self._fd is not None and fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                value = SLOT.unpack_from(table, offset)[0] + 1
+                SLOT.pack_into(table, offset, value)
+            finally:
+                if self._fd is not None and fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "generation", "expires")
+
+    def __init__(self, body, etag, generation, expires):
+        self.body = body
+        self.etag = etag
+        self.generation = generation
+        self.expires = expires
+
+
+class ResponseCache:
+    """
+    An in-process LRU of serialized JSON responses with a TTL, bounded by
+    entry count and by the total size of the bodies. Entries are invalidated
+    through a GenerationTable shared with the other processes.
+    """
+
+    def __init__(
+        self,
+        generations,
+        ttl=POLICY_CACHE_TTL,
+        max_entries=POLICY_CACHE_MAX_ENTRIES,
+        max_bytes=POLICY_CACHE_MAX_BYTES,
+    ):
+        self.generations = generations
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "not_modified": 0,
+            "stale": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry.body)
+
+    def get(self, key):
+        generation = self.generations.get(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry.generation != generation or entry.expires <= time.monotonic():
+                self._drop(key)
+                self._stats["stale"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key, generation, body):
+        """
+        Store a response body read while the key's generation was
+        ``generation``. If a write bumped it meanwhile, the entry is already
+        stale and the next read misses.
+        """
+        entry = CacheEntry(
+            body,
+            hashlib.sha256(body).hexdigest()[:32],
+            generation,
+            time.monotonic() + self.ttl,
+        )
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+                self._stats["evictions"] += 1
+        return entry
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self.generations.bump(key)
+        with self._lock:
+            for key in keys:
+                self._drop(key)
+            self._stats["invalidations"] += len(keys)
+
+    def count_not_modified(self):
+        with self._lock:
+            self._stats["not_modified"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        stats["max_entries"] = self.max_entries
+        stats["max_bytes"] = self.max_bytes
+        stats["ttl"] = self.ttl
+        stats["enabled"] = POLICY_CACHE_ENABLED
+        return stats
+
+
+policy_cache = ResponseCache(GenerationTable(CACHE_GENERATION_FILE))
+
+
+def policy_cache_keys(user_id, policy_number=None):
+    """
+    The keys a write to one of a user's policies invalidates: the policy's
+    own entry and the user's policy list, cached under policy number None.
+    """
+    keys = [(user_id, None)]
+    if policy_number is not None:
+        keys.append((user_id, policy_number))
+    return keys
+
+
+def invalidate_policy(user_id, *policy_numbers):
+    keys = set(policy_cache_keys(user_id))
+    for policy_number in policy_numbers:
+        keys.update(policy_cache_keys(user_id, policy_number))
+    policy_cache.invalidate(*keys)
+
+
+def etag_response(entry, cache_status):
+    if request.if_none_match.contains_weak(entry.etag):
+        policy_cache.count_not_modified()
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, mimetype="application/json")
+    response.set_etag(entry.etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.headers["X-Cache"] = cache_status
+    return response
+
+
+def cached_policy_read(fn):
+    """
+    Serve a GET handler taking user_id (and policy_number) from
+    policy_cache, with an ETag, and answer a matching If-None-Match with 304.
+    Goes between @jwt_required() and the access check decorator: the owner
+    and the admin are answered from the cache without touching the
+    database, anyone else reaches the handler and its checks. Only 200
+    responses are cached.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        current_user = current_identity()
+        user_id = kwargs.get("user_id")
+        if not POLICY_CACHE_ENABLED or (
+            current_user["username"] != "admin" and current_user["id"] != user_id
+        ):
+            return fn(*args, **kwargs)
+
+        key = (user_id, kwargs.get("policy_number"))
+        entry = policy_cache.get(key)
+        if entry is not None:
+            return etag_response(entry, "hit")
+
+        generation = policy_cache.generations.get(key)
+        result = fn(*args, **kwargs)
+        if not isinstance(result, (dict, list)):
+            return result
+        body = (json.dumps(result) + "\n").encode("utf-8")
+        return etag_response(policy_cache.put(key, generation, body), "miss")
+
+    return wrapper
@@ -0,0 +1,441 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from changes import notify_changes, record_claim_change
+from db import pool
+from dispatch import (
+    OTTO_WORKFLOW,
+    PermanentDispatchError,
+    backoff_delay,
+    create_session,
+    invoke_workflow,
+)
+from metrics import get_logger, start_log_listener
+
+CLAIM_SCHEDULER_ENABLED = (
+    os.getenv("CLAIM_SCHEDULER_ENABLED", "false").lower() == "true"
+)
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "8"))
+# Per policy type caps on concurrent workflow runs, e.g. "Windscreen=6,Device=2"
+SCHEDULER_TYPE_LIMITS = os.getenv("SCHEDULER_TYPE_LIMITS", "")
+# Workflow per policy type, e.g. "Device=device-claim"; other types use OTTO_WORKFLOW
+SCHEDULER_WORKFLOWS = os.getenv("SCHEDULER_WORKFLOWS", "")
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", "3"))
+SCHEDULER_POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", "2"))
+SCHEDULER_LEASE = float(os.getenv("SCHEDULER_LEASE", "120"))
+SCHEDULER_HEARTBEAT = float(os.getenv("SCHEDULER_HEARTBEAT", "30"))
+SCHEDULER_RUN_TIMEOUT = float(os.getenv("SCHEDULER_RUN_TIMEOUT", "1800"))
+# Seconds between writes of the scheduler's statistics to SchedulerStats, where
+# the APIs read them; schedulers silent for three intervals count as stopped
+SCHEDULER_STATS_INTERVAL = float(os.getenv("SCHEDULER_STATS_INTERVAL", "15"))
+
+log = get_logger(__name__)
+
+# A claim is due when it is Pending and not backing off from a failed run
+DUE_CLAIMS = (
+    "c.internal_status = 'Pending' AND COALESCE(c.scheduler_not_before, 0) <= :now"
+)
+
+
+def parse_type_map(value):
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            key, _, setting = item.partition("=")
+            mapping[key.strip()] = setting.strip()
+    return mapping
+
+
+class ClaimScheduler(threading.Thread):
+    """
+    Moves Pending claims into the claim workflow, oldest claim first, with at
+    most ``workers`` runs in flight and at most the configured limit per
+    policy type. A claim is taken with an atomic Pending -> Scheduled update
+    that also writes a lease; the lease is renewed while the run lasts, so
+    claims held by a scheduler that died are picked up again once it expires.
+    """
+
+    def __init__(
+        self,
+        workers=SCHEDULER_WORKERS,
+        type_limits=None,
+        workflows=None,
+        max_attempts=SCHEDULER_MAX_ATTEMPTS,
+        poll_interval=SCHEDULER_POLL_INTERVAL,
+    ):
+        super().__init__(name="claim-scheduler", daemon=True)
+        self.workers = workers
+        if type_limits is None:
+            type_limits = {
+                policy_type: int(limit)
+                for policy_type, limit in parse_type_map(SCHEDULER_TYPE_LIMITS).items()
+            }
+        self.type_limits = type_limits
+        self.workflows = (
+            parse_type_map(SCHEDULER_WORKFLOWS) if workflows is None else workflows
+        )
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.session = create_session(workers)
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._stats = {
+            "scheduled": 0,
+            "recovered": 0,
+            "completed": 0,
+            "retried": 0,
+            "failed": 0,
+            "heartbeats": 0,
+        }
+        self._run_times = deque(maxlen=1000)
+        self._completed_at = deque(maxlen=10000)
+        self._queue = {}
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def limit_for(self, policy_type):
+        return self.type_limits.get(policy_type, self.workers)
+
+    def run(self):
+        last_heartbeat = time.monotonic()
+        last_published = 0
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="claim-scheduler"
+        ) as executor:
+            while not self._stop_event.is_set():
+                try:
+                    self.recover_expired()
+                    for claim in self.schedule_due():
+                        executor.submit(self.process, claim)
+                except Exception as e:
+                    log.error("Error scheduling claims: %s", e)
+
+                if time.monotonic() - last_heartbeat >= SCHEDULER_HEARTBEAT:
+                    try:
+                        self.heartbeat()
+                    except Exception as e:
+                        log.error("Error renewing claim leases: %s", e)
+                    last_heartbeat = time.monotonic()
+
+                if time.monotonic() - last_published >= SCHEDULER_STATS_INTERVAL:
+                    try:
+                        self.publish_stats()
+                    except Exception as e:
+                        log.error("Error publishing scheduler statistics: %s", e)
+                    last_published = time.monotonic()
+
+                self._wake.wait(
+                    min(
+                        self.poll_interval,
+                        SCHEDULER_HEARTBEAT,
+                        SCHEDULER_STATS_INTERVAL,
+                    )
+                )
+                self._wake.clear()
+
+    def recover_expired(self):
+        """
+        Return claims whose lease ran out, because the scheduler holding them
+        stopped heartbeating, to Pending.
+        """
+        with pool.connection() as conn:
+            claims = conn.execute(
+                """
+                UPDATE Claims
+                SET internal_status = 'Pending', scheduler_owner = NULL, lease_until = NULL
+                WHERE internal_status = 'Scheduled' AND lease_until < ?
+                RETURNING id
+                """,
+                (time.time(),),
+            ).fetchall()
+            for claim in claims:
+                record_claim_change(conn, claim["id"])
+            conn.commit()
+        if claims:
+            log.warning(
+                "Recovered %d claims with expired scheduler leases", len(claims)
+            )
+            with self._lock:
+                self._stats["recovered"] += len(claims)
+        return len(claims)
+
+    def schedule_due(self):
+        """
+        Take as many due claims as there are free slots, per policy type and
+        overall, oldest policy type backlog first.
+        """
+        now = time.time()
+        scheduled = []
+        with pool.connection() as conn:
+            queue = conn.execute(
+                f"""
+                SELECT p.type, COUNT(*) AS due, MIN(c.claim_date) AS oldest
+                FROM Claims c JOIN Policy p ON p.id = c.policy_id
+                WHERE {DUE_CLAIMS}
+                GROUP BY p.type
+                ORDER BY oldest
+                """,
+                {"now": now},
+            ).fetchall()
+            with self._lock:
+                self._queue = {row["type"]: row["due"] for row in queue}
+                in_flight = {
+                    policy_type: len(claims)
+                    for policy_type, claims in self._in_flight.items()
+                }
+            free = self.workers - sum(in_flight.values())
+
+            for row in queue:
+                slots = min(
+                    free, self.limit_for(row["type"]) - in_flight.get(row["type"], 0)
+                )
+                if slots <= 0:
+                    continue
+                claims = conn.execute(
+                    f"""
+                    UPDATE Claims
+                    SET internal_status = 'Scheduled',
+                        scheduler_owner = :owner,
+                        lease_until = :lease_until,
+                        scheduler_attempts = scheduler_attempts + 1
+                    WHERE id IN (
+                        SELECT c.id FROM Claims c JOIN Policy p ON p.id = c.policy_id
+                        WHERE p.type = :type AND ({DUE_CLAIMS})
+                        ORDER BY c.claim_date, c.id
+                        LIMIT :slots
+                    )
+                    AND internal_status = 'Pending'
+                    RETURNING id, scheduler_attempts
+                    """,
+                    {
+                        "owner": self.owner,
+                        "lease_until": now + SCHEDULER_LEASE,
+                        "type": row["type"],
+                        "now": now,
+                        "slots": slots,
+                    },
+                ).fetchall()
+                for claim in claims:
+                    record_claim_change(conn, claim["id"])
+                    scheduled.append(
+                        {
+                            "id": claim["id"],
+                            "type": row["type"],
+                            "attempts": claim["scheduler_attempts"],
+                        }
+                    )
+                free -= len(claims)
+            conn.commit()
+
+        if scheduled:
+            notify_changes()
+            with self._lock:
+                for claim in scheduled:
+                    self._in_flight.setdefault(claim["type"], set()).add(claim["id"])
+                    self._stats["scheduled"] += 1
+        return scheduled
+
+    def heartbeat(self):
+        with self._lock:
+            claim_ids = [id for claims in self._in_flight.values() for id in claims]
+        if not claim_ids:
+            return
+        with pool.connection() as conn:
+            conn.execute(
+                f"UPDATE Claims SET lease_until = ? WHERE scheduler_owner = ? AND id IN ({', '.join('?' * len(claim_ids))})",
+                (time.time() + SCHEDULER_LEASE, self.owner, *claim_ids),
+            )
+            conn.commit()
+        with self._lock:
+            self._stats["heartbeats"] += 1
+
+    def process(self, claim):
+        started = time.monotonic()
+        workflow = self.workflows.get(claim["type"], OTTO_WORKFLOW)
+        error = None
+        permanent = False
+        try:
+            invoke_workflow(
+                self.session,
+                workflow,
+                {"input": f"Process claim with ID: {claim['id']}"},
+                wait=True,
+                timeout=SCHEDULER_RUN_TIMEOUT,
+            )
+        except PermanentDispatchError as e:
+            error, permanent = str(e), True
+        except Exception as e:
+            error = str(e)
+
+        try:
+            outcome = self.complete(claim, error, permanent)
+        except Exception as e:
+            # The lease runs out and another pass picks the claim up again
+            log.error("Error completing scheduled claim %s: %s", claim["id"], e)
+            outcome = None
+
+        with self._lock:
+            self._in_flight[claim["type"]].discard(claim["id"])
+            if outcome:
+                self._stats[outcome] += 1
+            if outcome == "completed":
+                self._run_times.append(time.monotonic() - started)
+                self._completed_at.append(time.time())
+        self._wake.set()
+
+    def complete(self, claim, error, permanent=False):
+        with pool.connection() as conn:
+            if error is None:
+                # A run that returns without taking the claim out of Scheduled
+                # did not process it
+                released = conn.execute(
+                    "UPDATE Claims SET scheduler_owner = NULL, lease_until = NULL WHERE id = ? AND scheduler_owner = ? AND internal_status != 'Scheduled' RETURNING id",
+                    (claim["id"], self.owner),
+                ).fetchone()
+                if released:
+                    conn.commit()
+                    return "completed"
+                error = "Workflow run finished without processing the claim"
+
+            if permanent or claim["attempts"] >= self.max_attempts:
+                conn.execute(
+                    """
+                    UPDATE Claims
+                    SET internal_status = '2nd Level Review',
+                        internal_status_message = ?,
+                        scheduler_owner = NULL,
+                        lease_until = NULL
+                    WHERE id = ? AND scheduler_owner = ?
+                    """,
+                    (f"Automatic processing failed: {error}", claim["id"], self.owner),
+                )
+                outcome = "failed"
+                log.warning(
+                    "Claim %s failed automatic processing: %s", claim["id"], error
+                )
+            else:
+                conn.execute(
+                    """
+                    UPDATE Claims
+                    SET internal_status = 'Pending',
+                        scheduler_owner = NULL,
+                        lease_until = NULL,
+                        scheduler_not_before = ?
+                    WHERE id = ? AND scheduler_owner = ?
+                    """,
+                    (
+                        time.time() + backoff_delay(claim["attempts"]),
+                        claim["id"],
+                        self.owner,
+                    ),
+                )
+                outcome = "retried"
+            record_claim_change(conn, claim["id"])
+            conn.commit()
+        notify_changes()
+        return outcome
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = {
+                policy_type: len(claims)
+                for policy_type, claims in self._in_flight.items()
+                if claims
+            }
+            stats["queued"] = dict(self._queue)
+            run_times = sorted(self._run_times)
+            completed_last_minute = sum(1 for at in self._completed_at if at > now - 60)
+
+        stats["workers"] = self.workers
+        stats["type_limits"] = self.type_limits
+        stats["throughput_per_minute"] = completed_last_minute
+        stats["run_time"] = {
+            name: round(run_times[min(len(run_times) - 1, int(len(run_times) * q))], 3)
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+            if run_times
+        }
+        return stats
+
+    def publish_stats(self):
+        """
+        Write this scheduler's statistics to SchedulerStats, and drop the rows
+        of schedulers that stopped publishing a day ago.
+        """
+        now = time.time()
+        with pool.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO SchedulerStats (owner, stats, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (owner) DO UPDATE SET stats = excluded.stats, updated_at = excluded.updated_at
+                """,
+                (self.owner, json.dumps(self.stats()), now),
+            )
+            conn.execute(
+                "DELETE FROM SchedulerStats WHERE updated_at < ?", (now - 86400,)
+            )
+            conn.commit()
+
+
+def published_stats(conn):
+    """
+    The statistics of the schedulers that published recently, from any
+    process, with their owner and the age of the figures in seconds.
+    """
+    now = time.time()
+    rows = conn.execute(
+        "SELECT owner, stats, updated_at FROM SchedulerStats WHERE updated_at >= ? ORDER BY owner",
+        (now - 3 * SCHEDULER_STATS_INTERVAL,),
+    ).fetchall()
+    return [
+        {
+            "owner": row["owner"],
+            "age": round(now - row["updated_at"], 1),
+            **json.loads(row["stats"]),
+        }
+        for row in rows
+    ]
+
+
+scheduler = None
+
+
+def start_scheduler():
+    global scheduler
+    if scheduler is None or not scheduler.is_alive():
+        scheduler = ClaimScheduler()
+        scheduler.start()
+    return scheduler
+
+
+def get_scheduler():
+    return scheduler
+
+
+def notify_scheduler():
+    if scheduler is not None:
+        scheduler.notify()
+
+
+if __name__ == "__main__":
+    start_log_listener()
+    running = start_scheduler()
+    while running.is_alive():
+        running.join(60)
+        log.info("%s", json.dumps(running.stats()))
@@ -0,0 +1,122 @@
+"""
+Serve one of the APIs with gunicorn, for production use instead of the
+Werkzeug development server the modules start when run directly.
+
+    python serve.py customer
+    python serve.py agent
+
+Each worker process runs WEB_THREADS request threads; the app is imported
+once in the master and forked into the workers. Send SIGHUP to the master to
+replace the workers gracefully (finishing in-flight requests first). With
+WEB_PRELOAD=true, HUP keeps the preloaded code; deploy new code with SIGUSR2
+followed by SIGQUIT to the old master, or run with WEB_PRELOAD=false.
+
+The claim scheduler is not started in the workers, since its concurrency
+limits are per process; run it alongside with `python scheduler.py`.
+Metrics at /metrics and /system/metrics are those of the worker that
+answers the request.
+"""
+
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+# 0 sizes the worker count from the number of CPUs
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))
+WEB_PRELOAD = os.getenv("WEB_PRELOAD", "true").lower() == "true"
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "5"))
+WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", "60"))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+# Restart a worker after this many requests (plus jitter); 0 never restarts
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+WEB_LIMIT_REQUEST_LINE = int(os.getenv("WEB_LIMIT_REQUEST_LINE", "4094"))
+WEB_LIMIT_REQUEST_FIELDS = int(os.getenv("WEB_LIMIT_REQUEST_FIELDS", "100"))
+WEB_LIMIT_REQUEST_FIELD_SIZE = int(os.getenv("WEB_LIMIT_REQUEST_FIELD_SIZE", "8190"))
+WEB_PIDFILE = os.getenv("WEB_PIDFILE", "")
+
+APPS = {
+    "customer": {
+        "module": "customer_api",
+        "bind": os.getenv("CUSTOMER_API_BIND", "127.0.0.1:5000"),
+    },
+    "agent": {
+        "module": "agent_api",
+        "bind": os.getenv("AGENT_API_BIND", "0.0.0.0:5100"),
+    },
+}
+
+
+def default_workers():
+    # Request threads cover I/O waits; one process per core covers the CPU
+    # bound parts (JSON, password hashing) that threads serialize on the GIL
+    return max(2, os.cpu_count() or 1)
+
+
+def post_fork(server, worker):
+    # Threads do not survive fork(), so background services start per worker
+    from db import start_checkpointer
+    from metrics import start_log_listener
+
+    start_log_listener()
+    start_checkpointer()
+    if server.app.name == "agent":
+        from changes import start_change_pruner
+
+        start_change_pruner()
+    if server.app.name == "customer":
+        # Outbox rows are leased, so each worker can run a dispatcher
+        from dispatch import start_dispatcher
+
+        start_dispatcher()
+
+
+class APIApplication(BaseApplication):
+    def __init__(self, name, options=None):
+        self.name = name
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key.lower(), value)
+
+    def load(self):
+        module = __import__(APPS[self.name]["module"])
+        return module.app
+
+
+def options_for(name):
+    return {
+        "bind": APPS[name]["bind"],
+        "workers": WEB_WORKERS or default_workers(),
+        "worker_class": "gthread",
+        "threads": WEB_THREADS,
+        "preload_app": WEB_PRELOAD,
+        "keepalive": WEB_KEEPALIVE,
+        "timeout": WEB_TIMEOUT,
+        "graceful_timeout": WEB_GRACEFUL_TIMEOUT,
+        "max_requests": WEB_MAX_REQUESTS,
+        "max_requests_jitter": WEB_MAX_REQUESTS // 10,
+        "limit_request_line": WEB_LIMIT_REQUEST_LINE,
+        "limit_request_fields": WEB_LIMIT_REQUEST_FIELDS,
+        "limit_request_field_size": WEB_LIMIT_REQUEST_FIELD_SIZE,
+        "pidfile": WEB_PIDFILE or None,
+        "proc_name": f"insurance-{name}-api",
+        "post_fork": post_fork,
+        "accesslog": "-" if os.getenv("WEB_ACCESS_LOG", "false") == "true" else None,
+    }
+
+
+def main(argv):
+    if len(argv) != 1 or argv[0] not in APPS:
+        print(f"Usage: python serve.py {{{'|'.join(APPS)}}}")
+        return 2
+    APIApplication(argv[0], options_for(argv[0])).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,8 +2,12 @@ $!/bin/sh
 
 python migrate.py
 
-python agent_api.py &
-python customer_api.py &
+# Development servers instead: python agent_api.py / python customer_api.py
+python serve.py agent &
+python serve.py customer &
+if [ "$CLAIM_SCHEDULER_ENABLED" = "true" ]; then
+    python scheduler.py &
+fi
 
 cd agent-frontend
 pnpm start &
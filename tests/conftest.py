@@ -0,0 +1,131 @@
+"""
+Point every module at a scratch database and invoice store before any of
+them is imported, since they read their settings at import time.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+
+import pytest
+
+SCRATCH = tempfile.mkdtemp(prefix="claims-tests-")
+os.environ["DATABASE"] = os.path.join(SCRATCH, "insurance.db")
+os.environ["UPLOAD_FOLDER"] = os.path.join(SCRATCH, "uploads") + "/"
+os.environ["ADMIN_PASSWORD"] = "admin-password"
+os.environ["PASSWORD_SCRYPT_N"] = "1024"
+
+
+@pytest.fixture(scope="session")
+def database():
+    import migrate
+
+    migrate.create_tables()
+    migrate.run_migrations()
+    migrate.seed_database()
+    return os.environ["DATABASE"]
+
+
+@pytest.fixture
+def agent_client(database):
+    from agent_api import app
+
+    client = app.test_client()
+    response = client.post(
+        "/login", json={"username": "admin", "password": "admin-password"}
+    )
+    client.environ_base["HTTP_AUTHORIZATION"] = (
+        f"Bearer {response.json['access_token']}"
+    )
+    return client
+
+
+@pytest.fixture
+def customer_admin_client(database):
+    from customer_api import app
+
+    client = app.test_client()
+    response = client.post(
+        "/users/login", json={"username": "admin", "password": "admin-password"}
+    )
+    client.environ_base["HTTP_AUTHORIZATION"] = (
+        f"Bearer {response.json['access_token']}"
+    )
+    return client
+
+
+@pytest.fixture
+def customer(database):
+    """
+    A signed-up customer's test client, user id and the number of their
+    Windscreen policy, which has a vehicle.
+    """
+    import uuid
+
+    from customer_api import app
+
+    client = app.test_client()
+    username = f"user-{uuid.uuid4().hex[:8]}"
+    user = client.post(
+        "/users/",
+        json={
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "username": username,
+            "password": "password",
+            "email": f"{username}@example.com",
+            "phone": "555",
+        },
+    ).json
+    token = client.post(
+        "/users/login", json={"username": username, "password": "password"}
+    ).json["access_token"]
+    client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    policy_number = f"P-{username}"
+    client.post(
+        f"/users/{user['id']}/policies",
+        json={"type": "Windscreen", "policy_number": policy_number, "deductible": 100},
+    )
+    client.post(
+        f"/users/{user['id']}/policies/{policy_number}/vehicles",
+        json={"make": "Volvo", "model": "V70", "year": 2015},
+    )
+    return client, user["id"], policy_number
+
+
+@pytest.fixture
+def claim(database, customer):
+    """A fresh claim on the customer's policy, filed through the customer API."""
+    import io
+    import uuid
+
+    client, user_id, policy_number = customer
+    response = client.post(
+        f"/users/{user_id}/policies/{policy_number}/claims",
+        data={
+            "claim_date": "2024-05-10",
+            "damage_date": "2024-05-01",
+            "date_of_repair": "2024-05-05",
+            "invoice": (io.BytesIO(uuid.uuid4().bytes), "invoice.pdf"),
+        },
+        content_type="multipart/form-data",
+    )
+    response.close()
+    claim_id = response.json["id"]
+    # Let the background extraction finish before the test and its teardown
+    from extraction import get_extraction
+
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    sha256 = conn.execute(
+        "SELECT invoice_sha256 FROM Claims WHERE id = ?", (claim_id,)
+    ).fetchone()[0]
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        row = get_extraction(conn, sha256)
+        if row is not None and row["status"] != "Pending":
+            break
+        time.sleep(0.05)
+    conn.close()
+    return claim_id
@@ -0,0 +1,53 @@
+def test_evaluate_rejects_line_items_that_are_not_an_object(agent_client):
+    response = agent_client.post(
+        "/claims/1/checks/evaluate", json={"line_items": [{"labor": 120}]}
+    )
+    assert response.status_code == 400
+    assert "line_items" in response.json["message"]
+
+
+def test_evaluate_of_unknown_claim_is_not_found(agent_client):
+    response = agent_client.post(
+        "/claims/999999/checks/evaluate", json={"line_items": {"labor": 120}}
+    )
+    assert response.status_code == 404
+
+
+def count_checks(claim_id):
+    from db import pool
+
+    with pool.connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM ClaimsProcessingChecks WHERE claim_id = ?",
+            (claim_id,),
+        ).fetchone()[0]
+
+
+def test_repeated_reviewing_transition_creates_checks_once(agent_client, claim):
+    first = agent_client.put(f"/claims/{claim}", json={"internal_status": "Reviewing"})
+    assert first.status_code == 200
+    checks = count_checks(claim)
+    assert checks > 0
+
+    second = agent_client.put(f"/claims/{claim}", json={"internal_status": "Reviewing"})
+    assert second.status_code == 200
+    assert count_checks(claim) == checks
+
+
+def test_idempotency_key_replays_the_first_response(agent_client, claim):
+    headers = {"Idempotency-Key": f"review-{claim}"}
+    body = {"internal_status": "Reviewing"}
+    first = agent_client.put(f"/claims/{claim}", json=body, headers=headers)
+    replay = agent_client.put(f"/claims/{claim}", json=body, headers=headers)
+    assert replay.status_code == first.status_code
+    assert replay.json == first.json
+
+    conflict = agent_client.put(
+        f"/claims/{claim}", json={"internal_status": "Approved"}, headers=headers
+    )
+    assert conflict.status_code == 422
+
+
+def test_batch_check_update_rejects_a_body_that_is_not_an_object(agent_client):
+    response = agent_client.patch("/claims/1/checks", json=[1])
+    assert response.status_code == 400
@@ -0,0 +1,40 @@
+from flask import Flask
+from flask_jwt_extended import create_access_token, decode_token
+
+from auth import CachingJWTManager
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "test-secret"
+    return app, CachingJWTManager(app, cache_size=8)
+
+
+def test_cached_claims_are_not_shared_between_requests():
+    app, jwt = make_app()
+    with app.app_context():
+        token = create_access_token(identity={"id": 2, "username": "jane"})
+        first = decode_token(token)
+        first["sub"]["username"] = "admin"
+        first["extra"] = True
+        second = decode_token(token)
+        second["sub"]["id"] = 1
+        third = decode_token(token)
+
+    assert third["sub"] == {"id": 2, "username": "jane"}
+    assert "extra" not in third
+    assert jwt.cache_stats()["hits"] == 2
+
+
+def test_unsupported_library_release_disables_the_cache(monkeypatch):
+    import flask_jwt_extended
+
+    monkeypatch.setattr(flask_jwt_extended, "__version__", "5.0.0")
+    app, jwt = make_app()
+    with app.app_context():
+        token = create_access_token(identity={"id": 2, "username": "jane"})
+        decode_token(token)
+        decode_token(token)
+
+    assert jwt.cache_stats()["hits"] == 0
+    assert jwt.cache_stats()["size"] == 0
@@ -0,0 +1,96 @@
+import sqlite3
+
+import pytest
+
+from db import pool
+from changes import is_pruned, latest_seq, prune_changes, stream_changes
+
+
+@pytest.fixture
+def conn(database):
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    conn.execute("DELETE FROM ClaimChanges")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def add_change(conn, age_days):
+    conn.execute(
+        "INSERT INTO ClaimChanges (entity, entity_id, claim_id, payload, created_at) VALUES ('claim', 1, 1, '{}', datetime('now', ?))",
+        (f"-{age_days} days",),
+    )
+    conn.commit()
+    return latest_seq(conn)
+
+
+def test_prune_keeps_recent_changes(conn):
+    old = [add_change(conn, 30) for _ in range(3)]
+    recent = [add_change(conn, 1) for _ in range(2)]
+
+    assert prune_changes(conn, retention_days=7) == 3
+    kept = [row["seq"] for row in conn.execute("SELECT seq FROM ClaimChanges")]
+    assert kept == recent
+    assert is_pruned(conn, old[0])
+    assert not is_pruned(conn, old[-1])
+    assert not is_pruned(conn, recent[-1])
+
+
+def test_prune_everything_still_detects_stale_cursors(conn):
+    seqs = [add_change(conn, 30) for _ in range(2)]
+
+    assert prune_changes(conn, retention_days=7) == 2
+    assert is_pruned(conn, seqs[0])
+    assert not is_pruned(conn, seqs[-1])
+    # New changes keep counting from where the feed was
+    assert add_change(conn, 0) == seqs[-1] + 1
+
+
+def test_changes_endpoint_asks_stale_clients_to_resync(conn, agent_client):
+    first = add_change(conn, 30)
+    last = add_change(conn, 1)
+    prune_changes(conn, retention_days=7)
+
+    response = agent_client.get(f"/changes?since={first - 1}")
+    assert response.status_code == 410
+    assert response.json["resync"] is True
+    assert response.json["cursor"] == last
+
+    response = agent_client.get(f"/changes?since={first}")
+    assert response.status_code == 200
+    assert [change["seq"] for change in response.json["changes"]] == [last]
+
+
+def test_stream_ends_after_max_age_with_the_resume_position(database):
+    events = list(stream_changes(41, max_age=0))
+    assert events == ["retry: 3000\n\n", "id: 41\n\n"]
+
+
+@pytest.mark.parametrize("name", ["since", "wait", "limit"])
+def test_changes_endpoint_rejects_malformed_parameters(agent_client, name):
+    args = {"since": "0", name: "abc"}
+    response = agent_client.get("/changes", query_string=args)
+    assert response.status_code == 400
+    assert name in response.json["message"]
+
+
+def test_long_poll_does_not_hold_a_connection_while_waiting(conn, agent_client):
+    since = add_change(conn, 0)
+    in_use = []
+    real_acquire = pool.acquire
+
+    def acquire(*args, **kwargs):
+        in_use.append(pool.stats()["in_use"])
+        return real_acquire(*args, **kwargs)
+
+    pool.acquire = acquire
+    try:
+        response = agent_client.get(f"/changes?since={since}&wait=0.3")
+    finally:
+        pool.acquire = real_acquire
+
+    assert response.status_code == 200
+    assert response.json["changes"] == []
+    # The pre-checks and every poll each take the only connection in use
+    assert len(in_use) > 2 and max(in_use) == 0
@@ -0,0 +1,109 @@
+import pytest
+
+from checks import evaluate_check, parse_amount
+
+
+def check(expected_value, operator=None, subject=None):
+    return {"expected_value": expected_value, "operator": operator, "subject": subject}
+
+
+LABOR = check("50 <= cost <= 200", "<=", "line_items.labor")
+SENSOR = check("0 <= cost <= 40 or not present", "<=", "line_items.sensor")
+TOTAL = check("1200", "<=", "invoice_total")
+
+
+@pytest.mark.parametrize(
+    "value, amount",
+    [
+        (120, 120.0),
+        (99.5, 99.5),
+        ("120", 120.0),
+        (" 120.50 ", 120.5),
+        ("$120.50", 120.5),
+        ("-3", -3.0),
+    ],
+)
+def test_parse_amount_reads_plain_decimals(value, amount):
+    assert parse_amount(value) == amount
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "1.234,00",
+        "1,234.00",
+        "1,234",
+        "12a",
+        "",
+        "1.2.3",
+        None,
+        True,
+        float("nan"),
+        [1],
+    ],
+)
+def test_parse_amount_rejects_unclear_values(value):
+    assert parse_amount(value) is None
+
+
+def test_cost_range_passes_and_fails():
+    assert evaluate_check(LABOR, {"line_items": {"labor": 120}})[0] == "Passed"
+    assert evaluate_check(LABOR, {"line_items": {"labor": [120, 250]}})[0] == "Failed"
+
+
+def test_cost_range_optional_item_missing_passes():
+    status, reviewed, _ = evaluate_check(SENSOR, {"line_items": {"labor": 120}})
+    assert (status, reviewed) == ("Passed", "not present")
+
+
+def test_cost_range_required_item_missing_needs_review():
+    assert evaluate_check(LABOR, {"line_items": {}}) is None
+    assert evaluate_check(LABOR, {}) is None
+
+
+@pytest.mark.parametrize("line_items", [[{"labor": 120}], "labor 120", 120])
+def test_cost_range_with_malformed_line_items_needs_review(line_items):
+    assert evaluate_check(LABOR, {"line_items": line_items}) is None
+
+
+def test_cost_range_with_unclear_amount_needs_review():
+    assert evaluate_check(LABOR, {"line_items": {"labor": "1.234,00"}}) is None
+
+
+def test_unclear_total_does_not_pass():
+    assert evaluate_check(TOTAL, {"invoice_total": "1.234,00"}) is None
+    assert evaluate_check(TOTAL, {"invoice_total": "1234"})[0] == "Failed"
+    assert evaluate_check(TOTAL, {"invoice_total": 800})[0] == "Passed"
+
+
+def test_in_and_equality_compare_normalized_text():
+    plate = check("AB12 CDE", "IN", "invoice_text")
+    assert evaluate_check(plate, {"invoice_text": "Plate: ab12-cde"})[0] == "Passed"
+    assert evaluate_check(plate, {"invoice_text": "Plate: XY99"})[0] == "Failed"
+    name = check("Jane Doe", "=", "invoice_customer_name")
+    assert evaluate_check(name, {"invoice_customer_name": "JANE DOE"})[0] == "Passed"
+
+
+@pytest.mark.parametrize("operator", ["IN", "="])
+@pytest.mark.parametrize("expected", ["", " ", "--"])
+def test_empty_expected_value_is_not_a_pass(operator, expected):
+    rule = check(expected, operator, "invoice_text")
+    assert evaluate_check(rule, {"invoice_text": "anything"}) is None
+
+
+def test_date_comparisons():
+    before = check("damage_date < claim_date", "<")
+    facts = {"damage_date": "2024-05-01", "claim_date": "2024-05-10"}
+    assert evaluate_check(before, facts)[0] == "Passed"
+    facts["damage_date"] = "2024-05-11"
+    assert evaluate_check(before, facts)[0] == "Failed"
+    assert evaluate_check(before, {"claim_date": "2024-05-10"}) is None
+
+    delta = check("delta between date_of_repair and invoice_date <= 14", "<=")
+    facts = {"date_of_repair": "2024-05-01", "invoice_date": "2024-05-20"}
+    status, reviewed, _ = evaluate_check(delta, facts)
+    assert (status, reviewed) == ("Failed", "19 days")
+
+
+def test_check_without_expected_value_needs_review():
+    assert evaluate_check(check(None, "="), {}) is None
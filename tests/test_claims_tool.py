@@ -0,0 +1,144 @@
+import json
+import sqlite3
+import uuid
+
+import pytest
+
+import claims_tool
+
+
+@pytest.fixture
+def policy_number(database):
+    number = f"P-{uuid.uuid4().hex[:10]}"
+    conn = sqlite3.connect(database)
+    user_id = conn.execute(
+        "INSERT INTO User (first_name, last_name) VALUES ('Jane', 'Doe')"
+    ).lastrowid
+    conn.execute(
+        "INSERT INTO Policy (type, user_id, policy_number) VALUES ('Windscreen', ?, ?)",
+        (user_id, number),
+    )
+    conn.commit()
+    conn.close()
+    return number
+
+
+@pytest.fixture
+def invoices(tmp_path):
+    directory = tmp_path / "invoices"
+    directory.mkdir()
+    for i in range(10):
+        (directory / f"{i}.pdf").write_bytes(b"%%PDF-1.4 invoice %d" % i)
+    return directory
+
+
+def record(policy_number, invoice, **fields):
+    return {
+        "policy_number": policy_number,
+        "claim_date": "2024-05-10",
+        "damage_date": "2024-05-01",
+        "date_of_repair": "2024-05-05",
+        "invoice": invoice,
+        "internal_status": "Approved",
+        "status": "Approved",
+        **fields,
+    }
+
+
+def imported(database, policy_number):
+    conn = sqlite3.connect(database)
+    rows = conn.execute(
+        "SELECT c.invoice_filename FROM Claims c JOIN Policy p ON p.id = c.policy_id WHERE p.policy_number = ? ORDER BY c.id",
+        (policy_number,),
+    ).fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def checkpoint(database, name):
+    conn = sqlite3.connect(database)
+    row = conn.execute(
+        "SELECT position, imported, rejected FROM ImportCheckpoints WHERE name = ?",
+        (name,),
+    ).fetchone()
+    conn.close()
+    return row
+
+
+def run_import(source, invoices, name, *extra):
+    return claims_tool.main(
+        ["import", str(source), "--invoices", str(invoices), "--name", name, *extra]
+    )
+
+
+def test_malformed_lines_are_rejected_and_the_import_goes_on(
+    database, policy_number, invoices, tmp_path
+):
+    source = tmp_path / "claims.jsonl"
+    with open(source, "wb") as f:
+        f.write(json.dumps(record(policy_number, "0.pdf")).encode() + b"\n")
+        f.write(b'{"policy_number": "truncated\n')
+        f.write(b"[1, 2, 3]\n")
+        f.write(b'{"invoice": "\xff\xfe.pdf"}\n')
+        f.write(json.dumps(record(policy_number, "1.pdf", status=["x"])).encode())
+        f.write(b"\n\n")
+        f.write(json.dumps(record(policy_number, "2.pdf")).encode() + b"\n")
+
+    run_import(source, invoices, "malformed", "--batch-size", "2")
+
+    assert imported(database, policy_number) == ["0.pdf", "2.pdf"]
+    assert checkpoint(database, "malformed") == (6, 2, 4)
+
+
+def test_csv_rows_that_cannot_be_read_are_rejected(
+    database, policy_number, invoices, tmp_path
+):
+    source = tmp_path / "claims.csv"
+    header = "policy_number,claim_date,damage_date,date_of_repair,invoice,status"
+    row = f"{policy_number},2024-05-10,2024-05-01,2024-05-05,{{}},Approved"
+    source.write_bytes(
+        "\n".join(
+            [header, row.format("0.pdf"), row.format("1.pdf") + ",extra", ""]
+        ).encode()
+        + row.format("\xe9.pdf").encode("latin-1")
+        + b"\n"
+        + row.format("3.pdf").encode()
+        + b"\n"
+    )
+
+    run_import(source, invoices, "csv")
+
+    assert imported(database, policy_number) == ["0.pdf", "3.pdf"]
+    assert checkpoint(database, "csv") == (4, 2, 2)
+
+
+def test_interrupted_import_resumes_after_the_last_committed_batch(
+    database, policy_number, invoices, tmp_path, monkeypatch
+):
+    source = tmp_path / "claims.jsonl"
+    source.write_text(
+        "".join(json.dumps(record(policy_number, f"{i}.pdf")) + "\n" for i in range(7))
+    )
+    commit_batch = claims_tool.ClaimImporter.commit_batch
+    batches = []
+
+    def failing_commit_batch(self, *args):
+        if len(batches) == 2:
+            raise KeyboardInterrupt
+        batches.append(args)
+        return commit_batch(self, *args)
+
+    monkeypatch.setattr(claims_tool.ClaimImporter, "commit_batch", failing_commit_batch)
+    with pytest.raises(KeyboardInterrupt):
+        run_import(source, invoices, "resume", "--batch-size", "2")
+    assert imported(database, policy_number) == ["0.pdf", "1.pdf", "2.pdf", "3.pdf"]
+    assert checkpoint(database, "resume") == (4, 4, 0)
+
+    monkeypatch.setattr(claims_tool.ClaimImporter, "commit_batch", commit_batch)
+    run_import(source, invoices, "resume", "--batch-size", "2")
+    assert imported(database, policy_number) == [f"{i}.pdf" for i in range(7)]
+    assert checkpoint(database, "resume") == (7, 7, 0)
+
+    # Nothing left to do on another run
+    run_import(source, invoices, "resume", "--batch-size", "2")
+    assert imported(database, policy_number) == [f"{i}.pdf" for i in range(7)]
@@ -0,0 +1,26 @@
+import io
+
+import customer_api
+
+
+def test_failed_invoice_save_is_logged_and_reported(customer, monkeypatch, caplog):
+    client, user_id, policy_number = customer
+
+    def save(file):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(customer_api.invoice_store, "save", save)
+    response = client.post(
+        f"/users/{user_id}/policies/{policy_number}/claims",
+        data={
+            "claim_date": "2024-05-10",
+            "damage_date": "2024-05-01",
+            "date_of_repair": "2024-05-05",
+            "invoice": (io.BytesIO(b"invoice"), "invoice.pdf"),
+        },
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 500
+    (record,) = [r for r in caplog.records if r.name == "customer_api"]
+    assert record.message.startswith("Error filing a claim")
+    assert "disk full" in str(record.exc_info[1])
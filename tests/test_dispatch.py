@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+import dispatch
+from db import pool
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = f"status {status_code}"
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise dispatch.requests.HTTPError(self.text)
+
+
+class FakeSession:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.posts = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.posts += 1
+        return FakeResponse(self.status_code)
+
+
+@pytest.fixture
+def outbox(database):
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM ClaimDispatchOutbox")
+        claim_id = conn.execute("SELECT MIN(id) FROM Claims").fetchone()[0] or 1
+        dispatch.enqueue_claim_dispatch(conn, claim_id)
+        conn.commit()
+    yield
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM ClaimDispatchOutbox")
+        conn.commit()
+
+
+def drain_once(dispatcher):
+    for row in dispatcher.lease_due():
+        dispatcher.send(row)
+    with pool.connection() as conn:
+        return conn.execute(
+            "SELECT status, attempts, next_attempt_at, last_error FROM ClaimDispatchOutbox"
+        ).fetchone()
+
+
+def make_due():
+    with pool.connection() as conn:
+        conn.execute("UPDATE ClaimDispatchOutbox SET next_attempt_at = 0")
+        conn.commit()
+
+
+def test_transient_failures_back_off_then_dead_letter(outbox):
+    dispatcher = dispatch.ClaimDispatcher(concurrency=1, max_attempts=3)
+    dispatcher.session = FakeSession(503)
+
+    before = time.time()
+    row = drain_once(dispatcher)
+    assert row["status"] == "Pending"
+    assert row["attempts"] == 1
+    assert row["next_attempt_at"] > before
+    assert "503" in row["last_error"]
+
+    # Not due yet, so nothing is leased
+    assert dispatcher.lease_due() == []
+
+    make_due()
+    assert drain_once(dispatcher)["status"] == "Pending"
+    make_due()
+    row = drain_once(dispatcher)
+    assert row["status"] == "Dead"
+    assert row["attempts"] == 3
+    assert dispatcher.session.posts == 3
+    assert dispatcher.stats()["dead"] == 1
+
+
+def test_client_errors_dead_letter_without_retry(outbox):
+    dispatcher = dispatch.ClaimDispatcher(concurrency=1, max_attempts=5)
+    dispatcher.session = FakeSession(404)
+
+    row = drain_once(dispatcher)
+    assert row["status"] == "Dead"
+    assert row["attempts"] == 1
+
+
+def test_requeue_dead_resets_attempts(outbox):
+    dispatcher = dispatch.ClaimDispatcher(concurrency=1, max_attempts=1)
+    dispatcher.session = FakeSession(500)
+    assert drain_once(dispatcher)["status"] == "Dead"
+
+    with pool.connection() as conn:
+        assert dispatch.requeue_dead(conn) == 1
+    dispatcher.session = FakeSession(202)
+    row = drain_once(dispatcher)
+    assert row["status"] == "Sent"
+    assert row["attempts"] == 1
+    assert row["last_error"] is None
+
+
+def test_backoff_delay_is_capped():
+    assert dispatch.backoff_delay(1) <= dispatch.DISPATCH_BACKOFF_BASE
+    assert dispatch.backoff_delay(50) <= dispatch.DISPATCH_BACKOFF_MAX
+    assert dispatch.backoff_delay(50) >= dispatch.DISPATCH_BACKOFF_MAX / 2
@@ -0,0 +1,123 @@
+import io
+import sqlite3
+import time
+import uuid
+
+from db import pool
+import pytest
+
+from checks import evaluate_check
+from extraction import get_extraction, parse_invoice_fields
+
+
+def wait_for_extraction(database, sha256, timeout=10):
+    # Polls outside the pool, whose use the test observes
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        row = get_extraction(conn, sha256)
+        if row is not None and row["status"] != "Pending":
+            break
+        time.sleep(0.05)
+    conn.close()
+    return row
+
+
+def test_claim_upload_extracts_after_the_request_connection_is_released(database):
+    from customer_api import app
+
+    client = app.test_client()
+    username = f"user-{uuid.uuid4().hex[:8]}"
+    user = client.post(
+        "/users/",
+        json={
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "username": username,
+            "password": "password",
+            "email": f"{username}@example.com",
+            "phone": "555",
+        },
+    ).json
+    token = client.post(
+        "/users/login", json={"username": username, "password": "password"}
+    ).json["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    policy_number = f"P-{username}"
+    client.post(
+        f"/users/{user['id']}/policies",
+        json={"type": "Windscreen", "policy_number": policy_number, "deductible": 100},
+        headers=headers,
+    )
+
+    in_use = []
+    real_acquire = pool.acquire
+
+    def acquire(*args, **kwargs):
+        in_use.append(pool.stats()["in_use"])
+        return real_acquire(*args, **kwargs)
+
+    pool.acquire = acquire
+    try:
+        response = client.post(
+            f"/users/{user['id']}/policies/{policy_number}/claims",
+            data={
+                "claim_date": "2024-05-10",
+                "damage_date": "2024-05-01",
+                "date_of_repair": "2024-05-05",
+                "invoice": (io.BytesIO(uuid.uuid4().bytes), "invoice.pdf"),
+            },
+            headers=headers,
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 201
+        assert max(in_use) == 0
+        # The WSGI server closes the response after sending it, once the
+        # request's connection went back to the pool
+        response.close()
+        with sqlite3.connect(database) as conn:
+            sha256 = conn.execute(
+                "SELECT invoice_sha256 FROM Claims WHERE id = ?",
+                (response.json["id"],),
+            ).fetchone()[0]
+        row = wait_for_extraction(database, sha256)
+    finally:
+        pool.acquire = real_acquire
+
+    # Neither the request nor the extraction waited for a connection while
+    # holding another
+    assert len(in_use) == 2 and max(in_use) == 0
+    assert row["status"] in ("Extracted", "NoText", "Failed")
+
+
+@pytest.mark.parametrize(
+    "text, total",
+    [
+        ("Total: $1,234.00", 1234.0),
+        ("Subtotal: 1000.00\nTotal due: 1,150.50", 1150.5),
+        ("Total: 1.234,00", None),
+        ("Total: 1234,50", None),
+        ("Total: 1.5", None),
+    ],
+)
+def test_invoice_total_with_ambiguous_separators_is_left_out(text, total):
+    assert parse_invoice_fields(text).get("invoice_total") == total
+
+
+def test_european_line_items_are_left_to_a_reviewer():
+    fields = parse_invoice_fields(
+        "Labour 2 hrs 1.234,00\nUrethane adhesive 45.00\nTotal: 1.279,00"
+    )
+    assert "invoice_total" not in fields
+    assert fields["line_items"] == {"labor": ["1.234,00"], "adhesive": [45.0]}
+
+
+def test_checks_on_european_amounts_stay_pending():
+    facts = parse_invoice_fields("Labour 1.234,00\nTotal: 1.234,00")
+    for subject, operator, expected in [
+        ("invoice_total", "<=", "1200"),
+        ("line_items.labor", "IN", "0 <= cost <= 100 or not present"),
+    ]:
+        check = {"subject": subject, "operator": operator, "expected_value": expected}
+        assert evaluate_check(check, facts) is None
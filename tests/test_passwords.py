@@ -0,0 +1,61 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from passwords import HasherBusy, HashingPool, hash_password, verify_password
+
+
+@pytest.mark.parametrize(
+    "encoded",
+    ["scrypt$1024$8", "scrypt$x$8$1$c2FsdA$a2V5", "pbkdf2_sha256$1$!!!$a2V5"],
+)
+def test_malformed_hashes_do_not_verify(encoded):
+    assert verify_password("password", encoded) is False
+
+
+def test_current_hashes_verify():
+    encoded = hash_password("password")
+    assert verify_password("password", encoded)
+    assert not verify_password("wrong", encoded)
+
+
+def test_saturated_pool_turns_callers_away_at_once():
+    pool = HashingPool(workers=1, queue_size=0)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    worker = threading.Thread(target=pool.run, args=(slow,))
+    worker.start()
+    started.wait(5)
+    try:
+        begin = time.monotonic()
+        with pytest.raises(HasherBusy):
+            pool.run(lambda: None)
+        assert time.monotonic() - begin < 0.5
+    finally:
+        release.set()
+        worker.join()
+    assert pool.stats()["rejected"] == 1
+
+
+def test_login_with_a_malformed_stored_hash_is_refused(database):
+    from customer_api import app
+    from db import pool
+
+    username = f"user-{uuid.uuid4().hex[:8]}"
+    with pool.connection() as conn:
+        conn.execute(
+            "INSERT INTO User (first_name, last_name, phone, email, username, password) VALUES ('A', 'B', '555', ?, ?, 'scrypt$broken')",
+            (f"{username}@example.com", username),
+        )
+        conn.commit()
+
+    response = app.test_client().post(
+        "/users/login", json={"username": username, "password": "password"}
+    )
+    assert response.status_code == 401
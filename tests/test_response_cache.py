@@ -0,0 +1,54 @@
+from response_cache import GenerationTable, ResponseCache
+
+
+def make_cache(path, **kwargs):
+    return ResponseCache(GenerationTable(str(path)), **kwargs)
+
+
+def test_invalidate_drops_the_entry(tmp_path):
+    cache = make_cache(tmp_path / "generations")
+    key = (1, None)
+    cache.put(key, cache.generations.get(key), b"[]")
+    assert cache.get(key).body == b"[]"
+
+    cache.invalidate(key)
+    assert cache.get(key) is None
+
+
+def test_write_in_another_process_invalidates_through_the_shared_table(tmp_path):
+    path = tmp_path / "generations"
+    reader = make_cache(path)
+    writer = make_cache(path)
+    key = (1, "POL-1")
+    reader.put(key, reader.generations.get(key), b"{}")
+
+    writer.invalidate(key)
+    assert reader.get(key) is None
+    assert reader.stats()["stale"] == 1
+
+
+def test_put_after_a_concurrent_write_is_already_stale(tmp_path):
+    cache = make_cache(tmp_path / "generations")
+    key = (2, None)
+    generation = cache.generations.get(key)
+    # A write lands between reading the database and storing the response
+    cache.invalidate(key)
+    cache.put(key, generation, b"[]")
+    assert cache.get(key) is None
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = make_cache(tmp_path / "generations", ttl=0)
+    key = (3, None)
+    cache.put(key, cache.generations.get(key), b"[]")
+    assert cache.get(key) is None
+
+
+def test_byte_bound_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path / "generations", max_bytes=10)
+    for user_id in range(3):
+        key = (user_id, None)
+        cache.put(key, cache.generations.get(key), b"12345")
+    assert cache.get((0, None)) is None
+    assert cache.get((2, None)) is not None
+    assert cache.stats()["bytes"] <= 10
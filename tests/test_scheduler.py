@@ -0,0 +1,29 @@
+import sqlite3
+import time
+
+from scheduler import ClaimScheduler
+
+
+def test_scheduler_statistics_reach_the_api(database, customer_admin_client):
+    conn = sqlite3.connect(database)
+    conn.execute("DELETE FROM SchedulerStats")
+    conn.commit()
+    assert customer_admin_client.get("/system/scheduler").status_code == 404
+
+    scheduler = ClaimScheduler(workers=3, type_limits={"Windscreen": 2})
+    scheduler.publish_stats()
+    # A scheduler that stopped publishing long ago is not reported
+    conn.execute(
+        "INSERT INTO SchedulerStats (owner, stats, updated_at) VALUES ('gone', '{}', ?)",
+        (time.time() - 3600,),
+    )
+    conn.commit()
+    conn.close()
+
+    response = customer_admin_client.get("/system/scheduler")
+    assert response.status_code == 200
+    [stats] = response.json["schedulers"]
+    assert stats["owner"] == scheduler.owner
+    assert stats["workers"] == 3
+    assert stats["type_limits"] == {"Windscreen": 2}
+    assert "throughput_per_minute" in stats